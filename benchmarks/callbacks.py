@@ -0,0 +1,86 @@
+"""
+Микробенчмарк диспетчеризации callback_query: цепочка F.data.startswith(...) в обычном Router
+против таблицы по префиксу в IndexedRouter. Обработчики пустые, БД не используется.
+
+    python -m benchmarks.callbacks --actions 40 --updates 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from aiogram import Dispatcher, F, Router
+from aiogram.filters.callback_data import CallbackData
+
+from benchmarks.fake_bot import callback_update, create_fake_bot
+from handlers import expenses, main_menu, projects, statistics, tasks
+from handlers.routing import IndexedRouter
+from keyboards.callbacks import ActionCallback
+
+class BenchCallback(ActionCallback, CallbackData, prefix="bench"):
+    action: str
+    id: int = 0
+
+async def _noop(callback, **kwargs):
+    return None
+
+def build_plain(actions: int, routers: int) -> Dispatcher:
+    dp = Dispatcher()
+    per_router = [Router() for _ in range(routers)]
+    for i in range(actions):
+        per_router[i % routers].callback_query.register(_noop, F.data.startswith(f"action{i}_"))
+    dp.include_routers(*per_router)
+    return dp
+
+def build_indexed(actions: int, routers: int) -> Dispatcher:
+    dp = Dispatcher()
+    per_router = [IndexedRouter() for _ in range(routers)]
+    for i in range(actions):
+        per_router[i % routers].callback_query.register(_noop, BenchCallback.on(f"action{i}"))
+    dp.include_routers(*per_router)
+    return dp
+
+async def measure(dp: Dispatcher, bot, updates) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+def app_candidates():
+    """Среднее число обработчиков, проверяемых ботом на одно нажатие, до и после индекса"""
+    observers = [r.callback_query for r in (main_menu.router, projects.router, tasks.router, expenses.router, statistics.router)]
+    keys = {key for observer in observers for key in observer._build_index() if ":" in key}
+    total = sum(len(observer.handlers) for observer in observers)
+    checked = [sum(len(observer.candidates(f"{key}:1")) for observer in observers) for key in keys]
+    return total, sum(checked) / len(checked)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--actions", type=int, default=40, help="обработчиков callback_query")
+    parser.add_argument("--routers", type=int, default=5)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    bot = create_fake_bot()
+    actions = [random.randrange(args.actions) for _ in range(args.updates)]
+    plain_updates = [callback_update(bot, 1, f"action{a}_{a}", 1) for a in actions]
+    indexed_updates = [callback_update(bot, 1, BenchCallback(action=f"action{a}", id=a).pack(), 1) for a in actions]
+
+    async def run():
+        # Прогрев, затем замер
+        plain, indexed = build_plain(args.actions, args.routers), build_indexed(args.actions, args.routers)
+        await measure(plain, bot, plain_updates[:1000])
+        await measure(indexed, bot, indexed_updates[:1000])
+        return await measure(plain, bot, plain_updates), await measure(indexed, bot, indexed_updates)
+
+    plain, indexed = asyncio.run(run())
+    print(f"обработчиков: {args.actions}, роутеров: {args.routers}, апдейтов: {args.updates}")
+    print(f"F.data.startswith: {plain * 1e6:8.1f} мкс/апдейт")
+    print(f"IndexedRouter:     {indexed * 1e6:8.1f} мкс/апдейт ({plain / indexed:.1f}x)")
+
+    total, checked = app_candidates()
+    print(f"\nбот: обработчиков callback_query {total}, проверяется на нажатие в среднем {checked:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import itertools
+import time
+from collections import defaultdict
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.enums import ParseMode
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, Update, User
+
+BOT_ID = 42
+BOT_USER = {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+class RecordingSession(BaseSession):
+    """Сессия бота, которая ничего не отправляет, а записывает вызовы API и возвращает правдоподобные ответы"""
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.calls: List[TelegramMethod] = []
+        self.last_markup: Dict[int, Any] = {}
+        self.last_message_id: Dict[int, int] = defaultdict(lambda: 1)
+        self._message_ids = itertools.count(1000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls.append(method)
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if chat_id is not None and markup is not None:
+            self.last_markup[chat_id] = markup
+
+        api_method = method.__api_method__
+        if api_method == "getMe":
+            return User.model_validate(BOT_USER)
+        if api_method.startswith("send") and chat_id is not None:
+            message_id = next(self._message_ids)
+            self.last_message_id[chat_id] = message_id
+            return self._message(bot, chat_id, message_id, getattr(method, "text", None))
+        if api_method == "editMessageText" and chat_id is not None:
+            return self._message(bot, chat_id, method.message_id, method.text)
+        return True
+
+    @staticmethod
+    def _message(bot: Bot, chat_id: int, message_id: int, text: Optional[str]) -> Message:
+        return Message.model_validate(
+            {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": text,
+            },
+            context={"bot": bot},
+        )
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+def create_fake_bot() -> Bot:
+    return Bot(
+        token=f"{BOT_ID}:BENCHMARK",
+        session=RecordingSession(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+_update_ids = itertools.count(1)
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"}
+
+def message_update(bot: Bot, user_id: int, text: str) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": next(_update_ids),
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": _user(user_id),
+                "text": text,
+            },
+        },
+        context={"bot": bot},
+    )
+
+def callback_update(bot: Bot, user_id: int, data: str, message_id: int) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": next(_update_ids),
+            "callback_query": {
+                "id": str(next(_update_ids)),
+                "from": _user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            },
+        },
+        context={"bot": bot},
+    )
+
+def inline_query_update(bot: Bot, user_id: int, query: str, offset: str = "") -> Update:
+    return Update.model_validate(
+        {
+            "update_id": next(_update_ids),
+            "inline_query": {
+                "id": str(next(_update_ids)),
+                "from": _user(user_id),
+                "query": query,
+                "offset": offset,
+            },
+        },
+        context={"bot": bot},
+    )
@@ -0,0 +1,337 @@
+"""
+Сквозной бенчмарк обработчиков: синтетические апдейты проходят через настоящие
+Dispatcher, DatabaseMiddleware и роутеры, ответы бота записываются фейковой сессией.
+
+    python -m benchmarks.handlers --users 20 --flows 3 --seed-users 1000
+    python -m benchmarks.handlers --save-baseline
+    python -m benchmarks.handlers --processes 4   # пользователи делятся между 4 процессами
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Отдельная БД и хранилище FSM в памяти - до импорта модулей бота.
+# Процессы --processes получают каталог родителя через окружение и работают с той же БД
+_tmp_dir = os.environ.get("BENCH_TMP_DIR") or tempfile.mkdtemp(prefix="bench_")
+os.environ["BENCH_TMP_DIR"] = _tmp_dir
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp_dir}/bench.db"
+os.environ["FSM_STORAGE"] = "memory"
+
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram_calendar import SimpleCalendarCallback
+from aiogram_calendar.schemas import SimpleCalAct
+from sqlalchemy import insert
+
+from benchmarks.fake_bot import callback_update, create_fake_bot, inline_query_update, message_update
+from bot import create_dispatcher, create_tables
+from keyboards.callbacks import ExpenseCallback, ProjectCallback, SkipCallback, TaskCallback
+from middlewares.query_budget import count_statements, install_query_counter
+from models import Expense, Project, ProjectStatus, ProjectType, Task
+from services.database import AsyncSessionLocal, engine
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+# Пауза между нажатиями клавиш при наборе inline-запроса
+TYPING_INTERVAL = 0.01
+
+async def seed(users: int, rows: int) -> None:
+    """Заполняет БД: у каждого пользователя rows проектов, задач и расходов"""
+    now = datetime.now()
+    statuses = list(ProjectStatus)
+    async with AsyncSessionLocal() as db:
+        for first in range(1, users + 1, 100):
+            user_ids = range(first, min(first + 100, users + 1))
+            await db.execute(insert(Project), [
+                {
+                    "user_id": u, "name": f"Проект {u}-{i}",
+                    "type": ProjectType.ORDER if i % 2 else ProjectType.PERSONAL,
+                    "status": statuses[i % len(statuses)], "cost": 1000 * i,
+                }
+                for u in user_ids for i in range(rows)
+            ])
+            await db.execute(insert(Task), [
+                {"user_id": u, "title": f"Задача {u}-{i}", "is_completed": i % 3 == 0,
+                 "deadline": now + timedelta(days=i % 30)}
+                for u in user_ids for i in range(rows)
+            ])
+            await db.execute(insert(Expense), [
+                {"user_id": u, "amount": 100 + i, "date": now - timedelta(days=i % 60), "comment": f"Расход {i}"}
+                for u in user_ids for i in range(rows)
+            ])
+        await db.commit()
+
+class SimulatedUser:
+    def __init__(self, dp, bot, user_id: int, samples):
+        self.dp = dp
+        self.bot = bot
+        self.user_id = user_id
+        self.samples = samples
+
+    async def _feed(self, step: str, update) -> None:
+        with count_statements() as statements:
+            started = time.perf_counter()
+            await self.dp.feed_update(self.bot, update)
+            elapsed = time.perf_counter() - started
+        self.samples.append((step, elapsed, len(statements)))
+
+    async def message(self, text: str, step: str = None) -> None:
+        await self._feed(step or f"message:{text}", message_update(self.bot, self.user_id, text))
+
+    async def callback(self, data, step: str = None) -> None:
+        if not isinstance(data, str):
+            step = step or f"callback:{data.__prefix__}:{data.action}"
+            data = data.pack()
+        message_id = self.bot.session.last_message_id[self.user_id]
+        await self._feed(step or f"callback:{data}", callback_update(self.bot, self.user_id, data, message_id))
+
+    async def click(self, factory, action: str) -> None:
+        """Нажимает случайную кнопку последней клавиатуры с заданным действием"""
+        prefix = factory.on(action).key + ":"
+        markup = self.bot.session.last_markup.get(self.user_id)
+        buttons = [
+            button.callback_data
+            for row in getattr(markup, "inline_keyboard", [])
+            for button in row
+            if button.callback_data and button.callback_data.startswith(prefix)
+        ]
+        if buttons:
+            await self.callback(random.choice(buttons), step=f"callback:{prefix}*")
+
+    async def inline(self, text: str) -> None:
+        """
+        Набирает inline-запрос по буквам: клиент Telegram отправляет запрос на каждое нажатие,
+        не дожидаясь ответа на предыдущий. Ответ пользователь видит только на последний.
+        """
+        keystrokes = []
+        for end in range(len(text) + 1):
+            step = "inline_query" if end == len(text) else "inline_query:typing"
+            keystrokes.append(asyncio.create_task(
+                self._feed(step, inline_query_update(self.bot, self.user_id, text[:end]))
+            ))
+            await asyncio.sleep(TYPING_INTERVAL)
+        await asyncio.gather(*keystrokes)
+
+    async def pick_date(self) -> None:
+        today = datetime.now() + timedelta(days=random.randint(1, 30))
+        data = SimpleCalendarCallback(act=SimpleCalAct.day, year=today.year, month=today.month, day=today.day)
+        await self.callback(data.pack(), step="callback:calendar_day")
+
+    async def flow(self, index: int) -> None:
+        await self.message("/start")
+
+        # Проект-заказ
+        await self.message("📁 Проекты")
+        await self.callback(ProjectCallback(action="add"))
+        await self.message(f"Бенчмарк {self.user_id}-{index}", step="message:project_name")
+        await self.callback(ProjectCallback(action="type", value="order"))
+        await self.message("15000", step="message:project_cost")
+        await self.callback(SkipCallback(action="deadline"))
+        await self.callback(ProjectCallback(action="my"))
+        await self.callback(ProjectCallback(action="orders"))
+        await self.click(ProjectCallback, "open")
+        await self.click(ProjectCallback, "complete")
+
+        # Задачи
+        for task in range(3):
+            await self.callback(TaskCallback(action="add"))
+            await self.message(f"Задача {index}-{task}", step="message:task_title")
+            await self.message("Описание", step="message:task_description")
+            await self.click(TaskCallback, "select_project")
+            await self.pick_date()
+        await self.callback(TaskCallback(action="list"))
+        await self.click(TaskCallback, "open")
+        await self.click(TaskCallback, "complete")
+        await self.inline(f"Задача {index}")
+
+        # Массовые действия: отметить пару задач и выполнить их одним нажатием
+        await self.callback(TaskCallback(action="list"))
+        await self.callback(TaskCallback(action="select"))
+        await self.click(TaskCallback, "toggle")
+        await self.click(TaskCallback, "toggle")
+        await self.callback(TaskCallback(action="bulk_complete"))
+
+        # Расходы
+        await self.message("💸 Траты")
+        await self.callback(ExpenseCallback(action="add"))
+        await self.message(str(random.randint(100, 5000)), step="message:expense_amount")
+        await self.pick_date()
+        await self.message("Бенчмарк", step="message:expense_comment")
+        await self.callback(ExpenseCallback(action="history"))
+        await self.callback(ExpenseCallback(action="select"))
+        await self.click(ExpenseCallback, "toggle")
+        await self.callback(ExpenseCallback(action="bulk_delete"))
+
+        await self.message("📊 Статистика")
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def summarize(samples, wall_time):
+    latencies = [elapsed for _, elapsed, _ in samples]
+    return {
+        "updates": len(samples),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "sql_per_update": statistics.mean(sql for _, _, sql in samples),
+        "updates_per_sec": len(samples) / wall_time,
+        # Шаги сценария: по ним видно, что базовый результат снят на том же сценарии
+        "steps": sorted({step for step, _, _ in samples}),
+    }
+
+def print_steps(samples):
+    per_step = defaultdict(list)
+    for step, elapsed, sql in samples:
+        per_step[step].append((elapsed, sql))
+
+    print(f"{'шаг':40} {'n':>6} {'p50 мс':>9} {'p95 мс':>9} {'SQL':>6}")
+    for step, values in sorted(per_step.items(), key=lambda item: -percentile([v[0] for v in item[1]], 0.95)):
+        latencies = [v[0] for v in values]
+        print(
+            f"{step[:40]:40} {len(values):>6} {percentile(latencies, 0.5) * 1000:>9.2f} "
+            f"{percentile(latencies, 0.95) * 1000:>9.2f} {statistics.mean(v[1] for v in values):>6.1f}"
+        )
+
+def compare(result, baseline, max_regression):
+    """Сравнивает с сохраненным результатом, возвращает список регрессий"""
+    regressions = []
+    print(f"\n{'метрика':18} {'база':>10} {'сейчас':>10} {'изм.':>8}")
+    for key in ("p50_ms", "p95_ms", "p99_ms", "sql_per_update", "updates_per_sec"):
+        old, new = baseline[key], result[key]
+        change = (new - old) / old if old else 0
+        print(f"{key:18} {old:>10.2f} {new:>10.2f} {change:>+8.1%}")
+        # Для пропускной способности хуже - меньше, для остальных метрик - больше
+        worse = -change if key == "updates_per_sec" else change
+        if worse > max_regression:
+            regressions.append(key)
+    return regressions
+
+async def prepare(args, dispose: bool = False) -> None:
+    try:
+        await create_tables()
+        await seed(args.seed_users, args.seed_rows)
+    finally:
+        if dispose:
+            await engine.dispose()
+
+async def run_users(user_ids, flows: int):
+    """Сценарии пользователей в одном процессе со своим Dispatcher - как у рабочего шардированного режима"""
+    install_query_counter(engine)
+    dp = create_dispatcher(storage=MemoryStorage())
+    bot = create_fake_bot()
+    samples = []
+    users = [SimulatedUser(dp, bot, user_id, samples) for user_id in user_ids]
+
+    async def run_user(user):
+        for index in range(flows):
+            await user.flow(index)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(run_user(user)) for user in users]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # При ошибке одного пользователя остальные останавливаются, и соединения возвращаются в пул:
+        # незакрытые соединения aiosqlite держат потоки, и процесс не завершился бы
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await engine.dispose()
+    wall_time = time.perf_counter() - started
+
+    return samples, wall_time
+
+def run_shard(index: int, processes: int, users: int, flows: int, seed: int):
+    random.seed(seed + index)
+    # Пользователи делятся между процессами так же, как в шардированном режиме (shard_for)
+    user_ids = [user_id for user_id in range(1, users + 1) if user_id % processes == index]
+    return asyncio.run(run_users(user_ids, flows))
+
+async def run_single(args):
+    try:
+        await prepare(args)
+    except BaseException:
+        await engine.dispose()
+        raise
+    random.seed(args.seed)
+    return await run_users(range(1, args.users + 1), args.flows)
+
+def run(args) -> dict:
+    if args.processes > 1:
+        # БД заполняется до запуска процессов, соединения родителя закрываются
+        asyncio.run(prepare(args, dispose=True))
+        with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(run_shard, index, args.processes, args.users, args.flows, args.seed)
+                for index in range(args.processes)
+            ]
+            parts = [future.result() for future in futures]
+    else:
+        parts = [asyncio.run(run_single(args))]
+    samples = [sample for part_samples, _ in parts for sample in part_samples]
+    # Время запуска процессов не учитывается: процессы работают параллельно, берется самый долгий
+    wall_time = max(part_wall_time for _, part_wall_time in parts)
+
+    if args.steps:
+        print_steps(samples)
+    return summarize(samples, wall_time)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--flows", type=int, default=3, help="сценариев на пользователя")
+    parser.add_argument("--seed-users", type=int, default=1000, help="пользователей в БД")
+    parser.add_argument("--seed-rows", type=int, default=50, help="проектов, задач и расходов на пользователя")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора случайных чисел")
+    parser.add_argument("--processes", type=int, default=1, help="процессов, между которыми делятся пользователи")
+    parser.add_argument("--steps", action="store_true", help="показать задержки по шагам")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    try:
+        result = run(args)
+    finally:
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+    result["params"] = {key: getattr(args, key) for key in ("users", "flows", "seed_users", "seed_rows", "seed")}
+    if args.processes > 1:
+        result["params"]["processes"] = args.processes
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Базовый результат сохранен в {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("steps") != result["steps"]:
+            # Другой сценарий - другие числа, сравнение ничего не покажет
+            if "steps" in baseline:
+                added = sorted(set(result["steps"]) - set(baseline["steps"]))
+                removed = sorted(set(baseline["steps"]) - set(result["steps"]))
+                print(f"\nБазовый результат снят на другом сценарии (новые шаги: {added}, убранные: {removed}).")
+            else:
+                print("\nВ базовом результате нет шагов сценария: он снят до их записи.")
+            print("Сохраните его заново: python -m benchmarks.handlers --save-baseline")
+            sys.exit(1)
+        if baseline.get("params") != result["params"]:
+            print(f"\nВнимание: параметры базового результата отличаются: {baseline.get('params')}")
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"\nРегрессия: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Микробенчмарк записи: одновременные обработчики добавляют расходы (как expenses.add),
+каждый со своей транзакцией или через групповую фиксацию (services.writer).
+
+    python -m benchmarks.writes --writers 50 --operations 2000
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+from sqlalchemy.exc import OperationalError
+
+# Отдельная БД - до импорта модулей бота
+_tmp_dir = tempfile.mkdtemp(prefix="bench_writes_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp_dir}/bench.db"
+
+from bot import create_tables
+from models import Expense
+from services.database import AsyncSessionLocal, engine
+from services.repositories import expenses as expense_repo
+from services.writer import group_writer, write
+
+async def measure(writers: int, operations: int) -> dict:
+    latencies = []
+    errors = 0
+    per_writer = operations // writers
+
+    async def writer(index: int) -> None:
+        nonlocal errors
+        for i in range(per_writer):
+            expense = Expense(user_id=index + 1, amount=100 + i, date=datetime.now(), comment=f"Запись {i}")
+            started = time.perf_counter()
+            # Сессия на операцию - как DatabaseMiddleware на апдейт
+            try:
+                async with AsyncSessionLocal() as db:
+                    await write(db, partial(expense_repo.add, expense=expense))
+            except OperationalError:
+                # database is locked: при многих писателях busy_timeout не хватает
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(index) for index in range(writers)))
+    wall_time = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops_per_sec": len(latencies) / wall_time,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "errors": errors,
+    }
+
+async def run(args) -> None:
+    await create_tables()
+
+    results = {"по транзакции на операцию": await measure(args.writers, args.operations)}
+    group_writer.configure(AsyncSessionLocal, interval=args.interval_ms / 1000, max_batch=args.batch)
+    results["групповая фиксация"] = await measure(args.writers, args.operations)
+    await group_writer.close()
+    await engine.dispose()
+
+    print(f"{'режим':28} {'оп/с':>10} {'p50 мс':>9} {'p95 мс':>9} {'ошибок':>7}")
+    for name, result in results.items():
+        print(
+            f"{name:28} {result['ops_per_sec']:>10.0f} {result['p50_ms']:>9.2f}"
+            f" {result['p95_ms']:>9.2f} {result['errors']:>7}"
+        )
+    stats = group_writer.stats()
+    print(f"\nпакетов: {stats['batches']}, операций в пакете: {stats['operations_per_batch']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=50, help="одновременных обработчиков")
+    parser.add_argument("--operations", type=int, default=2000, help="всего операций в каждом режиме")
+    parser.add_argument("--interval-ms", type=float, default=5)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,235 @@
 import os
+import sys
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.memory import MemoryStorage
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from datetime import timedelta
 from dotenv import load_dotenv
 
-from handlers import main_menu, projects, tasks, expenses, statistics
+from handlers import main_menu, projects, tasks, expenses, statistics, export, search, inline
 from middlewares.db import DatabaseMiddleware
-from services.database import Base, engine
+from middlewares.metrics import MetricsMiddleware
+from middlewares.query_budget import QueryBudgetMiddleware, install_query_counter
+from services.charts import chart_renderer
+from services.database import AsyncSessionLocal, engine
+from services.entity_cache import RedisInvalidationChannel, entity_cache
+from services.inline_search import inline_stats
+from services.metrics import install_sql_metrics, registry, start_metrics_server
+from services.migrations import run_migrations
+from services.reminders import ReminderService
+from services.sender import OutboundQueue
+from services.sharding import SHARD_ENV, SHARDS_ENV, ShardForwardMiddleware, ShardRouter, serve_shard
+from services.storage import create_storage
+from services.writer import group_writer
+from services.webhook import run_webhook
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Создание таблиц БД
+# Настройка логирования
+def setup_logging(shard=None):
+    # В шардированном режиме все процессы пишут в один лог, строки помечаются процессом
+    process = ""
+    if int(os.getenv(SHARDS_ENV, 1)) > 1:
+        process = "front - " if shard is None else f"shard {shard} - "
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - {process}%(name)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler("bot.log", encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+# Создание и обновление таблиц БД
 async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-# Инициализация бота и диспетчера с новым синтаксисом
-bot = Bot(
-    token=os.getenv("BOT_TOKEN"),
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# Подключение middleware
-dp.update.middleware(DatabaseMiddleware())
-
-# Подключение роутеров
-dp.include_router(main_menu.router)
-dp.include_router(projects.router)
-dp.include_router(tasks.router)
-dp.include_router(expenses.router)
-dp.include_router(statistics.router)
+    await run_migrations(engine)
+
+# Инициализация бота с новым синтаксисом
+def create_bot(session=None):
+    bot = Bot(
+        token=os.getenv("BOT_TOKEN"),
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    return bot
+
+# Диспетчер со всеми middleware и роутерами (используется ботом и бенчмарками)
+def create_dispatcher(storage=None):
+    dp = Dispatcher(storage=storage or create_storage())
+    
+    # Подключение middleware
+    # METRICS_PORT включает метрики обработчиков в формате Prometheus; подключаются первыми,
+    # чтобы в замер вошла фиксация транзакции в DatabaseMiddleware
+    if os.getenv("METRICS_PORT"):
+        install_sql_metrics(engine)
+        MetricsMiddleware().setup(
+            dp, main_menu.router, projects.router, tasks.router, expenses.router, statistics.router, export.router,
+            search.router, inline.router,
+        )
+    # SQL_QUERY_BUDGET задает лимит SQL-запросов на апдейт (используется в тестах)
+    if os.getenv("SQL_QUERY_BUDGET"):
+        install_query_counter(engine)
+        dp.update.middleware(QueryBudgetMiddleware(int(os.getenv("SQL_QUERY_BUDGET"))))
+    dp.update.middleware(DatabaseMiddleware())
+    
+    # Подключение роутеров
+    dp.include_router(main_menu.router)
+    dp.include_router(projects.router)
+    dp.include_router(tasks.router)
+    dp.include_router(expenses.router)
+    dp.include_router(statistics.router)
+    dp.include_router(export.router)
+    dp.include_router(search.router)
+    dp.include_router(inline.router)
+    return dp
+
+def webhook_options():
+    return dict(
+        base_url=os.getenv("WEBHOOK_URL"),
+        path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        secret_token=os.getenv("WEBHOOK_SECRET"),
+        host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", 8080)),
+        workers=int(os.getenv("WEBHOOK_WORKERS", 8)),
+        queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", 100)),
+    )
+
+# Входной процесс шардированного режима: принимает апдейты и раздает их рабочим процессам
+async def run_front(shards: int):
+    bot = create_bot()
+    # Диспетчер с роутерами нужен входному процессу только для списка типов апдейтов:
+    # обработка до роутеров не доходит, апдейт уходит рабочему из outer middleware
+    dp = create_dispatcher(storage=MemoryStorage())
+    router = ShardRouter(
+        dp,
+        bot,
+        command=[sys.executable, os.path.abspath(__file__)],
+        shards=shards,
+        queue_size=int(os.getenv("SHARD_QUEUE_SIZE", 100)),
+        stall_timeout=float(os.getenv("SHARD_STALL_TIMEOUT", 30)),
+    )
+    
+    metrics_runner = None
+    if os.getenv("METRICS_PORT"):
+        registry.add_gauges("bot_shards", router.stats)
+        metrics_runner = await start_metrics_server(
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            port=int(os.getenv("METRICS_PORT")),
+        )
+    
+    try:
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            await run_webhook(dp, bot, pool=router, **webhook_options())
+        else:
+            router.start()
+            dp.update.outer_middleware(ShardForwardMiddleware(router))
+            dp.shutdown.register(router.stop)
+            # Апдейты передаются по одному и по порядку, заполненная очередь рабочего тормозит polling
+            await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await engine.dispose()
 
 # Запуск бота
+# BOT_MODE=webhook включает прием апдейтов через вебхук, по умолчанию - polling
+# BOT_SHARDS=N (N > 1) запускает N рабочих процессов, апдейты распределяются по пользователям
 async def main():
-    await create_tables()
-    await dp.start_polling(bot)
+    shard = os.getenv(SHARD_ENV)
+    shards = int(os.getenv(SHARDS_ENV, 1))
+    setup_logging(shard)
+    if shard is None:
+        # Миграции выполняет только входной процесс, до запуска рабочих
+        await create_tables()
+        if shards > 1:
+            await run_front(shards)
+            return
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    
+    # Все исходящие сообщения проходят через очередь с ограничением частоты Telegram,
+    # общий лимит делится между рабочими процессами
+    outbound_queue = OutboundQueue(
+        global_rate=float(os.getenv("SEND_GLOBAL_RATE", 30)) / shards,
+        chat_rate=float(os.getenv("SEND_CHAT_RATE", 1)),
+    )
+    bot.session.middleware(outbound_queue)
+    dp.shutdown.register(outbound_queue.close)
+    
+    # Графики рисуются в пуле процессов, очередь рендера ограничена
+    chart_renderer.configure(
+        workers=int(os.getenv("CHART_WORKERS", 2)),
+        max_pending=int(os.getenv("CHART_QUEUE_SIZE", 8)),
+    )
+    dp.shutdown.register(chart_renderer.close)
+    
+    # DB_GROUP_COMMIT=1: создание задач, проектов и расходов фиксируется общими пакетами
+    # раз в DB_GROUP_COMMIT_INTERVAL_MS или по DB_GROUP_COMMIT_BATCH операций
+    if os.getenv("DB_GROUP_COMMIT", "0") == "1":
+        group_writer.configure(
+            AsyncSessionLocal,
+            interval=float(os.getenv("DB_GROUP_COMMIT_INTERVAL_MS", 5)) / 1000,
+            max_batch=int(os.getenv("DB_GROUP_COMMIT_BATCH", 100)),
+        )
+        dp.shutdown.register(group_writer.close)
+    
+    # Кэш проектов, задач и расходов по id; ENTITY_CACHE_SIZE=0 отключает его.
+    # ENTITY_CACHE_REDIS_URL нужен, только если одни данные меняют несколько независимых процессов
+    entity_cache.configure(
+        max_entries=int(os.getenv("ENTITY_CACHE_SIZE", 10_000)),
+        max_bytes=int(float(os.getenv("ENTITY_CACHE_MAX_MB", 8)) * 1024 * 1024),
+        ttl=float(os.getenv("ENTITY_CACHE_TTL", 300)),
+    )
+    if os.getenv("ENTITY_CACHE_REDIS_URL"):
+        await entity_cache.connect(RedisInvalidationChannel(os.getenv("ENTITY_CACHE_REDIS_URL")))
+        dp.shutdown.register(entity_cache.close)
+    
+    metrics_runner = None
+    if os.getenv("METRICS_PORT"):
+        registry.add_gauges("bot_outbound", outbound_queue.stats)
+        registry.add_gauges("bot_charts", chart_renderer.stats)
+        registry.add_gauges("bot_inline", inline_stats)
+        registry.add_gauges("bot_group_commit", group_writer.stats)
+        registry.add_gauges("bot_entity_cache", entity_cache.stats)
+        # Рабочий процесс N отдает метрики на METRICS_PORT + 1 + N, входной - на METRICS_PORT
+        metrics_runner = await start_metrics_server(
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            port=int(os.getenv("METRICS_PORT")) + (0 if shard is None else 1 + int(shard)),
+        )
+    
+    # Напоминания о дедлайнах: одна периодическая задача на все задачи и проекты,
+    # в шардированном режиме - только в рабочем процессе 0
+    scheduler = AsyncIOScheduler()
+    if os.getenv("REMINDERS_ENABLED", "1") == "1" and shard in (None, "0"):
+        ReminderService(bot, AsyncSessionLocal).schedule(
+            scheduler, interval=timedelta(minutes=int(os.getenv("REMINDER_INTERVAL_MINUTES", 10)))
+        )
+    scheduler.start()
+    
+    try:
+        if shard is not None:
+            await serve_shard(
+                dp,
+                bot,
+                workers=int(os.getenv("WEBHOOK_WORKERS", 8)),
+                queue_size=int(os.getenv("SHARD_QUEUE_SIZE", 100)),
+            )
+        elif os.getenv("BOT_MODE", "polling") == "webhook":
+            await run_webhook(dp, bot, **webhook_options())
+        else:
+            await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await engine.dispose()
 
 if __name__ == "__main__":
     import asyncio
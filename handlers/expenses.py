@@ -1,27 +1,51 @@
-from aiogram import Router, types, F
+import csv
+import tempfile
+import time
+from contextlib import aclosing
+from functools import partial
+
+from aiogram import types, F
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
 from models import Expense
-from sqlalchemy import select, func, delete
 from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
 from keyboards.calendar import get_calendar
+from services.entity_cache import entity_cache
+from services.expense_import import ImportSummary, import_expenses
+from services.repositories import expenses as expense_repo
+from services.writer import write
+from keyboards.callbacks import ExpenseCallback, MenuCallback, SkipCallback
+from keyboards.selection import get_selection, save_selection, selection_keyboard
+from handlers.routing import IndexedRouter
 
-router = Router()
+router = IndexedRouter()
 
 class ExpenseForm(StatesGroup):
     amount = State()
     date = State()
     comment = State()
 
-def expenses_main_keyboard():
+class ExpenseImportForm(StatesGroup):
+    file = State()
+
+class ExpenseBulkForm(StatesGroup):
+    select = State()
+
+# Ключ выбранных расходов в данных FSM и сколько последних расходов показывается для выбора
+SELECTION_KEY = "bulk_expenses"
+SELECTION_LIMIT = 50
+
+def _build_expenses_main_keyboard():
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="💵 Добавить расход", callback_data="add_expense"),
-        types.InlineKeyboardButton(text="📊 История расходов", callback_data="expenses_history"),
-        types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="💵 Добавить расход", callback_data=ExpenseCallback(action="add").pack()),
+        types.InlineKeyboardButton(text="📊 История расходов", callback_data=ExpenseCallback(action="history").pack()),
+        types.InlineKeyboardButton(text="☑️ Удалить несколько", callback_data=ExpenseCallback(action="select").pack()),
+        types.InlineKeyboardButton(text="📥 Импорт из файла", callback_data=ExpenseCallback(action="import").pack()),
+        types.InlineKeyboardButton(text="◀️ Назад", callback_data=MenuCallback(action="main").pack())
     )
     builder.adjust(1)
     return builder.as_markup()
@@ -31,69 +55,133 @@ def expense_actions_keyboard(expense_id):
     builder.add(
         types.InlineKeyboardButton(
             text="✏️ Редактировать", 
-            callback_data=f"edit_expense_{expense_id}"
+            callback_data=ExpenseCallback(action="edit", id=expense_id).pack()
         ),
         types.InlineKeyboardButton(
             text="🗑️ Удалить", 
-            callback_data=f"delete_expense_{expense_id}"
+            callback_data=ExpenseCallback(action="delete", id=expense_id).pack()
         ),
         types.InlineKeyboardButton(
             text="◀️ Назад", 
-            callback_data="expenses_menu"
+            callback_data=ExpenseCallback(action="menu").pack()
         )
     )
     builder.adjust(1)
     return builder.as_markup()
 
-def get_skip_keyboard():
+def _build_skip_keyboard():
     builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data="skip_comment"))
+    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data=SkipCallback(action="comment").pack()))
     return builder.as_markup()
 
-@router.callback_query(F.data == "expenses_menu")
-async def show_expenses_menu(callback: types.CallbackQuery):
+def _build_back_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data=ExpenseCallback(action="menu").pack()))
+    return builder.as_markup()
+
+# Статические клавиатуры строятся один раз при импорте
+EXPENSES_MAIN_KEYBOARD = _build_expenses_main_keyboard()
+SKIP_KEYBOARD = _build_skip_keyboard()
+BACK_KEYBOARD = _build_back_keyboard()
+
+def expenses_main_keyboard():
+    return EXPENSES_MAIN_KEYBOARD
+
+def get_skip_keyboard():
+    return SKIP_KEYBOARD
+
+@router.callback_query(ExpenseCallback.on("menu"))
+async def show_expenses_menu(callback: types.CallbackQuery, state: FSMContext = None):
+    # Выход из меню импорта по кнопке "Назад" сбрасывает ожидание файла
+    if state is not None:
+        await state.clear()
     await callback.message.edit_text("Управление расходами:", reply_markup=expenses_main_keyboard())
 
-@router.callback_query(F.data == "expenses_history")
+# Лимит Telegram на длину сообщения - 4096 символов, оставляем запас
+MESSAGE_LIMIT = 4000
+# Сколько сообщений с историей отправляем максимум
+MAX_HISTORY_MESSAGES = 5
+COMMENT_LIMIT = 500
+
+def format_expense_line(expense: Expense) -> str:
+    line = f"📅 {expense.date.strftime('%d.%m.%Y')}: {expense.amount} руб.\n"
+    if expense.comment:
+        comment = expense.comment
+        if len(comment) > COMMENT_LIMIT:
+            comment = comment[:COMMENT_LIMIT] + "…"
+        line += f"   💬 {comment}\n"
+    line += f"   [ID: {expense.id}]\n\n"
+    return line
+
+async def iter_expense_pages(db, user_id: int, since: datetime, header: str):
+    """Читает расходы порциями и отдает готовые страницы текста не длиннее MESSAGE_LIMIT"""
+    expenses = await expense_repo.stream_since(db, user_id, since)
+    
+    buffer = [header]
+    size = len(header)
+    try:
+        async for expense in expenses:
+            line = format_expense_line(expense)
+            if size + len(line) > MESSAGE_LIMIT:
+                yield "".join(buffer)
+                buffer, size = [], 0
+            buffer.append(line)
+            size += len(line)
+    finally:
+        # При досрочной остановке (pages.aclose()) курсор закрывается сразу, а не вместе с сессией
+        await expenses.close()
+    
+    if buffer:
+        yield "".join(buffer)
+
+@router.callback_query(ExpenseCallback.on("history"))
 async def show_expenses_history(callback: types.CallbackQuery, db):
     one_month_ago = datetime.now() - timedelta(days=30)
     
-    result = await db.execute(
-        select(Expense).where(
-            Expense.user_id == callback.from_user.id,
-            Expense.date >= one_month_ago
-        ).order_by(Expense.date.desc())
-    )
-    expenses = result.scalars().all()
+    # Итог и количество считаем в SQL, не загружая строки
+    count, total = await expense_repo.summary(db, callback.from_user.id, one_month_ago)
     
-    if not expenses:
+    if not count:
         await callback.message.edit_text("У вас нет расходов за последний месяц.", reply_markup=expenses_main_keyboard())
         return
     
-    total = sum(expense.amount for expense in expenses)
-    message_text = "Ваши расходы за последний месяц:\n\n"
+    pages = iter_expense_pages(db, callback.from_user.id, one_month_ago, "Ваши расходы за последний месяц:\n\n")
+    footer = f"💵 Итого: {total} руб."
     
-    for expense in expenses:
-        message_text += f"📅 {expense.date.strftime('%d.%m.%Y')}: {expense.amount} руб.\n"
-        if expense.comment:
-            message_text += f"   💬 {expense.comment}\n"
-        message_text += f"   [ID: {expense.id}]\n\n"
+    # Страницы отправляем по мере готовности: первую - правкой текущего сообщения,
+    # остальные - новыми сообщениями, последняя получает итог и кнопку "Назад"
+    sent = 0
     
-    message_text += f"💵 Итого: {total} руб."
+    async def send_page(text, reply_markup=None):
+        nonlocal sent
+        if sent == 0:
+            await callback.message.edit_text(text, reply_markup=reply_markup)
+        else:
+            await callback.message.answer(text, reply_markup=reply_markup)
+        sent += 1
     
-    builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="expenses_menu"))
+    pending = None
+    async with aclosing(pages):
+        async for page in pages:
+            if pending is not None:
+                # Оставляем место под последнюю страницу и итог
+                if sent + 2 >= MAX_HISTORY_MESSAGES:
+                    footer = "…показаны не все расходы\n\n" + footer
+                    break
+                await send_page(pending)
+            pending = page
     
-    await callback.message.edit_text(message_text, reply_markup=builder.as_markup())
+    if len(pending) + len(footer) > MESSAGE_LIMIT:
+        await send_page(pending)
+        pending = ""
+    
+    await send_page(pending + footer, reply_markup=BACK_KEYBOARD)
 
-@router.callback_query(F.data.startswith("expense_"))
-async def show_expense(callback: types.CallbackQuery, db):
-    expense_id = int(callback.data.split("_")[1])
+@router.callback_query(ExpenseCallback.on("open"))
+async def show_expense(callback: types.CallbackQuery, callback_data: ExpenseCallback, db):
+    expense_id = callback_data.id
     
-    result = await db.execute(
-        select(Expense).where(Expense.id == expense_id)
-    )
-    expense = result.scalar_one_or_none()
+    expense = await expense_repo.get(db, callback.from_user.id, expense_id)
     
     if not expense:
         await callback.answer("Расход не найден!")
@@ -112,19 +200,84 @@ async def show_expense(callback: types.CallbackQuery, db):
         reply_markup=expense_actions_keyboard(expense_id)
     )
 
-@router.callback_query(F.data.startswith("delete_expense_"))
-async def delete_expense(callback: types.CallbackQuery, db):
-    expense_id = int(callback.data.split("_")[2])
+@router.callback_query(ExpenseCallback.on("delete"))
+async def delete_expense(callback: types.CallbackQuery, callback_data: ExpenseCallback, db):
+    expense_id = callback_data.id
     
-    await db.execute(
-        delete(Expense).where(Expense.id == expense_id)
-    )
-    await db.commit()
+    expense = await expense_repo.remove(db, callback.from_user.id, expense_id)
+    if expense:
+        await db.commit()
+        entity_cache.invalidate(Expense, expense_id)
     
     await callback.answer("Расход удален!")
     await show_expenses_menu(callback)
 
-@router.callback_query(F.data == "add_expense")
+# Массовое удаление: выбор хранится в FSM, удаление - один запрос и одна правка сообщения
+
+BULK_ACTIONS = (
+    ("🗑️ Удалить", ExpenseCallback(action="bulk_delete").pack()),
+    ("◀️ Отмена", ExpenseCallback(action="menu").pack()),
+)
+
+def _toggle_callback(expense_id):
+    return ExpenseCallback(action="toggle", id=expense_id).pack()
+
+async def get_expense_rows(db, user_id):
+    rows = []
+    for expense_id, date, amount, comment in await expense_repo.recent(db, user_id, SELECTION_LIMIT):
+        label = f"{date.strftime('%d.%m.%Y')}: {amount} руб."
+        if comment:
+            label += f" · {comment[:20]}"
+        rows.append((expense_id, label))
+    return rows
+
+async def show_expense_selection(callback: types.CallbackQuery, db, selected):
+    rows = await get_expense_rows(db, callback.from_user.id)
+    if not rows:
+        await callback.message.edit_text("У вас нет расходов.", reply_markup=expenses_main_keyboard())
+        return
+    markup = selection_keyboard(rows, selected, _toggle_callback, ExpenseCallback(action="toggle_all").pack(), BULK_ACTIONS)
+    await callback.message.edit_text(
+        f"Отметьте расходы для удаления (последние {SELECTION_LIMIT}, выбрано: {len(selected)}):",
+        reply_markup=markup
+    )
+
+@router.callback_query(ExpenseCallback.on("select"))
+async def start_expense_selection(callback: types.CallbackQuery, state: FSMContext, db):
+    await state.set_state(ExpenseBulkForm.select)
+    await save_selection(state, SELECTION_KEY, ())
+    await show_expense_selection(callback, db, set())
+
+@router.callback_query(ExpenseBulkForm.select, ExpenseCallback.on("toggle"))
+async def toggle_expense(callback: types.CallbackQuery, callback_data: ExpenseCallback, state: FSMContext, db):
+    selected = await get_selection(state, SELECTION_KEY) ^ {callback_data.id}
+    await save_selection(state, SELECTION_KEY, selected)
+    await show_expense_selection(callback, db, selected)
+
+@router.callback_query(ExpenseBulkForm.select, ExpenseCallback.on("toggle_all"))
+async def toggle_all_expenses(callback: types.CallbackQuery, state: FSMContext, db):
+    expense_ids = {expense_id for expense_id, _ in await get_expense_rows(db, callback.from_user.id)}
+    selected = set() if expense_ids <= await get_selection(state, SELECTION_KEY) else expense_ids
+    await save_selection(state, SELECTION_KEY, selected)
+    await show_expense_selection(callback, db, selected)
+
+@router.callback_query(ExpenseBulkForm.select, ExpenseCallback.on("bulk_delete"))
+async def delete_selected_expenses(callback: types.CallbackQuery, state: FSMContext, db):
+    selected = await get_selection(state, SELECTION_KEY)
+    if not selected:
+        await callback.answer("Не выбрано ни одного расхода")
+        return
+    deleted = await expense_repo.remove_many(db, callback.from_user.id, selected)
+    await db.commit()
+    for expense_id in deleted:
+        entity_cache.invalidate(Expense, expense_id)
+    await state.clear()
+    await callback.message.edit_text(
+        f"Удалено расходов: {len(deleted)}\n\nУправление расходами:",
+        reply_markup=expenses_main_keyboard()
+    )
+
+@router.callback_query(ExpenseCallback.on("add"))
 async def start_add_expense(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(ExpenseForm.amount)
     await callback.message.edit_text("Введите сумму расхода:")
@@ -160,7 +313,7 @@ async def process_expense_date(
         await state.set_state(ExpenseForm.comment)
         await callback.message.edit_text("Введите комментарий к расходу:", reply_markup=get_skip_keyboard())
 
-@router.callback_query(F.data == "skip_date", ExpenseForm.date)
+@router.callback_query(SkipCallback.on("date"), ExpenseForm.date)
 async def skip_expense_date(callback: types.CallbackQuery, state: FSMContext):
     # Устанавливаем текущую дату как дату расхода
     await state.update_data(date=datetime.now())
@@ -168,7 +321,7 @@ async def skip_expense_date(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Введите комментарий к расходу:", reply_markup=get_skip_keyboard())
 
 # Обработчик для кнопки "Пропустить" в комментарии
-@router.callback_query(F.data == "skip_comment", ExpenseForm.comment)
+@router.callback_query(SkipCallback.on("comment"), ExpenseForm.comment)
 async def skip_expense_comment(callback: types.CallbackQuery, state: FSMContext, db):
     data = await state.get_data()
     
@@ -179,8 +332,7 @@ async def skip_expense_comment(callback: types.CallbackQuery, state: FSMContext,
         comment=None
     )
     
-    db.add(expense)
-    await db.commit()
+    await write(db, partial(expense_repo.add, expense=expense))
     
     await state.clear()
     await callback.message.edit_text("Расход успешно добавлен!")
@@ -198,12 +350,85 @@ async def process_expense_comment(message: types.Message, state: FSMContext, db)
         comment=message.text
     )
     
-    db.add(expense)
-    await db.commit()
+    await write(db, partial(expense_repo.add, expense=expense))
     
     await state.clear()
     await message.answer("Расход успешно добавлен!")
     await show_expenses_menu_from_message(message)
 
 async def show_expenses_menu_from_message(message: types.Message):
-    await message.answer("Управление расходами:", reply_markup=expenses_main_keyboard())
\ No newline at end of file
+    await message.answer("Управление расходами:", reply_markup=expenses_main_keyboard())
+
+# Telegram отдает ботам файлы до 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Как часто обновлять сообщение о ходе импорта, секунды
+IMPORT_PROGRESS_INTERVAL = 1.0
+
+IMPORT_HELP = (
+    "📥 Отправьте файл с расходами документом:\n\n"
+    "• CSV с колонками дата, сумма, комментарий (разделитель «,» или «;», "
+    "можно с заголовком «Дата;Сумма;Комментарий»)\n"
+    "• банковскую выписку OFX - импортируются только списания\n\n"
+    "Расходы, которые уже есть (та же дата, сумма и комментарий), пропускаются."
+)
+
+def format_import_summary(summary: ImportSummary) -> str:
+    lines = [
+        "✅ Импорт завершен\n",
+        f"Строк в файле: {summary.rows}",
+        f"Добавлено: {summary.added} на сумму {round(summary.total, 2)} руб.",
+        f"Дубликатов: {summary.duplicates}",
+    ]
+    if summary.skipped:
+        lines.append(f"Поступлений пропущено: {summary.skipped}")
+    if summary.error_count:
+        lines.append(f"Ошибок: {summary.error_count}")
+        lines.extend(f"   строка {line_no}: {error}" for line_no, error in summary.errors)
+    if summary.truncated:
+        lines.append("\n…файл обработан не полностью: слишком много строк")
+    return "\n".join(lines)
+
+@router.callback_query(ExpenseCallback.on("import"))
+async def start_import_expenses(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(ExpenseImportForm.file)
+    await callback.message.edit_text(IMPORT_HELP, reply_markup=BACK_KEYBOARD)
+
+@router.message(ExpenseImportForm.file, F.document)
+async def process_import_file(message: types.Message, state: FSMContext, db):
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("Файл слишком большой (максимум 20 МБ).")
+        return
+    
+    await state.clear()
+    status = await message.answer("⏳ Загружаю файл…")
+    last_progress = time.monotonic()
+    imported = None
+    
+    # Вызывается после фиксации пачки, поэтому запрос к Telegram не держит транзакцию открытой
+    async def progress(summary: ImportSummary):
+        nonlocal last_progress, imported
+        imported = summary
+        if time.monotonic() - last_progress < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_progress = time.monotonic()
+        await status.edit_text(f"⏳ Обработано строк: {summary.rows}, новых расходов: {summary.added}")
+    
+    # Файл скачивается во временный файл на диске и читается построчно
+    with tempfile.TemporaryFile() as file:
+        await message.bot.download(document, destination=file)
+        try:
+            summary = await import_expenses(db, message.from_user.id, file, document.file_name, progress)
+        except csv.Error:
+            await db.rollback()
+            text = "Не удалось разобрать файл. Проверьте, что это CSV или OFX."
+            if imported is not None and imported.added:
+                text += f"\nДо ошибки сохранено расходов: {imported.added}, повторный импорт их не задвоит."
+            await status.edit_text(text, reply_markup=expenses_main_keyboard())
+            return
+    
+    await status.edit_text(format_import_summary(summary), reply_markup=expenses_main_keyboard())
+
+@router.message(ExpenseImportForm.file)
+async def process_import_not_document(message: types.Message):
+    await message.answer("Отправьте файл CSV или OFX документом (скрепка → Файл).", reply_markup=BACK_KEYBOARD)
@@ -0,0 +1,55 @@
+from aiogram import types
+from aiogram.enums import ChatAction
+from aiogram.filters import Command
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from keyboards.callbacks import ExportCallback, MenuCallback
+from handlers.routing import IndexedRouter
+from services.export import ExportTooLarge, close_export, export_user_data
+
+router = IndexedRouter()
+
+def _build_export_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        types.InlineKeyboardButton(text="CSV", callback_data=ExportCallback(action="csv").pack()),
+        types.InlineKeyboardButton(text="CSV (gzip)", callback_data=ExportCallback(action="csv", compress=True).pack()),
+        types.InlineKeyboardButton(text="JSON Lines", callback_data=ExportCallback(action="jsonl").pack()),
+        types.InlineKeyboardButton(text="JSON Lines (gzip)", callback_data=ExportCallback(action="jsonl", compress=True).pack()),
+        types.InlineKeyboardButton(text="◀️ Назад", callback_data=MenuCallback(action="main").pack())
+    )
+    builder.adjust(2)
+    return builder.as_markup()
+
+EXPORT_KEYBOARD = _build_export_keyboard()
+
+@router.message(Command("export"))
+async def cmd_export(message: types.Message):
+    await message.answer("📤 Выгрузка проектов, задач и расходов. Выберите формат:", reply_markup=EXPORT_KEYBOARD)
+
+async def _export(callback: types.CallbackQuery, callback_data: ExportCallback, db):
+    await callback.answer()
+    await callback.message.edit_text("⏳ Готовлю выгрузку…")
+    await callback.bot.send_chat_action(callback.message.chat.id, ChatAction.UPLOAD_DOCUMENT)
+    
+    try:
+        files = await export_user_data(db, callback.from_user.id, callback_data.action, callback_data.compress)
+    except ExportTooLarge:
+        await callback.message.edit_text("Выгрузка больше 50 МБ. Попробуйте формат со сжатием.", reply_markup=EXPORT_KEYBOARD)
+        return
+    # Данные прочитаны - освобождаем соединение до отправки файлов
+    await db.close()
+    
+    try:
+        for input_file, count in files:
+            await callback.message.answer_document(input_file, caption=f"{input_file.filename}: {count} строк")
+    finally:
+        close_export(files)
+    await callback.message.edit_text("✅ Выгрузка готова", reply_markup=EXPORT_KEYBOARD)
+
+@router.callback_query(ExportCallback.on("csv"))
+async def export_csv(callback: types.CallbackQuery, callback_data: ExportCallback, db):
+    await _export(callback, callback_data, db)
+
+@router.callback_query(ExportCallback.on("jsonl"))
+async def export_jsonl(callback: types.CallbackQuery, callback_data: ExportCallback, db):
+    await _export(callback, callback_data, db)
@@ -0,0 +1,134 @@
+import asyncio
+import html
+import os
+import re
+
+from aiogram import types
+from models import Project, Task
+from keyboards.cache import keyboard_cache
+from keyboards.callbacks import InlineCallback
+from handlers.routing import IndexedRouter
+from services.entity_cache import entity_cache
+from services.repositories import projects as project_repo
+from services.repositories import tasks as task_repo
+from services.inline_search import RESULTS_LIMIT, find_items, inline_cache, inline_debouncer
+from services.search import SearchResult
+
+router = IndexedRouter()
+
+# Результаты меняются вместе с задачами и проектами пользователя
+keyboard_cache.subscribe(inline_cache.invalidate)
+
+# Пауза перед поиском: за это время следующее нажатие клавиши делает запрос устаревшим
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", 0.02))
+# Сколько секунд Telegram может отдавать результаты из своего кэша (у каждого пользователя свои)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 5))
+
+OPEN_PAYLOAD = re.compile(r"^(task|project)_(\d+)$")
+
+def _deadline(result: SearchResult) -> str:
+    return f"⏰ до {result.date.strftime('%d.%m.%Y')}" if result.date else "без дедлайна"
+
+def _result_keyboard(result: SearchResult, bot_username: str):
+    # Разметка собирается напрямую: InlineKeyboardBuilder копирует кнопки, а результатов до 20 на нажатие
+    return types.InlineKeyboardMarkup(inline_keyboard=[[
+        types.InlineKeyboardButton(
+            text="✅ Завершить",
+            callback_data=InlineCallback(action=f"complete_{result.kind}", id=result.id).pack(),
+        ),
+        # Карточка с полным набором действий открывается в личном чате с ботом
+        types.InlineKeyboardButton(
+            text="Открыть в боте",
+            url=f"https://t.me/{bot_username}?start={result.kind}_{result.id}",
+        ),
+    ]])
+
+def _article(result: SearchResult, bot_username: str) -> types.InlineQueryResultArticle:
+    title = html.escape(result.title or "")
+    if result.kind == "task":
+        heading, text = f"✅ {result.title}", f"✅ Задача: {title}"
+    else:
+        heading, text = f"📁 {result.title}", f"📁 Проект: {title}"
+    if result.date:
+        text += f"\n⏰ Дедлайн: {result.date.strftime('%d.%m.%Y')}"
+    return types.InlineQueryResultArticle(
+        id=f"{result.kind}:{result.id}",
+        title=heading,
+        description=("Задача, " if result.kind == "task" else "Проект, ") + _deadline(result),
+        input_message_content=types.InputTextMessageContent(message_text=text),
+        reply_markup=_result_keyboard(result, bot_username),
+    )
+
+@router.inline_query()
+async def inline_lookup(inline_query: types.InlineQuery, db):
+    user_id, query_id = inline_query.from_user.id, inline_query.id
+    inline_debouncer.begin(user_id, query_id)
+    try:
+        if INLINE_DEBOUNCE:
+            await asyncio.sleep(INLINE_DEBOUNCE)
+        if inline_debouncer.is_superseded(user_id, query_id):
+            return
+        page = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+        results, has_next = await find_items(db, user_id, inline_query.query, page)
+        if inline_debouncer.is_superseded(user_id, query_id):
+            return
+        bot_username = (await inline_query.bot.me()).username
+        await inline_query.answer(
+            [_article(result, bot_username) for result in results[:RESULTS_LIMIT]],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            next_offset=str(page + 1) if has_next else "",
+        )
+    finally:
+        inline_debouncer.finish(user_id, query_id)
+
+async def _edit_inline_message(callback: types.CallbackQuery, text: str) -> None:
+    if callback.inline_message_id:
+        await callback.bot.edit_message_text(text, inline_message_id=callback.inline_message_id)
+
+@router.callback_query(InlineCallback.on("complete_task"))
+async def complete_task_inline(callback: types.CallbackQuery, callback_data: InlineCallback, db):
+    # Сообщение могли переслать в общий чат: завершить задачу может только ее владелец
+    task = await task_repo.complete(db, callback.from_user.id, callback_data.id)
+    if task is None:
+        await callback.answer("Задача не найдена или уже выполнена")
+        return
+    await db.commit()
+    keyboard_cache.invalidate(callback.from_user.id)
+    entity_cache.invalidate(Task, callback_data.id)
+    await callback.answer("Задача выполнена!")
+    await _edit_inline_message(callback, f"✅ Задача выполнена: {html.escape(task.title)}")
+
+@router.callback_query(InlineCallback.on("complete_project"))
+async def complete_project_inline(callback: types.CallbackQuery, callback_data: InlineCallback, db):
+    project = await project_repo.complete(db, callback.from_user.id, callback_data.id)
+    if project is None:
+        await callback.answer("Проект не найден или уже завершен")
+        return
+    await db.commit()
+    keyboard_cache.invalidate(project.user_id)
+    entity_cache.invalidate(Project, project.id)
+    await callback.answer("Проект завершен!")
+    await _edit_inline_message(callback, f"✅ Проект завершен: {html.escape(project.name)}")
+
+async def open_from_link(message: types.Message, payload: str, db):
+    """/start task_<id> или project_<id> - кнопка «Открыть в боте» под inline-результатом"""
+    from handlers.projects import project_actions_keyboard, project_card_text
+    from handlers.tasks import task_actions_keyboard, task_card_text
+
+    kind, item_id = OPEN_PAYLOAD.match(payload).groups()
+    if kind == "task":
+        task = await task_repo.get(db, message.from_user.id, int(item_id))
+        if task is None:
+            await message.answer("Задача не найдена!")
+            return
+        await message.answer(task_card_text(task), reply_markup=task_actions_keyboard(task.id))
+    else:
+        project = await project_repo.get(db, message.from_user.id, int(item_id))
+        if project is None:
+            await message.answer("Проект не найден!")
+            return
+        await message.answer(
+            project_card_text(project),
+            reply_markup=project_actions_keyboard(project.id, project.type, project.status),
+        )
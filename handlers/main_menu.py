@@ -1,11 +1,12 @@
-from aiogram import Router, types, F
-from aiogram.filters import CommandStart
+from aiogram import types, F
+from aiogram.filters import CommandObject, CommandStart
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from keyboards.callbacks import MenuCallback
+from handlers.routing import IndexedRouter
 
-router = Router()
+router = IndexedRouter()
 
-@router.message(CommandStart())
-async def cmd_start(message: types.Message):
+def _build_main_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.add(
         types.KeyboardButton(text="📁 Проекты"),
@@ -14,10 +15,21 @@ async def cmd_start(message: types.Message):
         types.KeyboardButton(text="📊 Статистика")
     )
     builder.adjust(2)
-    
+    return builder.as_markup(resize_keyboard=True)
+
+MAIN_KEYBOARD = _build_main_keyboard()
+
+# Ссылка из inline-результата: /start task_<id> или /start project_<id>
+@router.message(CommandStart(deep_link=True, magic=F.args.regexp(r"^(task|project)_\d+$")))
+async def cmd_start_open(message: types.Message, command: CommandObject, db):
+    from handlers.inline import open_from_link
+    await open_from_link(message, command.args, db)
+
+@router.message(CommandStart())
+async def cmd_start(message: types.Message):
     await message.answer(
         "Добро пожаловать в менеджер проектов!\nВыберите раздел:",
-        reply_markup=builder.as_markup(resize_keyboard=True)
+        reply_markup=MAIN_KEYBOARD
     )
 
 @router.message(F.text == "📁 Проекты")
@@ -38,8 +50,8 @@ async def show_expenses_menu(message: types.Message):
 @router.message(F.text == "📊 Статистика")
 async def show_statistics(message: types.Message, db):
     from handlers.statistics import send_statistics
-    await send_statistics(message, db)
+    await send_statistics(message, db, message.from_user.id)
 
-@router.callback_query(F.data == "main_menu")
+@router.callback_query(MenuCallback.on("main"))
 async def back_to_main_menu(callback: types.CallbackQuery):
     await cmd_start(callback.message)
\ No newline at end of file
@@ -1,16 +1,21 @@
-from aiogram import Router, types, F
+from aiogram import types
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from datetime import datetime
+from functools import partial
 from models import Project, ProjectType, ProjectStatus
-from sqlalchemy import select, update, delete
 from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
 from keyboards.calendar import get_calendar
 from aiogram.exceptions import TelegramBadRequest
+from services.entity_cache import MISSING, entity_cache
+from services.repositories import projects as project_repo
+from keyboards.cache import keyboard_cache
+from keyboards.callbacks import MenuCallback, ProjectCallback, SkipCallback
+from handlers.routing import IndexedRouter
+from services.writer import write
 
-router = Router()
+router = IndexedRouter()
 
 class ProjectForm(StatesGroup):
     name = State()
@@ -22,14 +27,14 @@ class ProjectForm(StatesGroup):
 class EditProjectForm(StatesGroup):
     status = State()
 
-def projects_main_keyboard():
+def _build_projects_main_keyboard():
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="📋 Мои проекты", callback_data="my_projects"),
-        types.InlineKeyboardButton(text="💰 Заказы", callback_data="orders"),
-        types.InlineKeyboardButton(text="✅ Завершенные", callback_data="completed_projects"),
-        types.InlineKeyboardButton(text="➕ Добавить проект", callback_data="add_project"),
-        types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="📋 Мои проекты", callback_data=ProjectCallback(action="my").pack()),
+        types.InlineKeyboardButton(text="💰 Заказы", callback_data=ProjectCallback(action="orders").pack()),
+        types.InlineKeyboardButton(text="✅ Завершенные", callback_data=ProjectCallback(action="completed").pack()),
+        types.InlineKeyboardButton(text="➕ Добавить проект", callback_data=ProjectCallback(action="add").pack()),
+        types.InlineKeyboardButton(text="◀️ Назад", callback_data=MenuCallback(action="main").pack())
     )
     builder.adjust(2)
     return builder.as_markup()
@@ -41,51 +46,80 @@ def project_actions_keyboard(project_id, project_type, current_status):
     if current_status != ProjectStatus.COMPLETED:
         builder.add(types.InlineKeyboardButton(
             text="✅ Завершить", 
-            callback_data=f"complete_project_{project_id}"
+            callback_data=ProjectCallback(action="complete", id=project_id).pack()
         ))
     
     builder.add(types.InlineKeyboardButton(
         text="📊 Изменить статус", 
-        callback_data=f"change_status_{project_id}"
+        callback_data=ProjectCallback(action="change_status", id=project_id).pack()
     ))
     
     builder.add(
         types.InlineKeyboardButton(
             text="✏️ Редактировать", 
-            callback_data=f"edit_project_{project_id}"
+            callback_data=ProjectCallback(action="edit", id=project_id).pack()
         ),
         types.InlineKeyboardButton(
             text="🗑️ Удалить", 
-            callback_data=f"delete_project_{project_id}"
+            callback_data=ProjectCallback(action="delete", id=project_id).pack()
         ),
         types.InlineKeyboardButton(
             text="◀️ Назад", 
-            callback_data="projects_menu"
+            callback_data=ProjectCallback(action="menu").pack()
         )
     )
     builder.adjust(1)
     return builder.as_markup()
 
-def get_status_keyboard(project_type):
+def _build_status_keyboard(project_type):
     builder = InlineKeyboardBuilder()
     
     if project_type == ProjectType.PERSONAL:
         builder.add(
-            types.InlineKeyboardButton(text="💡 Идея", callback_data="status_idea"),
-            types.InlineKeyboardButton(text="🚀 В разработке", callback_data="status_in_progress"),
-            types.InlineKeyboardButton(text="✅ Завершен", callback_data="status_completed")
+            types.InlineKeyboardButton(text="💡 Идея", callback_data=ProjectCallback(action="status", value=ProjectStatus.IDEA.value).pack()),
+            types.InlineKeyboardButton(text="🚀 В разработке", callback_data=ProjectCallback(action="status", value=ProjectStatus.IN_PROGRESS.value).pack()),
+            types.InlineKeyboardButton(text="✅ Завершен", callback_data=ProjectCallback(action="status", value=ProjectStatus.COMPLETED.value).pack())
         )
     else:  # ProjectType.ORDER
         builder.add(
-            types.InlineKeyboardButton(text="📋 На согласовании", callback_data="status_agreement"),
-            types.InlineKeyboardButton(text="🚀 В разработке", callback_data="status_in_progress"),
-            types.InlineKeyboardButton(text="✅ Завершен", callback_data="status_completed")
+            types.InlineKeyboardButton(text="📋 На согласовании", callback_data=ProjectCallback(action="status", value=ProjectStatus.AGREEMENT.value).pack()),
+            types.InlineKeyboardButton(text="🚀 В разработке", callback_data=ProjectCallback(action="status", value=ProjectStatus.IN_PROGRESS.value).pack()),
+            types.InlineKeyboardButton(text="✅ Завершен", callback_data=ProjectCallback(action="status", value=ProjectStatus.COMPLETED.value).pack())
         )
     
-    builder.add(types.InlineKeyboardButton(text="◀️ Отмена", callback_data="cancel_status"))
+    builder.add(types.InlineKeyboardButton(text="◀️ Отмена", callback_data=ProjectCallback(action="cancel_status").pack()))
     builder.adjust(1)
     return builder.as_markup()
 
+def _build_project_type_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        types.InlineKeyboardButton(text="Личный проект", callback_data=ProjectCallback(action="type", value=ProjectType.PERSONAL.value).pack()),
+        types.InlineKeyboardButton(text="Заказ", callback_data=ProjectCallback(action="type", value=ProjectType.ORDER.value).pack())
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
+def _build_skip_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data=SkipCallback(action="deadline").pack()))
+    return builder.as_markup()
+
+# Статические клавиатуры не зависят от пользователя и строятся один раз при импорте
+PROJECTS_MAIN_KEYBOARD = _build_projects_main_keyboard()
+STATUS_KEYBOARDS = {project_type: _build_status_keyboard(project_type) for project_type in ProjectType}
+PROJECT_TYPE_KEYBOARD = _build_project_type_keyboard()
+SKIP_KEYBOARD = _build_skip_keyboard()
+
+def projects_main_keyboard():
+    return PROJECTS_MAIN_KEYBOARD
+
+def get_status_keyboard(project_type):
+    return STATUS_KEYBOARDS[project_type]
+
+def get_skip_keyboard():
+    return SKIP_KEYBOARD
+
 async def safe_edit_message(message: types.Message, text: str, reply_markup=None):
     """Безопасное редактирование сообщения с обработкой ошибки 'message not modified'"""
     try:
@@ -96,127 +130,62 @@ async def safe_edit_message(message: types.Message, text: str, reply_markup=None
         else:
             raise
 
-@router.callback_query(F.data == "projects_menu")
+@router.callback_query(ProjectCallback.on("menu"))
 async def show_projects_menu(callback: types.CallbackQuery):
     await safe_edit_message(callback.message, "Управление проектами:", projects_main_keyboard())
 
-@router.callback_query(F.data == "my_projects")
-async def show_my_projects(callback: types.CallbackQuery, db):
-    result = await db.execute(
-        select(Project).where(
-            Project.user_id == callback.from_user.id,
-            Project.type == ProjectType.PERSONAL,
-            Project.status != ProjectStatus.COMPLETED
-        )
-    )
-    projects = result.scalars().all()
-    
-    if not projects:
-        await callback.message.answer("У вас нет активных личных проектов.", reply_markup=projects_main_keyboard())
-        try:
-            await callback.message.delete()
-        except:
-            pass
-        return
-    
-    builder = InlineKeyboardBuilder()
-    for project in projects:
-        builder.add(types.InlineKeyboardButton(
-            text=f"{project.name} ({project.status.value})", 
-            callback_data=f"project_{project.id}"
-        ))
+async def get_projects_list_keyboard(db, user_id, kind):
+    """Клавиатура со списком проектов пользователя, кэшируется до изменения его проектов"""
+    markup = keyboard_cache.get(user_id, kind)
+    if markup is not MISSING:
+        return markup
+    
+    token = keyboard_cache.token()
+    projects = await project_repo.list_rows(db, user_id, kind)
+    
+    markup = None
+    if projects:
+        builder = InlineKeyboardBuilder()
+        for project in projects:
+            # Для завершенных проектов показываем тип, для остальных - статус
+            label = project.type.value if kind == "completed_projects" else project.status.value
+            builder.add(types.InlineKeyboardButton(
+                text=f"{project.name} ({label})", 
+                callback_data=ProjectCallback(action="open", id=project.id).pack()
+            ))
+        
+        builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data=ProjectCallback(action="menu").pack()))
+        builder.adjust(1)
+        markup = builder.as_markup()
     
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="projects_menu"))
-    builder.adjust(1)
+    keyboard_cache.set(user_id, kind, markup, token)
+    return markup
+
+async def send_projects_list(callback: types.CallbackQuery, db, kind, title, empty_text):
+    markup = await get_projects_list_keyboard(db, callback.from_user.id, kind)
     
-    await callback.message.answer("Ваши проекты:", reply_markup=builder.as_markup())
+    if markup is None:
+        await callback.message.answer(empty_text, reply_markup=projects_main_keyboard())
+    else:
+        await callback.message.answer(title, reply_markup=markup)
     try:
         await callback.message.delete()
     except:
         pass
 
-@router.callback_query(F.data == "orders")
+@router.callback_query(ProjectCallback.on("my"))
+async def show_my_projects(callback: types.CallbackQuery, db):
+    await send_projects_list(callback, db, "my_projects", "Ваши проекты:", "У вас нет активных личных проектов.")
+
+@router.callback_query(ProjectCallback.on("orders"))
 async def show_orders(callback: types.CallbackQuery, db):
-    result = await db.execute(
-        select(Project).where(
-            Project.user_id == callback.from_user.id,
-            Project.type == ProjectType.ORDER,
-            Project.status != ProjectStatus.COMPLETED
-        )
-    )
-    projects = result.scalars().all()
-    
-    if not projects:
-        await callback.message.answer("У вас нет активных заказов.", reply_markup=projects_main_keyboard())
-        try:
-            await callback.message.delete()
-        except:
-            pass
-        return
-    
-    builder = InlineKeyboardBuilder()
-    for project in projects:
-        builder.add(types.InlineKeyboardButton(
-            text=f"{project.name} ({project.status.value})", 
-            callback_data=f"project_{project.id}"
-        ))
-    
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="projects_menu"))
-    builder.adjust(1)
-    
-    await callback.message.answer("Ваши заказы:", reply_markup=builder.as_markup())
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    await send_projects_list(callback, db, "orders", "Ваши заказы:", "У вас нет активных заказов.")
 
-@router.callback_query(F.data == "completed_projects")
+@router.callback_query(ProjectCallback.on("completed"))
 async def show_completed_projects(callback: types.CallbackQuery, db):
-    result = await db.execute(
-        select(Project).where(
-            Project.user_id == callback.from_user.id,
-            Project.status == ProjectStatus.COMPLETED
-        )
-    )
-    projects = result.scalars().all()
-    
-    if not projects:
-        await callback.message.answer("У вас нет завершенных проектов.", reply_markup=projects_main_keyboard())
-        try:
-            await callback.message.delete()
-        except:
-            pass
-        return
-    
-    builder = InlineKeyboardBuilder()
-    for project in projects:
-        builder.add(types.InlineKeyboardButton(
-            text=f"{project.name} ({project.type.value})", 
-            callback_data=f"project_{project.id}"
-        ))
-    
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="projects_menu"))
-    builder.adjust(1)
-    
-    await callback.message.answer("Завершенные проекты:", reply_markup=builder.as_markup())
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    await send_projects_list(callback, db, "completed_projects", "Завершенные проекты:", "У вас нет завершенных проектов.")
 
-@router.callback_query(F.data.startswith("project_"))
-async def show_project(callback: types.CallbackQuery, db):
-    project_id = int(callback.data.split("_")[1])
-    
-    result = await db.execute(
-        select(Project).where(Project.id == project_id)
-    )
-    project = result.scalar_one_or_none()
-    
-    if not project:
-        await callback.answer("Проект не найден!")
-        return
-    
+def project_card_text(project):
     project_text = f"""
 📁 Проект: {project.name}
 📝 Тип: {project.type.value}
@@ -231,9 +200,20 @@ async def show_project(callback: types.CallbackQuery, db):
     
     if project.completed_at:
         project_text += f"✅ Завершен: {project.completed_at.strftime('%d.%m.%Y')}\n"
+    return project_text
+
+@router.callback_query(ProjectCallback.on("open"))
+async def show_project(callback: types.CallbackQuery, callback_data: ProjectCallback, db):
+    project_id = callback_data.id
+    
+    project = await project_repo.get(db, callback.from_user.id, project_id)
+    
+    if not project:
+        await callback.answer("Проект не найден!")
+        return
     
     await callback.message.answer(
-        project_text, 
+        project_card_text(project), 
         reply_markup=project_actions_keyboard(project_id, project.type, project.status)
     )
     try:
@@ -241,40 +221,28 @@ async def show_project(callback: types.CallbackQuery, db):
     except:
         pass
 
-@router.callback_query(F.data.startswith("complete_project_"))
-async def complete_project(callback: types.CallbackQuery, db):
-    project_id = int(callback.data.split("_")[2])
+@router.callback_query(ProjectCallback.on("complete"))
+async def complete_project(callback: types.CallbackQuery, callback_data: ProjectCallback, db):
+    project_id = callback_data.id
     
-    result = await db.execute(
-        select(Project).where(Project.id == project_id)
-    )
-    project = result.scalar_one_or_none()
+    project = await project_repo.complete(db, callback.from_user.id, project_id)
     
     if not project:
-        await callback.answer("Проект не найден!")
+        await callback.answer("Проект не найден или уже завершен!")
         return
     
-    await db.execute(
-        update(Project)
-        .where(Project.id == project_id)
-        .values(
-            status=ProjectStatus.COMPLETED,
-            completed_at=datetime.now()
-        )
-    )
     await db.commit()
+    keyboard_cache.invalidate(project.user_id)
+    entity_cache.invalidate(Project, project_id)
     
     await callback.answer("Проект завершен!")
     await show_projects_menu(callback)
 
-@router.callback_query(F.data.startswith("change_status_"))
-async def start_change_status(callback: types.CallbackQuery, state: FSMContext, db):
-    project_id = int(callback.data.split("_")[2])
+@router.callback_query(ProjectCallback.on("change_status"))
+async def start_change_status(callback: types.CallbackQuery, callback_data: ProjectCallback, state: FSMContext, db):
+    project_id = callback_data.id
     
-    result = await db.execute(
-        select(Project).where(Project.id == project_id)
-    )
-    project = result.scalar_one_or_none()
+    project = await project_repo.get(db, callback.from_user.id, project_id)
     
     if not project:
         await callback.answer("Проект не найден!")
@@ -292,53 +260,52 @@ async def start_change_status(callback: types.CallbackQuery, state: FSMContext,
     except:
         pass
 
-@router.callback_query(EditProjectForm.status, F.data.startswith("status_"))
-async def process_change_status(callback: types.CallbackQuery, state: FSMContext, db):
+@router.callback_query(EditProjectForm.status, ProjectCallback.on("status"))
+async def process_change_status(callback: types.CallbackQuery, callback_data: ProjectCallback, state: FSMContext, db):
     data = await state.get_data()
     project_id = data['project_id']
     
     # Определяем новый статус
-    status_mapping = {
-        "status_idea": ProjectStatus.IDEA,
-        "status_agreement": ProjectStatus.AGREEMENT,
-        "status_in_progress": ProjectStatus.IN_PROGRESS,
-        "status_completed": ProjectStatus.COMPLETED
-    }
-    
-    new_status = status_mapping.get(callback.data)
+    try:
+        new_status = ProjectStatus(callback_data.value)
+    except ValueError:
+        new_status = None
     
+    project = None
     if new_status:
-        await db.execute(
-            update(Project)
-            .where(Project.id == project_id)
-            .values(status=new_status)
-        )
+        project = await project_repo.change_status(db, callback.from_user.id, project_id, new_status)
+    
+    if project:
         await db.commit()
+        keyboard_cache.invalidate(project.user_id)
+        entity_cache.invalidate(Project, project_id)
         
         await callback.answer(f"Статус изменен на: {new_status.value}")
     
     await state.clear()
     await show_projects_menu(callback)
 
-@router.callback_query(EditProjectForm.status, F.data == "cancel_status")
+@router.callback_query(EditProjectForm.status, ProjectCallback.on("cancel_status"))
 async def cancel_change_status(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer("Изменение статуса отменено")
     await show_projects_menu(callback)
 
-@router.callback_query(F.data.startswith("delete_project_"))
-async def delete_project(callback: types.CallbackQuery, db):
-    project_id = int(callback.data.split("_")[2])
+@router.callback_query(ProjectCallback.on("delete"))
+async def delete_project(callback: types.CallbackQuery, callback_data: ProjectCallback, db):
+    project_id = callback_data.id
     
-    await db.execute(
-        delete(Project).where(Project.id == project_id)
-    )
-    await db.commit()
+    project = await project_repo.remove(db, callback.from_user.id, project_id)
+    if project:
+        await db.commit()
+        keyboard_cache.invalidate(project.user_id)
+        # Задачи в кэше остаются со ссылкой на удаленный проект и показываются без проекта
+        entity_cache.invalidate(Project, project_id)
     
     await callback.answer("Проект удален!")
     await show_projects_menu(callback)
 
-@router.callback_query(F.data == "add_project")
+@router.callback_query(ProjectCallback.on("add"))
 async def start_add_project(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(ProjectForm.name)
     await callback.message.answer("Введите название проекта:")
@@ -352,26 +319,19 @@ async def process_project_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text)
     await state.set_state(ProjectForm.type)
     
-    builder = InlineKeyboardBuilder()
-    builder.add(
-        types.InlineKeyboardButton(text="Личный проект", callback_data="personal"),
-        types.InlineKeyboardButton(text="Заказ", callback_data="order")
-    )
-    builder.adjust(1)
-    
-    await message.answer("Выберите тип проекта:", reply_markup=builder.as_markup())
+    await message.answer("Выберите тип проекта:", reply_markup=PROJECT_TYPE_KEYBOARD)
 
-@router.callback_query(ProjectForm.type, F.data.in_(["personal", "order"]))
-async def process_project_type(callback: types.CallbackQuery, state: FSMContext):
-    project_type = ProjectType.PERSONAL if callback.data == "personal" else ProjectType.ORDER
+@router.callback_query(ProjectForm.type, ProjectCallback.on("type"))
+async def process_project_type(callback: types.CallbackQuery, callback_data: ProjectCallback, state: FSMContext):
+    project_type = ProjectType.ORDER if callback_data.value == ProjectType.ORDER.value else ProjectType.PERSONAL
     await state.update_data(type=project_type)
     
     # Устанавливаем начальный статус в зависимости от типа
-    initial_status = ProjectStatus.IDEA if callback.data == "personal" else ProjectStatus.AGREEMENT
+    initial_status = ProjectStatus.IDEA if project_type == ProjectType.PERSONAL else ProjectStatus.AGREEMENT
     await state.update_data(status=initial_status)
     
     # Если это заказ, запрашиваем стоимость
-    if callback.data == "order":
+    if project_type == ProjectType.ORDER:
         await state.set_state(ProjectForm.cost)
         await callback.message.answer("Введите стоимость заказа:")
     else:
@@ -395,7 +355,7 @@ async def process_project_cost(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("Пожалуйста, введите корректную сумму:")
 
-@router.callback_query(ProjectForm.deadline, F.data == "skip_deadline")
+@router.callback_query(ProjectForm.deadline, SkipCallback.on("deadline"))
 async def skip_deadline(callback: types.CallbackQuery, state: FSMContext, db):
     await process_project_data(callback, state, db, None)
 
@@ -418,20 +378,15 @@ async def process_project_data(callback: types.CallbackQuery, state: FSMContext,
     project = Project(
         user_id=callback.from_user.id,
         name=data['name'],
-        type=data['type'],
-        status=data['status'],
+        type=ProjectType(data['type']),
+        status=ProjectStatus(data['status']),
         deadline=deadline,
         cost=data.get('cost')
     )
     
-    db.add(project)
-    await db.commit()
+    await write(db, partial(project_repo.add, project=project))
+    keyboard_cache.invalidate(project.user_id)
     
     await state.clear()
     await callback.message.answer("Проект успешно создан!")
     await show_projects_menu(callback)
-
-def get_skip_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data="skip_deadline"))
-    return builder.as_markup()
\ No newline at end of file
@@ -0,0 +1,84 @@
+from typing import Any, Dict, List, Optional
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters.callback_data import CallbackQueryFilter
+from aiogram.types import CallbackQuery
+
+from keyboards.callbacks import CallbackAction
+
+def _handler_key(handler: HandlerObject) -> Optional[str]:
+    """Ключ обработчика в таблице: "prefix:action" для CallbackAction, "prefix" для фабрики.filter()"""
+    for filter_object in handler.filters or ():
+        callback = filter_object.callback
+        if isinstance(callback, CallbackAction):
+            return callback.key
+        if isinstance(callback, CallbackQueryFilter):
+            return callback.callback_data.__prefix__
+    return None
+
+class IndexedCallbackObserver(TelegramEventObserver):
+    """
+    Наблюдатель callback_query, который проверяет не все обработчики подряд, а только
+    подходящие по префиксу и действию из callback_data (один поиск в словаре).
+    Обработчики без ключа (F.data == ..., собственные фильтры) проверяются всегда,
+    порядок регистрации сохраняется.
+    """
+
+    def __init__(self, router: Router, event_name: str = "callback_query") -> None:
+        super().__init__(router=router, event_name=event_name)
+        self._index: Optional[Dict[str, List[HandlerObject]]] = None
+        self._unkeyed: List[HandlerObject] = []
+
+    def register(self, callback, *filters, flags=None, **kwargs):
+        self._index = None
+        return super().register(callback, *filters, flags=flags, **kwargs)
+
+    def _build_index(self) -> Dict[str, List[HandlerObject]]:
+        keys = [(handler, _handler_key(handler)) for handler in self.handlers]
+        self._unkeyed = [handler for handler, key in keys if key is None]
+
+        index: Dict[str, List[HandlerObject]] = {}
+        for key in {key for _, key in keys if key is not None}:
+            prefix = key.partition(":")[0]
+            index[key] = [handler for handler, k in keys if k in (key, prefix, None)]
+            index.setdefault(prefix, [handler for handler, k in keys if k in (prefix, None)])
+        return index
+
+    def candidates(self, data: Optional[str]) -> List[HandlerObject]:
+        if self._index is None:
+            self._index = self._build_index()
+        if not data:
+            return self._unkeyed
+        prefix, _, rest = data.partition(":")
+        handlers = self._index.get(f"{prefix}:{rest.partition(':')[0]}")
+        if handlers is None:
+            handlers = self._index.get(prefix, self._unkeyed)
+        return handlers
+
+    async def trigger(self, event: CallbackQuery, **kwargs: Any) -> Any:
+        # Повторяет TelegramEventObserver.trigger, но перебирает только кандидатов
+        for handler in self.candidates(event.data):
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    wrapped_inner = self.outer_middleware.wrap_middlewares(
+                        self._resolve_middlewares(),
+                        handler.call,
+                    )
+                    return await wrapped_inner(event, kwargs)
+                except SkipHandler:
+                    continue
+
+        return UNHANDLED
+
+class IndexedRouter(Router):
+    """Router с таблицей диспетчеризации callback_query по префиксу callback_data"""
+
+    def __init__(self, *, name: Optional[str] = None) -> None:
+        super().__init__(name=name)
+        self.callback_query = self.observers["callback_query"] = IndexedCallbackObserver(router=self)
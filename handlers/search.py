@@ -0,0 +1,84 @@
+import html
+
+from aiogram import types
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from keyboards.callbacks import ExpenseCallback, MenuCallback, ProjectCallback, SearchCallback, TaskCallback
+from handlers.routing import IndexedRouter
+from services.search import SearchResult, search
+
+router = IndexedRouter()
+
+class SearchForm(StatesGroup):
+    query = State()
+
+BUTTON_TEXT_LIMIT = 60
+
+def _result_button(result: SearchResult) -> types.InlineKeyboardButton:
+    title = result.title or ""
+    if len(title) > BUTTON_TEXT_LIMIT:
+        title = title[:BUTTON_TEXT_LIMIT - 1] + "…"
+    if result.kind == "task":
+        return types.InlineKeyboardButton(text=f"✅ {title}", callback_data=TaskCallback(action="open", id=result.id).pack())
+    if result.kind == "project":
+        return types.InlineKeyboardButton(text=f"📁 {title}", callback_data=ProjectCallback(action="open", id=result.id).pack())
+    date = result.date.strftime('%d.%m.%Y') if result.date else ""
+    return types.InlineKeyboardButton(
+        text=f"💸 {result.amount} руб., {date}: {title}",
+        callback_data=ExpenseCallback(action="open", id=result.id).pack(),
+    )
+
+def search_results_keyboard(results, page: int, has_next: bool):
+    builder = InlineKeyboardBuilder()
+    for result in results:
+        builder.row(_result_button(result))
+    navigation = []
+    if page > 0:
+        navigation.append(types.InlineKeyboardButton(text="◀️", callback_data=SearchCallback(action="page", page=page - 1).pack()))
+    if has_next:
+        navigation.append(types.InlineKeyboardButton(text="▶️", callback_data=SearchCallback(action="page", page=page + 1).pack()))
+    if navigation:
+        builder.row(*navigation)
+    builder.row(types.InlineKeyboardButton(text="◀️ В меню", callback_data=MenuCallback(action="main").pack()))
+    return builder.as_markup()
+
+async def _search_page(db, user_id: int, query: str, page: int):
+    results, has_next = await search(db, user_id, query, page)
+    if not results and page == 0:
+        return f"🔍 По запросу «{html.escape(query)}» ничего не найдено.", None
+    text = f"🔍 Результаты по запросу «{html.escape(query)}», страница {page + 1}:"
+    return text, search_results_keyboard(results, page, has_next)
+
+async def run_search(message: types.Message, state: FSMContext, db, user_id: int, query: str):
+    # Текст запроса нужен для перелистывания страниц: в callback_data он может не поместиться
+    await state.set_state(None)
+    await state.update_data(search_query=query)
+    text, markup = await _search_page(db, user_id, query, 0)
+    await message.answer(text, reply_markup=markup)
+
+@router.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext, db):
+    if command.args:
+        await run_search(message, state, db, message.from_user.id, command.args.strip())
+        return
+    await state.set_state(SearchForm.query)
+    await message.answer("Введите слова для поиска по задачам, проектам и комментариям к расходам:")
+
+@router.message(SearchForm.query)
+async def process_search_query(message: types.Message, state: FSMContext, db):
+    if not message.text:
+        await message.answer("Отправьте текст для поиска.")
+        return
+    await run_search(message, state, db, message.from_user.id, message.text.strip())
+
+@router.callback_query(SearchCallback.on("page"))
+async def show_search_page(callback: types.CallbackQuery, callback_data: SearchCallback, state: FSMContext, db):
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search")
+        return
+    text, markup = await _search_page(db, callback.from_user.id, query, max(callback_data.page, 0))
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
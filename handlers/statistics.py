@@ -1,46 +1,53 @@
-from aiogram import Router, types, F
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime
-from models import Project, Expense, ProjectStatus, ProjectType
-from sqlalchemy import select, func
+from models import ProjectStatus
+from services.analytics import MONTH, WEEK, YEAR, change_percent, period_report
+from services.charts import (
+    EXPENSE_TREND, INCOME_EXPENSES, PROJECT_STATUS, Chart, ChartsBusy, ChartsUnavailable, chart_renderer, charts_available
+)
+from services.repositories import projects as project_repo
+from services.stats import get_user_stats
+from keyboards.callbacks import AnalyticsCallback, MenuCallback
+from handlers.routing import IndexedRouter
 
-router = Router()
+router = IndexedRouter()
 
-async def send_statistics(message: types.Message, db):
-    user_id = message.from_user.id
-    
-    # Получаем статистику по проектам
-    completed_projects = await db.execute(
-        select(func.count()).where(
-            Project.user_id == user_id,
-            Project.status == ProjectStatus.COMPLETED
-        )
-    )
-    completed_count = completed_projects.scalar()
-    
-    active_projects = await db.execute(
-        select(func.count()).where(
-            Project.user_id == user_id,
-            Project.status != ProjectStatus.COMPLETED
-        )
-    )
-    active_count = active_projects.scalar()
-    
-    # Получаем доходы (только завершенные заказы)
-    income_result = await db.execute(
-        select(func.sum(Project.cost)).where(
-            Project.user_id == user_id,
-            Project.type == ProjectType.ORDER,
-            Project.status == ProjectStatus.COMPLETED
-        )
-    )
-    income = income_result.scalar() or 0
-    
-    # Получаем расходы
-    expenses_result = await db.execute(
-        select(func.sum(Expense.amount)).where(Expense.user_id == user_id)
-    )
-    expenses = expenses_result.scalar() or 0
+def _build_statistics_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(types.InlineKeyboardButton(text="📅 По неделям", callback_data=AnalyticsCallback(action=WEEK).pack()))
+    builder.add(types.InlineKeyboardButton(text="🗓 По месяцам", callback_data=AnalyticsCallback(action=MONTH).pack()))
+    builder.add(types.InlineKeyboardButton(text="📆 По годам", callback_data=AnalyticsCallback(action=YEAR).pack()))
+    if charts_available():
+        builder.add(types.InlineKeyboardButton(text="📈 Графики", callback_data=AnalyticsCallback(action="charts").pack()))
+    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data=MenuCallback(action="main").pack()))
+    builder.adjust(3, 1, 1)
+    return builder.as_markup()
+
+STATISTICS_KEYBOARD = _build_statistics_keyboard()
+
+# Сколько периодов показывать и как назвать предыдущий период в сравнении
+PERIODS = {
+    WEEK: (12, "По неделям", "к прошлой неделе"),
+    MONTH: (12, "По месяцам", "к прошлому месяцу"),
+    YEAR: (None, "По годам", "к прошлому году"),
+}
+
+STATUS_LABELS = {
+    ProjectStatus.IDEA: "Идея",
+    ProjectStatus.AGREEMENT: "Согласование",
+    ProjectStatus.IN_PROGRESS: "В работе",
+    ProjectStatus.COMPLETED: "Завершен",
+}
+
+async def send_statistics(message: types.Message, db, user_id: int):
+    # Сводная статистика хранится в user_stats и обновляется при изменениях
+    stats = await get_user_stats(db, user_id)
+    completed_count = stats.completed_projects
+    active_count = stats.active_projects
+    income = stats.income
+    expenses = stats.expenses
     
     # Рассчитываем прибыль
     profit = income - expenses
@@ -54,11 +61,93 @@ async def send_statistics(message: types.Message, db):
         f"💵 Прибыль: {profit} руб."
     )
     
-    builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu"))
-    
-    await message.answer(message_text, reply_markup=builder.as_markup())
+    await message.answer(message_text, reply_markup=STATISTICS_KEYBOARD)
 
-@router.callback_query(F.data == "statistics")
+@router.callback_query(MenuCallback.on("statistics"))
 async def show_stats(callback: types.CallbackQuery, db):
-    await send_statistics(callback.message, db)
\ No newline at end of file
+    # callback.message отправлен ботом, пользователь - callback.from_user
+    await send_statistics(callback.message, db, callback.from_user.id)
+def _money(value: float) -> str:
+    value = round(value, 2)
+    return f"{value:.0f}" if value == int(value) else f"{value:.2f}"
+
+def _change(current: float, previous: float) -> str:
+    percent = change_percent(current, previous)
+    return "—" if percent is None else f"{percent:+.1f}%"
+
+def format_period_report(granularity: str, totals) -> str:
+    _, title, compare = PERIODS[granularity]
+    if not any(period.expense_count or period.income_count for period in totals):
+        return f"📈 {title}: данных пока нет"
+
+    lines = [f"📈 {title}:\n"]
+    for period in totals:
+        lines.append(f"{period.label}: 💸 {_money(period.expenses)} | 💰 {_money(period.income)} | 💵 {_money(period.profit)}")
+
+    count = len(totals)
+    lines.append("")
+    lines.append(
+        f"Среднее: 💸 {_money(sum(p.expenses for p in totals) / count)} | "
+        f"💰 {_money(sum(p.income for p in totals) / count)} руб."
+    )
+    if count > 1:
+        current, previous = totals[-1], totals[-2]
+        lines.append(
+            f"{current.label} {compare}: расходы {_change(current.expenses, previous.expenses)}, "
+            f"доходы {_change(current.income, previous.income)}"
+        )
+    return "\n".join(lines)
+
+@router.callback_query(AnalyticsCallback.on(WEEK))
+@router.callback_query(AnalyticsCallback.on(MONTH))
+@router.callback_query(AnalyticsCallback.on(YEAR))
+async def show_period_analytics(callback: types.CallbackQuery, callback_data: AnalyticsCallback, db):
+    granularity = callback_data.action
+    count = PERIODS[granularity][0]
+    totals = await period_report(db, callback.from_user.id, granularity, count or 0)
+    try:
+        await callback.message.edit_text(format_period_report(granularity, totals), reply_markup=STATISTICS_KEYBOARD)
+    except TelegramBadRequest:
+        # Тот же отчет уже на экране
+        pass
+    await callback.answer()
+
+async def build_charts(db, user_id: int):
+    """Данные графиков: расходы и доходы за 12 месяцев из сводной таблицы, проекты по статусам"""
+    months = await period_report(db, user_id, MONTH, 12)
+    labels = [period.label for period in months]
+    expenses = [round(period.expenses, 2) for period in months]
+    charts = [
+        Chart(EXPENSE_TREND, {"title": "Расходы по месяцам", "labels": labels, "expenses": expenses}),
+        Chart(INCOME_EXPENSES, {
+            "title": "Доходы и расходы",
+            "labels": labels,
+            "income": [round(period.income, 2) for period in months],
+            "expenses": expenses,
+        }),
+    ]
+    counts = await project_repo.status_counts(db, user_id)
+    statuses = [(status, counts[status]) for status in ProjectStatus if counts.get(status)]
+    if statuses:
+        charts.append(Chart(PROJECT_STATUS, {
+            "title": "Проекты по статусам",
+            "labels": [STATUS_LABELS.get(status, status.value) for status, _ in statuses],
+            "counts": [count for _, count in statuses],
+        }))
+    return charts
+
+async def send_charts(message: types.Message, db, user_id: int):
+    charts = await build_charts(db, user_id)
+    # Соединение с БД не нужно на время рендера и загрузки
+    await db.close()
+    try:
+        await chart_renderer.send(message, charts)
+    except ChartsBusy:
+        await message.answer("Сейчас строится слишком много графиков, попробуйте через минуту.")
+    except ChartsUnavailable:
+        await message.answer("Графики недоступны на этом сервере.")
+
+@router.callback_query(AnalyticsCallback.on("charts"))
+async def show_charts(callback: types.CallbackQuery, db):
+    await callback.answer("Строю графики...")
+    await send_charts(callback.message, db, callback.from_user.id)
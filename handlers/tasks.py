@@ -1,13 +1,20 @@
-from aiogram import Router, types, F
+from aiogram import types
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from datetime import datetime
-from models import Task, Project, ProjectStatus
-from sqlalchemy import select, update, delete
+from functools import partial
+from models import Task
 from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
 from keyboards.calendar import get_calendar
+from keyboards.cache import keyboard_cache
+from keyboards.callbacks import MenuCallback, SkipCallback, TaskCallback
+from keyboards.selection import get_selection, save_selection, selection_keyboard
+from handlers.routing import IndexedRouter
+from services.entity_cache import MISSING, entity_cache
+from services.repositories import projects as project_repo
+from services.repositories import tasks as task_repo
+from services.writer import write
 
 
 class TaskForm(StatesGroup):
@@ -16,14 +23,25 @@ class TaskForm(StatesGroup):
     project_id = State()
     deadline = State()
 
-router = Router()
+class TaskBulkForm(StatesGroup):
+    # Выбор задач галочками, затем для переноса - выбор проекта, для дедлайна - дата
+    select = State()
+    project = State()
+    deadline = State()
 
-def tasks_main_keyboard():
+# Ключ выбранных задач в данных FSM и сколько задач показывается для выбора
+# (Telegram не принимает клавиатуры примерно из сотни кнопок и больше)
+SELECTION_KEY = "bulk_tasks"
+SELECTION_LIMIT = 50
+
+router = IndexedRouter()
+
+def _build_tasks_main_keyboard():
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="📋 Мои задачи", callback_data="my_tasks"),
-        types.InlineKeyboardButton(text="➕ Добавить задачу", callback_data="add_task"),
-        types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="📋 Мои задачи", callback_data=TaskCallback(action="list").pack()),
+        types.InlineKeyboardButton(text="➕ Добавить задачу", callback_data=TaskCallback(action="add").pack()),
+        types.InlineKeyboardButton(text="◀️ Назад", callback_data=MenuCallback(action="main").pack())
     )
     builder.adjust(1)
     return builder.as_markup()
@@ -33,51 +51,61 @@ def task_actions_keyboard(task_id):
     builder.add(
         types.InlineKeyboardButton(
             text="✅ Выполнить", 
-            callback_data=f"complete_task_{task_id}"
+            callback_data=TaskCallback(action="complete", id=task_id).pack()
         ),
         types.InlineKeyboardButton(
             text="✏️ Редактировать", 
-            callback_data=f"edit_task_{task_id}"
+            callback_data=TaskCallback(action="edit", id=task_id).pack()
         ),
         types.InlineKeyboardButton(
             text="🗑️ Удалить", 
-            callback_data=f"delete_task_{task_id}"
+            callback_data=TaskCallback(action="delete", id=task_id).pack()
         ),
         types.InlineKeyboardButton(
             text="◀️ Назад", 
-            callback_data="tasks_menu"
+            callback_data=TaskCallback(action="menu").pack()
         )
     )
     builder.adjust(1)
     return builder.as_markup()
 
-def get_skip_keyboard():
+def _build_skip_keyboard():
     builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data="skip_description"))
+    builder.add(types.InlineKeyboardButton(text="Пропустить", callback_data=SkipCallback(action="description").pack()))
     return builder.as_markup()
 
-async def show_projects_for_selection(message: types.Message, db):
-    # Получаем активные проекты пользователя
-    result = await db.execute(
-        select(Project).where(
-            Project.user_id == message.from_user.id,
-            Project.status != ProjectStatus.COMPLETED
-        )
-    )
-    projects = result.scalars().all()
-    
-    builder = InlineKeyboardBuilder()
-    for project in projects:
-        builder.add(types.InlineKeyboardButton(
-            text=project.name, 
-            callback_data=f"select_project_{project.id}"  # Изменили префикс
-        ))
-    
-    builder.add(types.InlineKeyboardButton(text="Без проекта", callback_data="select_no_project"))
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="tasks_menu"))
-    builder.adjust(1)
+# Статические клавиатуры строятся один раз при импорте
+TASKS_MAIN_KEYBOARD = _build_tasks_main_keyboard()
+SKIP_KEYBOARD = _build_skip_keyboard()
+
+def tasks_main_keyboard():
+    return TASKS_MAIN_KEYBOARD
+
+def get_skip_keyboard():
+    return SKIP_KEYBOARD
+
+async def show_projects_for_selection(message: types.Message, db, user_id):
+    # message может быть сообщением бота (после нажатия кнопки), поэтому пользователь передается явно
+    markup = keyboard_cache.get(user_id, "task_projects")
+    if markup is MISSING:
+        token = keyboard_cache.token()
+        # Получаем активные проекты пользователя
+        projects = await project_repo.open_choices(db, user_id)
+        
+        builder = InlineKeyboardBuilder()
+        for project in projects:
+            builder.add(types.InlineKeyboardButton(
+                text=project.name, 
+                callback_data=TaskCallback(action="select_project", id=project.id).pack()
+            ))
+        
+        builder.add(types.InlineKeyboardButton(text="Без проекта", callback_data=TaskCallback(action="select_project").pack()))
+        builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data=TaskCallback(action="menu").pack()))
+        builder.adjust(1)
+        markup = builder.as_markup()
+        keyboard_cache.set(user_id, "task_projects", markup, token)
     
-    await message.answer("Выберите проект для задачи:", reply_markup=builder.as_markup())
+    await message.answer("Выберите проект для задачи:", reply_markup=markup)
 
 async def process_task_data(callback: types.CallbackQuery, state: FSMContext, db, deadline):
     data = await state.get_data()
@@ -90,61 +118,60 @@ async def process_task_data(callback: types.CallbackQuery, state: FSMContext, db
         deadline=deadline
     )
     
-    db.add(task)
-    await db.commit()
+    await write(db, partial(task_repo.add, task=task))
+    keyboard_cache.invalidate(task.user_id)
     
     await state.clear()
     await callback.message.edit_text("Задача успешно создана!")
     await show_tasks_menu(callback)
 
-@router.callback_query(F.data == "tasks_menu")
+@router.callback_query(TaskCallback.on("menu"))
 async def show_tasks_menu(callback: types.CallbackQuery):
     await callback.message.edit_text("Управление задачами:", reply_markup=tasks_main_keyboard())
 
-@router.callback_query(F.data == "my_tasks")
+async def get_task_rows(db, user_id):
+    """(id, подпись) активных задач пользователя, кэшируется до изменения его задач и проектов"""
+    rows = keyboard_cache.get(user_id, "task_rows")
+    if rows is MISSING:
+        token = keyboard_cache.token()
+        tasks = await task_repo.list_active(db, user_id)
+        rows = [
+            (task.id, f"{task.title} ({task.project.name if task.project else 'Без проекта'})")
+            for task in tasks
+        ]
+        keyboard_cache.set(user_id, "task_rows", rows, token)
+    return rows
+
+@router.callback_query(TaskCallback.on("list"))
 async def show_my_tasks(callback: types.CallbackQuery, db):
-    result = await db.execute(
-        select(Task).where(
-            Task.user_id == callback.from_user.id,
-            Task.is_completed == False
-        )
-    )
-    tasks = result.scalars().all()
+    markup = keyboard_cache.get(callback.from_user.id, "my_tasks")
+    if markup is MISSING:
+        token = keyboard_cache.token()
+        rows = await get_task_rows(db, callback.from_user.id)
+        
+        markup = None
+        if rows:
+            builder = InlineKeyboardBuilder()
+            for task_id, label in rows:
+                builder.add(types.InlineKeyboardButton(
+                    text=label, 
+                    callback_data=TaskCallback(action="open", id=task_id).pack()
+                ))
+            
+            builder.add(types.InlineKeyboardButton(text="☑️ Выбрать несколько", callback_data=TaskCallback(action="select").pack()))
+            builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data=TaskCallback(action="menu").pack()))
+            builder.adjust(1)
+            markup = builder.as_markup()
+        keyboard_cache.set(callback.from_user.id, "my_tasks", markup, token)
     
-    if not tasks:
+    if markup is None:
         await callback.message.edit_text("У вас нет активных задач.", reply_markup=tasks_main_keyboard())
         return
     
-    builder = InlineKeyboardBuilder()
-    for task in tasks:
-        project_name = "Без проекта"
-        if task.project_id:
-            project_result = await db.execute(select(Project.name).where(Project.id == task.project_id))
-            project_name = project_result.scalar()
-        
-        builder.add(types.InlineKeyboardButton(
-            text=f"{task.title} ({project_name})", 
-            callback_data=f"task_{task.id}"  # Оставляем старый формат для отображения задач
-        ))
-    
-    builder.add(types.InlineKeyboardButton(text="◀️ Назад", callback_data="tasks_menu"))
-    builder.adjust(1)
-    
-    await callback.message.edit_text("Ваши задачи:", reply_markup=builder.as_markup())
+    await callback.message.edit_text("Ваши задачи:", reply_markup=markup)
 
-@router.callback_query(F.data.regexp(r'^task_\d+$'))
-async def show_task(callback: types.CallbackQuery, db):
-    task_id = int(callback.data.split("_")[1])
-    
-    result = await db.execute(
-        select(Task).where(Task.id == task_id)
-    )
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        await callback.answer("Задача не найдена!")
-        return
-    
+def task_card_text(task):
+    # task.project должен быть загружен заранее (task_repo.get или joinedload)
     task_text = f"""
 ✅ Задача: {task.title}
 """
@@ -152,51 +179,194 @@ async def show_task(callback: types.CallbackQuery, db):
     if task.description:
         task_text += f"📝 Описание: {task.description}\n"
     
-    if task.project_id:
-        project_result = await db.execute(select(Project.name).where(Project.id == task.project_id))
-        project_name = project_result.scalar()
-        task_text += f"📁 Проект: {project_name}\n"
+    if task.project:
+        task_text += f"📁 Проект: {task.project.name}\n"
     
     if task.deadline:
         task_text += f"⏰ Дедлайн: {task.deadline.strftime('%d.%m.%Y')}\n"
     
     task_text += f"📊 Статус: {'Выполнена' if task.is_completed else 'Активна'}\n"
+    return task_text
+
+@router.callback_query(TaskCallback.on("open"))
+async def show_task(callback: types.CallbackQuery, callback_data: TaskCallback, db):
+    task_id = callback_data.id
+    
+    task = await task_repo.get(db, callback.from_user.id, task_id)
+    
+    if not task:
+        await callback.answer("Задача не найдена!")
+        return
     
     await callback.message.edit_text(
-        task_text, 
+        task_card_text(task), 
         reply_markup=task_actions_keyboard(task_id)
     )
 
-@router.callback_query(F.data.startswith("complete_task_"))
-async def complete_task(callback: types.CallbackQuery, db):
-    task_id = int(callback.data.split("_")[2])
+@router.callback_query(TaskCallback.on("complete"))
+async def complete_task(callback: types.CallbackQuery, callback_data: TaskCallback, db):
+    task_id = callback_data.id
     
-    await db.execute(
-        update(Task)
-        .where(Task.id == task_id)
-        .values(
-            is_completed=True,
-            completed_at=datetime.now()
-        )
-    )
+    task = await task_repo.complete(db, callback.from_user.id, task_id)
+    if task is None:
+        await callback.answer("Задача не найдена или уже выполнена!")
+        return
     await db.commit()
+    keyboard_cache.invalidate(callback.from_user.id)
+    entity_cache.invalidate(Task, task_id)
     
     await callback.answer("Задача выполнена!")
     await show_tasks_menu(callback)
 
-@router.callback_query(F.data.startswith("delete_task_"))
-async def delete_task(callback: types.CallbackQuery, db):
-    task_id = int(callback.data.split("_")[2])
+@router.callback_query(TaskCallback.on("delete"))
+async def delete_task(callback: types.CallbackQuery, callback_data: TaskCallback, db):
+    task_id = callback_data.id
     
-    await db.execute(
-        delete(Task).where(Task.id == task_id)
-    )
+    task = await task_repo.remove(db, callback.from_user.id, task_id)
+    if task is None:
+        await callback.answer("Задача не найдена!")
+        return
     await db.commit()
+    keyboard_cache.invalidate(callback.from_user.id)
+    entity_cache.invalidate(Task, task_id)
     
     await callback.answer("Задача удалена!")
     await show_tasks_menu(callback)
 
-@router.callback_query(F.data == "add_task")
+# Массовые действия: выбор хранится в FSM, действие - один запрос и одна правка сообщения
+
+BULK_ACTIONS = (
+    ("✅ Выполнить", TaskCallback(action="bulk_complete").pack()),
+    ("🗑️ Удалить", TaskCallback(action="bulk_delete").pack()),
+    ("📁 В проект", TaskCallback(action="bulk_move").pack()),
+    ("⏰ Дедлайн", TaskCallback(action="bulk_deadline").pack()),
+    ("◀️ Отмена", TaskCallback(action="bulk_cancel").pack()),
+)
+
+def _toggle_callback(task_id):
+    return TaskCallback(action="toggle", id=task_id).pack()
+
+async def get_selectable_rows(db, user_id):
+    rows = await get_task_rows(db, user_id)
+    return rows[:SELECTION_LIMIT], len(rows) > SELECTION_LIMIT
+
+async def show_task_selection(callback: types.CallbackQuery, db, selected):
+    rows, truncated = await get_selectable_rows(db, callback.from_user.id)
+    if not rows:
+        await callback.message.edit_text("У вас нет активных задач.", reply_markup=tasks_main_keyboard())
+        return
+    markup = selection_keyboard(rows, selected, _toggle_callback, TaskCallback(action="toggle_all").pack(), BULK_ACTIONS)
+    shown = f"первые {SELECTION_LIMIT}, " if truncated else ""
+    await callback.message.edit_text(f"Отметьте задачи ({shown}выбрано: {len(selected)}):", reply_markup=markup)
+
+@router.callback_query(TaskCallback.on("select"))
+async def start_task_selection(callback: types.CallbackQuery, state: FSMContext, db):
+    await state.set_state(TaskBulkForm.select)
+    await save_selection(state, SELECTION_KEY, ())
+    await show_task_selection(callback, db, set())
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("toggle"))
+async def toggle_task(callback: types.CallbackQuery, callback_data: TaskCallback, state: FSMContext, db):
+    selected = await get_selection(state, SELECTION_KEY) ^ {callback_data.id}
+    await save_selection(state, SELECTION_KEY, selected)
+    await show_task_selection(callback, db, selected)
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("toggle_all"))
+async def toggle_all_tasks(callback: types.CallbackQuery, state: FSMContext, db):
+    rows, _ = await get_selectable_rows(db, callback.from_user.id)
+    task_ids = {task_id for task_id, _ in rows}
+    selected = set() if task_ids <= await get_selection(state, SELECTION_KEY) else task_ids
+    await save_selection(state, SELECTION_KEY, selected)
+    await show_task_selection(callback, db, selected)
+
+@router.callback_query(StateFilter(TaskBulkForm), TaskCallback.on("bulk_cancel"))
+async def cancel_task_selection(callback: types.CallbackQuery, state: FSMContext, db):
+    await state.clear()
+    await show_my_tasks(callback, db)
+
+async def _selected_or_warn(callback: types.CallbackQuery, state: FSMContext):
+    selected = await get_selection(state, SELECTION_KEY)
+    if not selected:
+        await callback.answer("Не выбрано ни одной задачи")
+    return selected
+
+async def _finish_bulk(callback: types.CallbackQuery, state: FSMContext, db, changed, text):
+    await db.commit()
+    keyboard_cache.invalidate(callback.from_user.id)
+    for task_id in changed:
+        entity_cache.invalidate(Task, task_id)
+    await state.clear()
+    await callback.message.edit_text(f"{text}: {len(changed)}\n\nУправление задачами:", reply_markup=tasks_main_keyboard())
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("bulk_complete"))
+async def complete_selected_tasks(callback: types.CallbackQuery, state: FSMContext, db):
+    selected = await _selected_or_warn(callback, state)
+    if selected:
+        changed = await task_repo.complete_many(db, callback.from_user.id, selected)
+        await _finish_bulk(callback, state, db, changed, "Выполнено задач")
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("bulk_delete"))
+async def delete_selected_tasks(callback: types.CallbackQuery, state: FSMContext, db):
+    selected = await _selected_or_warn(callback, state)
+    if selected:
+        changed = await task_repo.remove_many(db, callback.from_user.id, selected)
+        await _finish_bulk(callback, state, db, changed, "Удалено задач")
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("bulk_move"))
+async def choose_selected_tasks_project(callback: types.CallbackQuery, state: FSMContext, db):
+    if not await _selected_or_warn(callback, state):
+        return
+    builder = InlineKeyboardBuilder()
+    for project in await project_repo.open_choices(db, callback.from_user.id):
+        builder.add(types.InlineKeyboardButton(
+            text=project.name,
+            callback_data=TaskCallback(action="bulk_project", id=project.id).pack()
+        ))
+    builder.add(types.InlineKeyboardButton(text="Без проекта", callback_data=TaskCallback(action="bulk_project").pack()))
+    builder.add(types.InlineKeyboardButton(text="◀️ Отмена", callback_data=TaskCallback(action="bulk_cancel").pack()))
+    builder.adjust(1)
+    await state.set_state(TaskBulkForm.project)
+    await callback.message.edit_text("Выберите проект для выбранных задач:", reply_markup=builder.as_markup())
+
+@router.callback_query(TaskBulkForm.project, TaskCallback.on("bulk_project"))
+async def move_selected_tasks(callback: types.CallbackQuery, callback_data: TaskCallback, state: FSMContext, db):
+    # id=0 - кнопка "Без проекта"
+    selected = await get_selection(state, SELECTION_KEY)
+    changed = await task_repo.move_many(db, callback.from_user.id, selected, callback_data.id or None)
+    await _finish_bulk(callback, state, db, changed, "Перенесено задач")
+
+@router.callback_query(TaskBulkForm.select, TaskCallback.on("bulk_deadline"))
+async def choose_selected_tasks_deadline(callback: types.CallbackQuery, state: FSMContext):
+    if not await _selected_or_warn(callback, state):
+        return
+    await state.set_state(TaskBulkForm.deadline)
+    await callback.message.edit_text(
+        "Выберите дедлайн для выбранных задач ('Пропустить' - убрать дедлайн):",
+        reply_markup=await get_calendar()
+    )
+
+@router.callback_query(SkipCallback.on("date"), TaskBulkForm.deadline)
+async def clear_selected_tasks_deadline(callback: types.CallbackQuery, state: FSMContext, db):
+    selected = await get_selection(state, SELECTION_KEY)
+    changed = await task_repo.set_deadline_many(db, callback.from_user.id, selected, None)
+    await _finish_bulk(callback, state, db, changed, "Дедлайн убран у задач")
+
+@router.callback_query(SimpleCalendarCallback.filter(), TaskBulkForm.deadline)
+async def set_selected_tasks_deadline(
+    callback: types.CallbackQuery,
+    callback_data: SimpleCalendarCallback,
+    state: FSMContext,
+    db
+):
+    calendar = SimpleCalendar()
+    selected, date = await calendar.process_selection(callback, callback_data)
+    
+    if selected:
+        task_ids = await get_selection(state, SELECTION_KEY)
+        changed = await task_repo.set_deadline_many(db, callback.from_user.id, task_ids, date)
+        await _finish_bulk(callback, state, db, changed, "Дедлайн назначен задачам")
+
+@router.callback_query(TaskCallback.on("add"))
 async def start_add_task(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(TaskForm.title)
     await callback.message.edit_text("Введите название задачи:")
@@ -207,11 +377,11 @@ async def process_task_title(message: types.Message, state: FSMContext):
     await state.set_state(TaskForm.description)
     await message.answer("Введите описание задачи:", reply_markup=get_skip_keyboard())
 
-@router.callback_query(F.data == "skip_description", TaskForm.description)
+@router.callback_query(SkipCallback.on("description"), TaskForm.description)
 async def skip_task_description(callback: types.CallbackQuery, state: FSMContext, db):
     await state.update_data(description=None)
     await state.set_state(TaskForm.project_id)
-    await show_projects_for_selection(callback.message, db)
+    await show_projects_for_selection(callback.message, db, callback.from_user.id)
 
 @router.message(TaskForm.description)
 async def process_task_description(message: types.Message, state: FSMContext, db):
@@ -221,14 +391,15 @@ async def process_task_description(message: types.Message, state: FSMContext, db
         await state.update_data(description=None)
     
     await state.set_state(TaskForm.project_id)
-    await show_projects_for_selection(message, db)
+    await show_projects_for_selection(message, db, message.from_user.id)
 
-@router.callback_query(F.data.startswith("select_"), TaskForm.project_id)
-async def process_task_project(callback: types.CallbackQuery, state: FSMContext):
-    if callback.data == "select_no_project":
-        project_id = None
-    else:
-        project_id = int(callback.data.split("_")[2])  # Теперь индекс 2, так как префикс из двух частей
+@router.callback_query(TaskCallback.on("select_project"), TaskForm.project_id)
+async def process_task_project(callback: types.CallbackQuery, callback_data: TaskCallback, state: FSMContext, db):
+    # id=0 - кнопка "Без проекта"
+    project_id = callback_data.id or None
+    if project_id and await project_repo.get(db, callback.from_user.id, project_id) is None:
+        await callback.answer("Проект не найден!")
+        return
     
     await state.update_data(project_id=project_id)
     await state.set_state(TaskForm.deadline)
@@ -238,7 +409,7 @@ async def process_task_project(callback: types.CallbackQuery, state: FSMContext)
         reply_markup=await get_calendar()
     )
 
-@router.callback_query(F.data == "skip", TaskForm.deadline)
+@router.callback_query(SkipCallback.on("date"), TaskForm.deadline)
 async def skip_task_deadline(callback: types.CallbackQuery, state: FSMContext, db):
     await process_task_data(callback, state, db, None)
 
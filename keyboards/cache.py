@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from services.entity_cache import MISSING
+
+class UserKeyboardCache:
+    """
+    Кэш динамических клавиатур (списки проектов и задач) по пользователям.
+    Хранит не больше max_users пользователей, вытесняя давно не обращавшихся.
+    Обработчики, меняющие проекты или задачи, сбрасывают кэш пользователя через invalidate,
+    другие кэши тех же данных (результаты inline-запросов) подписываются через subscribe.
+
+    Клавиатура, построенная по данным, прочитанным до сброса, не попадает в кэш после него:
+    set принимает token, взятый до запроса, и пропускает запись, если пользователя с тех пор сбрасывали.
+    """
+
+    def __init__(self, max_users: int = 10_000):
+        self.max_users = max_users
+        self._users: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._subscribers: List[Callable[[int], None]] = []
+        # Номер последнего сброса по пользователям (не больше max_users); для вытесненных
+        # отсюда пользователей последним считается _floor - это лишь пропускает лишнюю запись
+        self._seq = 0
+        self._invalidated: "OrderedDict[int, int]" = OrderedDict()
+        self._floor = 0
+
+    def get(self, user_id: int, kind: str) -> Any:
+        entries = self._users.get(user_id)
+        if entries is None or kind not in entries:
+            self.misses += 1
+            return MISSING
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return entries[kind]
+
+    def token(self) -> int:
+        return self._seq
+
+    def invalidated_since(self, user_id: int, token: int) -> bool:
+        return self._invalidated.get(user_id, self._floor) > token
+
+    def set(self, user_id: int, kind: str, markup: Any, token: int) -> None:
+        if self.invalidated_since(user_id, token):
+            return
+        entries = self._users.get(user_id)
+        if entries is None:
+            entries = self._users[user_id] = {}
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        entries[kind] = markup
+
+    def subscribe(self, callback: Callable[[int], None]) -> None:
+        self._subscribers.append(callback)
+
+    def invalidate(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+        self._seq += 1
+        self._invalidated[user_id] = self._seq
+        self._invalidated.move_to_end(user_id)
+        if len(self._invalidated) > self.max_users:
+            _, seq = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, seq)
+        for callback in self._subscribers:
+            callback(user_id)
+
+keyboard_cache = UserKeyboardCache()
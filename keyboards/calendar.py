@@ -1,9 +1,10 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram_calendar import SimpleCalendar
+from keyboards.callbacks import SkipCallback
 
 async def get_calendar():
     calendar = SimpleCalendar()
     keyboard = await calendar.start_calendar()
     # Добавляем кнопку "Пропустить" к календарю
-    keyboard.inline_keyboard.append([InlineKeyboardButton(text="Пропустить", callback_data="skip_date")])
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="Пропустить", callback_data=SkipCallback(action="date").pack())])
     return keyboard
\ No newline at end of file
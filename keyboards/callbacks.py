@@ -0,0 +1,79 @@
+from typing import Any, Dict, Optional, Union
+
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+class CallbackAction(Filter):
+    """
+    Фильтр по фабрике callback-данных и действию, передает в обработчик распакованный callback_data.
+    Ключ "prefix:action" используется таблицей диспетчеризации IndexedRouter.
+    """
+
+    def __init__(self, factory, action: str):
+        self.factory = factory
+        self.action = action
+        self.key = f"{factory.__prefix__}{factory.__separator__}{action}"
+        self._key_with_separator = self.key + factory.__separator__
+
+    async def __call__(self, callback: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        data = callback.data
+        if not isinstance(data, str) or not (data == self.key or data.startswith(self._key_with_separator)):
+            return False
+        try:
+            return {"callback_data": self.factory.unpack(data)}
+        except (TypeError, ValueError):
+            return False
+
+class ActionCallback:
+    """Общая часть фабрик: первое поле - действие, по нему строится фильтр on()"""
+
+    @classmethod
+    def on(cls, action: str) -> CallbackAction:
+        return CallbackAction(cls, action)
+
+class MenuCallback(ActionCallback, CallbackData, prefix="menu"):
+    # main, statistics
+    action: str
+
+class ProjectCallback(ActionCallback, CallbackData, prefix="project"):
+    # menu, my, orders, completed, add, open, complete, change_status, edit, delete,
+    # type (value - тип проекта), status (value - новый статус), cancel_status
+    action: str
+    id: int = 0
+    value: Optional[str] = None
+
+class TaskCallback(ActionCallback, CallbackData, prefix="task"):
+    # menu, list, add, open, complete, edit, delete, select_project (id=0 - без проекта);
+    # массовые действия: select, toggle, toggle_all, bulk_complete, bulk_delete, bulk_move,
+    # bulk_project (id=0 - без проекта), bulk_deadline, bulk_cancel
+    action: str
+    id: int = 0
+
+class ExpenseCallback(ActionCallback, CallbackData, prefix="expense"):
+    # menu, add, history, open, edit, delete; массовое удаление: select, toggle, toggle_all, bulk_delete
+    action: str
+    id: int = 0
+
+class SkipCallback(ActionCallback, CallbackData, prefix="skip"):
+    # Кнопки "Пропустить" в формах: date, deadline, description, comment
+    action: str
+
+class ExportCallback(ActionCallback, CallbackData, prefix="export"):
+    # action - формат выгрузки: csv, jsonl
+    action: str
+    compress: bool = False
+
+class AnalyticsCallback(ActionCallback, CallbackData, prefix="analytics"):
+    # action - разбивка: week, month, year; charts - графики
+    action: str
+
+class SearchCallback(ActionCallback, CallbackData, prefix="search"):
+    # page - страница результатов поиска (текст запроса хранится в данных FSM)
+    action: str
+    page: int = 0
+
+class InlineCallback(ActionCallback, CallbackData, prefix="inline"):
+    # Кнопки под сообщениями, отправленными через inline-режим: complete_task, complete_project
+    action: str
+    id: int = 0
@@ -0,0 +1,65 @@
+"""
+Выбор нескольких элементов списка галочками (массовые действия с задачами и расходами).
+
+Выбранные id хранятся в данных FSM одной строкой: разности отсортированных id
+в base36 через точку ("2s.1.3"), поэтому выбор из десятков задач занимает десятки байт.
+"""
+from typing import Callable, Iterable, List, Sequence, Set, Tuple
+
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def _base36(value: int) -> str:
+    digits = ""
+    while True:
+        value, rest = divmod(value, 36)
+        digits = DIGITS[rest] + digits
+        if not value:
+            return digits
+
+def encode_ids(ids: Iterable[int]) -> str:
+    parts, previous = [], 0
+    for value in sorted(set(ids)):
+        parts.append(_base36(value - previous))
+        previous = value
+    return ".".join(parts)
+
+def decode_ids(data: str) -> List[int]:
+    ids, current = [], 0
+    for part in filter(None, data.split(".")):
+        current += int(part, 36)
+        ids.append(current)
+    return ids
+
+async def get_selection(state: FSMContext, key: str) -> Set[int]:
+    data = await state.get_data()
+    return set(decode_ids(data.get(key, "")))
+
+async def save_selection(state: FSMContext, key: str, selected: Iterable[int]) -> None:
+    await state.update_data({key: encode_ids(selected)})
+
+def selection_keyboard(
+    items: Sequence[Tuple[int, str]],
+    selected: Set[int],
+    toggle: Callable[[int], str],
+    toggle_all: str,
+    actions: Sequence[Tuple[str, str]],
+) -> types.InlineKeyboardMarkup:
+    """
+    Элементы (id, подпись) с галочками, кнопка "выбрать все / снять все" и кнопки действий
+    (текст, callback_data) по две в ряд
+    """
+    builder = InlineKeyboardBuilder()
+    for item_id, label in items:
+        mark = "☑️" if item_id in selected else "⬜"
+        builder.add(types.InlineKeyboardButton(text=f"{mark} {label}", callback_data=toggle(item_id)))
+
+    all_selected = bool(items) and all(item_id in selected for item_id, _ in items)
+    builder.add(types.InlineKeyboardButton(text="Снять все" if all_selected else "Выбрать все", callback_data=toggle_all))
+    for text, callback_data in actions:
+        builder.add(types.InlineKeyboardButton(text=text, callback_data=callback_data))
+    builder.adjust(*([1] * (len(items) + 1)), 2)
+    return builder.as_markup()
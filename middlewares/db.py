@@ -1,8 +1,55 @@
 from aiogram import BaseMiddleware
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram.types import TelegramObject
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from services.database import AsyncSessionLocal
 
+class LazySession:
+    """
+    Обертка над AsyncSession, создающая сессию только при первом обращении.
+    has_writes показывает, выполнялись ли в рамках апдейта изменения данных.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker):
+        self._session_factory = session_factory
+        self._session: Optional[AsyncSession] = None
+        self.has_writes = False
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+    def _get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_factory()
+            event.listen(self._session.sync_session, "after_flush", self._on_flush)
+            event.listen(self._session.sync_session, "do_orm_execute", self._on_execute)
+        return self._session
+
+    def _on_flush(self, session, flush_context):
+        self.has_writes = True
+
+    def _on_execute(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.has_writes = True
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get_session(), name)
+
+    async def finish(self) -> None:
+        """Фиксирует незавершенную транзакцию, если сессия вообще использовалась"""
+        if self._session is not None and self._session.in_transaction():
+            await self._session.commit()
+
+    async def rollback(self) -> None:
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
 class DatabaseMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -10,14 +57,15 @@ class DatabaseMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        async with AsyncSessionLocal() as session:
-            data['db'] = session
-            try:
-                result = await handler(event, data)
-                await session.commit()
-                return result
-            except Exception:
-                await session.rollback()
-                raise
-            finally:
-                await session.close()
\ No newline at end of file
+        # Соединение с БД берется только если обработчик действительно обратится к сессии
+        session = LazySession(AsyncSessionLocal)
+        data['db'] = session
+        try:
+            result = await handler(event, data)
+            await session.finish()
+            return result
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
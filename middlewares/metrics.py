@@ -0,0 +1,68 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher, Router
+from aiogram.types import TelegramObject
+
+from services.metrics import MetricsRegistry, current_handler, registry
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет время выполнения каждого обработчика, считает ошибки и выполняющиеся обработчики.
+    Подключается к апдейтам диспетчера снаружи DatabaseMiddleware (см. setup), поэтому
+    в замер и в SQL обработчика входит и фиксация транзакции после него. Имя обработчика
+    известно только внутри роутера: его сообщает inner middleware событий роутеров.
+    """
+
+    def __init__(self, metrics: MetricsRegistry = registry) -> None:
+        self.metrics = metrics
+        self._names: Dict[Callable, str] = {}
+
+    def setup(self, dispatcher: Dispatcher, *routers: Router) -> None:
+        """Вызывается до подключения DatabaseMiddleware: middleware апдейтов выполняются в порядке подключения"""
+        dispatcher.update.middleware(self)
+        for router in routers:
+            for event_name, observer in router.observers.items():
+                if event_name != "error":
+                    observer.middleware(self._bind_handler)
+
+    def _handler_name(self, data: Dict[str, Any]) -> str:
+        callback = data["handler"].callback
+        name = self._names.get(callback)
+        if name is None:
+            name = self._names[callback] = f"{callback.__module__}.{callback.__qualname__}"
+        return name
+
+    async def _bind_handler(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Значение сбрасывает __call__ после фиксации транзакции, а не после обработчика
+        current_handler.set(self.metrics.handler(self._handler_name(data)))
+        return await handler(event, data)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = current_handler.set(None)
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics = current_handler.get()
+            if metrics is not None:
+                metrics.errors += 1
+            raise
+        finally:
+            # Апдейты, для которых обработчик не нашелся, не замеряются
+            metrics = current_handler.get()
+            if metrics is not None:
+                metrics.observe(time.perf_counter() - started)
+            self.metrics.in_flight -= 1
+            current_handler.reset(token)
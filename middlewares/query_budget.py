@@ -0,0 +1,72 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Список SQL-запросов, выполненных в рамках текущего апдейта
+_statements: ContextVar[Optional[List[str]]] = ContextVar("sql_statements", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = _statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+def install_query_counter(engine: AsyncEngine) -> None:
+    """Подключает подсчет SQL-запросов к движку (повторный вызов безопасен)"""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+
+@contextmanager
+def count_statements():
+    """Собирает SQL-запросы, выполненные внутри блока, в возвращаемый список"""
+    statements: List[str] = []
+    token = _statements.set(statements)
+    try:
+        yield statements
+    finally:
+        _statements.reset(token)
+
+def current_statements() -> List[str]:
+    """Запросы текущего апдейта (пустой список вне QueryBudgetMiddleware)"""
+    return list(_statements.get() or [])
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    """
+    Ограничивает число SQL-запросов на один апдейт.
+    В строгом режиме (для тестов) превышение приводит к ошибке,
+    иначе только пишется предупреждение в лог.
+    """
+
+    def __init__(self, budget: int, strict: bool = True) -> None:
+        self.budget = budget
+        self.strict = strict
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with count_statements() as statements:
+            result = await handler(event, data)
+
+        if len(statements) > self.budget:
+            event_type = getattr(event, "event_type", type(event).__name__)
+            message = (
+                f"Превышен лимит SQL-запросов: {len(statements)} > {self.budget} ({event_type})\n"
+                + "\n".join(statements)
+            )
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return result
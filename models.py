@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, Text, Enum as SQLEnum
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from services.database import Base
 
@@ -16,9 +16,13 @@ class ProjectStatus(str, Enum):
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (
+        Index("ix_projects_user_type_status", "user_id", "type", "status"),
+        Index("ix_projects_deadline", "deadline"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(Integer)
     name = Column(String, index=True)
     type = Column(SQLEnum(ProjectType), default=ProjectType.PERSONAL)
     status = Column(SQLEnum(ProjectStatus), default=ProjectStatus.IDEA)
@@ -31,9 +35,14 @@ class Project(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_user_completed", "user_id", "is_completed"),
+        Index("ix_tasks_project_id", "project_id"),
+        Index("ix_tasks_completed_deadline", "is_completed", "deadline"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(Integer)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
     title = Column(String, index=True)
     description = Column(Text, nullable=True)
@@ -46,10 +55,51 @@ class Task(Base):
 
 class Expense(Base):
     __tablename__ = "expenses"
+    __table_args__ = (
+        Index("ix_expenses_user_date", "user_id", "date", "amount"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(Integer)
     amount = Column(Float)
     date = Column(DateTime, default=datetime.utcnow)
     comment = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UserStats(Base):
+    """Сводная статистика пользователя, обновляется вместе с проектами и расходами"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, primary_key=True)
+    completed_projects = Column(Integer, default=0, nullable=False)
+    active_projects = Column(Integer, default=0, nullable=False)
+    income = Column(Float, default=0, nullable=False)
+    expenses = Column(Float, default=0, nullable=False)
+
+class SentReminder(Base):
+    """Отправленные напоминания о дедлайнах (чтобы не отправлять повторно после перезапуска)"""
+    __tablename__ = "sent_reminders"
+    __table_args__ = (
+        UniqueConstraint("entity_type", "entity_id", "stage", "deadline", name="uq_sent_reminders"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    entity_type = Column(String, nullable=False)  # task | project
+    entity_id = Column(Integer, nullable=False)
+    stage = Column(String, nullable=False)  # upcoming | overdue
+    deadline = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, default=datetime.utcnow)
+
+class PeriodRollup(Base):
+    """
+    Расходы и доходы пользователя за период, обновляются вместе с исходными данными.
+    period: "M2024-03" - месяц, "W2024-09" - ISO-неделя (префикс разделяет диапазоны ключей)
+    """
+    __tablename__ = "period_rollups"
+    
+    user_id = Column(Integer, primary_key=True)
+    period = Column(String, primary_key=True)
+    expenses = Column(Float, default=0, nullable=False)
+    expense_count = Column(Integer, default=0, nullable=False)
+    income = Column(Float, default=0, nullable=False)
+    income_count = Column(Integer, default=0, nullable=False)
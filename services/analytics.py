@@ -0,0 +1,277 @@
+"""
+Аналитика по периодам: суммы расходов и доходов (завершенные заказы) по неделям, месяцам и годам.
+
+Данные берутся из period_rollups - по строке на пользователя и неделю/месяц, которые
+обновляются в той же транзакции, что и расходы с проектами. Отчет за несколько лет
+читает несколько десятков строк сводной таблицы, а не все расходы пользователя.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+
+from models import Expense, PeriodRollup, Project, ProjectStatus, ProjectType
+from services.database import insert_or_ignore
+from services.writer import Deltas, defer, register_deferred
+
+ROLLUP_FIELDS = ("expenses", "expense_count", "income", "income_count")
+
+WEEK, MONTH, YEAR = "week", "month", "year"
+
+def month_key(when: datetime) -> str:
+    return f"M{when.year:04d}-{when.month:02d}"
+
+def week_key(when: datetime) -> str:
+    year, week, _ = when.isocalendar()
+    return f"W{year:04d}-{week:02d}"
+
+def period_keys(when: datetime) -> Tuple[str, str]:
+    return month_key(when), week_key(when)
+
+def project_income(project: Optional[Project]) -> Optional[Tuple[datetime, float]]:
+    """Доход проекта и дата, к которой он относится (только завершенные заказы)"""
+    if project is None or project.status != ProjectStatus.COMPLETED or project.type != ProjectType.ORDER:
+        return None
+    if not project.cost:
+        return None
+    return project.completed_at or project.created_at or datetime.now(), project.cost
+
+async def apply_rollup_deltas(db, user_id: int, deltas: Dict[str, Dict[str, float]]) -> None:
+    """Применяет изменения {period: {поле: delta}} в текущей транзакции, создавая недостающие строки"""
+    for period, delta in deltas.items():
+        delta = {field: value for field, value in delta.items() if value}
+        if not delta:
+            continue
+        if defer("period_rollups", (user_id, period), delta):
+            continue
+        statement = (
+            update(PeriodRollup)
+            .where(PeriodRollup.user_id == user_id, PeriodRollup.period == period)
+            .values({field: getattr(PeriodRollup, field) + value for field, value in delta.items()})
+        )
+        result = await db.execute(statement)
+        if result.rowcount == 0:
+            # Нулевую строку могла одновременно вставить другая транзакция - тогда вставка пропускается
+            await db.execute(
+                insert_or_ignore(PeriodRollup.__table__).values(user_id=user_id, period=period, **dict.fromkeys(ROLLUP_FIELDS, 0))
+            )
+            await db.execute(statement)
+
+async def apply_rollup_batch(db, deltas: Deltas) -> None:
+    """
+    Изменения, накопленные пакетом групповой фиксации: {(user_id, period): delta}.
+    Недостающие строки вставляются нулевыми одним INSERT, затем все обновляются одним UPDATE executemany.
+    """
+    existing = set(
+        tuple(row)
+        for row in await db.execute(
+            select(PeriodRollup.user_id, PeriodRollup.period).where(
+                tuple_(PeriodRollup.user_id, PeriodRollup.period).in_(list(deltas))
+            )
+        )
+    )
+
+    table = PeriodRollup.__table__
+    missing = [
+        {"user_id": user_id, "period": period, **dict.fromkeys(ROLLUP_FIELDS, 0)}
+        for user_id, period in deltas
+        if (user_id, period) not in existing
+    ]
+    if missing:
+        await db.execute(insert_or_ignore(table), missing)
+    await db.execute(
+        update(table)
+        .where(table.c.user_id == bindparam("key_user_id"), table.c.period == bindparam("key_period"))
+        .values({field: table.c[field] + bindparam(f"delta_{field}") for field in ROLLUP_FIELDS}),
+        [
+            {"key_user_id": user_id, "key_period": period, **{f"delta_{field}": delta.get(field, 0) for field in ROLLUP_FIELDS}}
+            for (user_id, period), delta in deltas.items()
+        ],
+    )
+
+register_deferred("period_rollups", apply_rollup_batch)
+
+async def apply_rollup_delta(db, user_id: int, when: datetime, delta: Dict[str, float]) -> None:
+    await apply_rollup_deltas(db, user_id, {key: delta for key in period_keys(when)})
+
+async def apply_expense_rollup(db, user_id: int, when: datetime, amount: float, count: int = 1) -> None:
+    """Добавление (amount > 0) или удаление (amount < 0, count = -1) расхода"""
+    await apply_rollup_delta(db, user_id, when, {"expenses": amount, "expense_count": count})
+
+async def apply_project_income_change(
+    db,
+    user_id: int,
+    before: Optional[Tuple[datetime, float]],
+    after: Optional[Tuple[datetime, float]],
+) -> None:
+    if before == after:
+        return
+    if before is not None:
+        await apply_rollup_delta(db, user_id, before[0], {"income": -before[1], "income_count": -1})
+    if after is not None:
+        await apply_rollup_delta(db, user_id, after[0], {"income": after[1], "income_count": 1})
+
+def accumulate_rollups(
+    expenses: Iterable[Tuple[int, datetime, float]],
+    incomes: Iterable[Tuple[int, datetime, float]],
+) -> Dict[Tuple[int, str], Dict[str, float]]:
+    """Сводные строки по исходным (user_id, дата, сумма) - для пересборки и миграции"""
+    rollups: Dict[Tuple[int, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    for rows, amount_field, count_field in ((expenses, "expenses", "expense_count"), (incomes, "income", "income_count")):
+        for user_id, when, amount in rows:
+            for key in period_keys(when):
+                row = rollups[(user_id, key)]
+                row[amount_field] += amount or 0
+                row[count_field] += 1
+    return rollups
+
+def source_queries(user_id: Optional[int] = None):
+    expense_query = select(Expense.user_id, Expense.date, Expense.amount)
+    income_query = select(
+        Project.user_id, Project.completed_at, Project.created_at, Project.cost
+    ).where(
+        Project.status == ProjectStatus.COMPLETED,
+        Project.type == ProjectType.ORDER,
+        Project.cost != None,
+        Project.cost != 0,
+    )
+    if user_id is not None:
+        expense_query = expense_query.where(Expense.user_id == user_id)
+        income_query = income_query.where(Project.user_id == user_id)
+    return expense_query, income_query
+
+def income_rows(rows):
+    # Так же, как project_income: без даты завершения доход относится к дате создания
+    return ((uid, completed_at or created_at, cost) for uid, completed_at, created_at, cost in rows)
+
+async def compute_rollups(db, user_id: Optional[int] = None) -> Dict[Tuple[int, str], Dict[str, float]]:
+    expense_query, income_query = source_queries(user_id)
+    expenses = (await db.execute(expense_query)).all()
+    incomes = (await db.execute(income_query)).all()
+    return accumulate_rollups(expenses, income_rows(incomes))
+
+async def rebuild_rollups(db, user_id: Optional[int] = None) -> int:
+    rollups = await compute_rollups(db, user_id)
+    if user_id is None:
+        await db.execute(delete(PeriodRollup))
+    else:
+        await db.execute(delete(PeriodRollup).where(PeriodRollup.user_id == user_id))
+    if rollups:
+        await db.execute(
+            insert(PeriodRollup),
+            [{"user_id": uid, "period": period, **values} for (uid, period), values in rollups.items()],
+        )
+    return len(rollups)
+
+async def verify_rollups(db) -> List[int]:
+    """Пользователи, у которых period_rollups расходится с исходными данными"""
+    expected = await compute_rollups(db)
+    actual = {
+        (row.user_id, row.period): {field: getattr(row, field) for field in ROLLUP_FIELDS}
+        for row in (await db.execute(select(PeriodRollup))).scalars()
+    }
+    empty = dict.fromkeys(ROLLUP_FIELDS, 0)
+    drifted = set()
+    for key in expected.keys() | actual.keys():
+        want, have = expected.get(key, empty), actual.get(key, empty)
+        if any(abs((have[field] or 0) - (want[field] or 0)) > 1e-6 for field in ROLLUP_FIELDS):
+            drifted.add(key[0])
+    return sorted(drifted)
+
+class PeriodTotals:
+    __slots__ = ("label", "expenses", "expense_count", "income", "income_count")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.expenses = 0.0
+        self.expense_count = 0
+        self.income = 0.0
+        self.income_count = 0
+
+    @property
+    def profit(self) -> float:
+        return self.income - self.expenses
+
+def _recent_keys(granularity: str, count: int, now: datetime) -> List[str]:
+    if granularity == WEEK:
+        return [week_key(now - timedelta(weeks=i)) for i in reversed(range(count))]
+    keys = []
+    year, month = now.year, now.month
+    for _ in range(count):
+        keys.append(f"M{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(keys))
+
+def _label(key: str) -> str:
+    year, number = key[1:].split("-")
+    return f"{number}.{year}" if key[0] == "M" else f"{year}, неделя {int(number)}"
+
+async def period_report(db, user_id: int, granularity: str = MONTH, count: int = 12, now: Optional[datetime] = None) -> List[PeriodTotals]:
+    """
+    Итоги за последние count недель/месяцев (пустые периоды - нулевые) или по всем годам.
+    Читает только строки сводной таблицы из диапазона ключей (по первичному ключу).
+    """
+    now = now or datetime.now()
+    if granularity == YEAR:
+        start, end = "M", "N"
+    else:
+        keys = _recent_keys(granularity, count, now)
+        start, end = keys[0], keys[-1] + "~"
+    result = await db.execute(
+        select(PeriodRollup).where(
+            PeriodRollup.user_id == user_id,
+            PeriodRollup.period >= start,
+            PeriodRollup.period < end,
+        )
+    )
+    rows = result.scalars().all()
+
+    if granularity == YEAR:
+        totals: Dict[str, PeriodTotals] = {}
+        for row in rows:
+            year = row.period[1:5]
+            _add(totals.setdefault(year, PeriodTotals(year)), row)
+        return [totals[year] for year in sorted(totals)]
+
+    totals = {key: PeriodTotals(_label(key)) for key in keys}
+    for row in rows:
+        if row.period in totals:
+            _add(totals[row.period], row)
+    return [totals[key] for key in keys]
+
+def _add(totals: PeriodTotals, row: PeriodRollup) -> None:
+    totals.expenses += row.expenses or 0
+    totals.expense_count += row.expense_count or 0
+    totals.income += row.income or 0
+    totals.income_count += row.income_count or 0
+
+def change_percent(current: float, previous: float) -> Optional[float]:
+    if not previous:
+        return None
+    return (current - previous) / previous * 100
+
+async def main(command: str):
+    from services.database import AsyncSessionLocal, engine
+
+    try:
+        async with AsyncSessionLocal() as session:
+            if command == "rebuild":
+                rows = await rebuild_rollups(session)
+                await session.commit()
+                print(f"period_rollups пересобрана: {rows} строк")
+            else:
+                drifted = await verify_rollups(session)
+                if drifted:
+                    print(f"Расхождения у пользователей: {', '.join(map(str, drifted))}")
+                    raise SystemExit(1)
+                print("period_rollups совпадает с исходными данными")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m services.analytics verify | rebuild
+    import asyncio
+    import sys
+
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "verify"))
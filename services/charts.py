@@ -0,0 +1,227 @@
+"""
+Графики статистики: рендер в пуле процессов и кэш Telegram file_id.
+
+matplotlib рисует синхронно и занимает процессор на десятки миллисекунд, поэтому
+рендер идет в отдельных процессах, а в цикле событий только ожидание результата.
+Очередь рендера ограничена: при переполнении запрос отклоняется (ChartsBusy), а не копится.
+Готовые картинки кэшируются по хэшу исходных агрегатов: пока данные не изменились,
+повторно отправляется file_id уже загруженного фото, без рендера и загрузки.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaPhoto, Message
+
+logger = logging.getLogger(__name__)
+
+EXPENSE_TREND = "expense_trend"
+INCOME_EXPENSES = "income_expenses"
+PROJECT_STATUS = "project_status"
+
+def charts_available() -> bool:
+    # matplotlib - необязательная зависимость, без нее графики просто не предлагаются
+    return importlib.util.find_spec("matplotlib") is not None
+
+class ChartsUnavailable(Exception):
+    pass
+
+class ChartsBusy(Exception):
+    pass
+
+def render_chart(kind: str, data: Dict[str, Any]) -> bytes:
+    """Рисует график в PNG. Выполняется в процессе пула"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    # Figure без pyplot: нет глобального состояния, которое копилось бы в процессе пула
+    figure = Figure(figsize=(7, 4), dpi=100)
+    ax = figure.subplots()
+    labels = data["labels"]
+    if kind == EXPENSE_TREND:
+        ax.plot(labels, data["expenses"], marker="o", color="tab:red")
+        ax.fill_between(labels, data["expenses"], alpha=0.15, color="tab:red")
+        ax.set_ylabel("руб.")
+    elif kind == INCOME_EXPENSES:
+        positions = range(len(labels))
+        ax.bar([p - 0.2 for p in positions], data["income"], width=0.4, label="Доходы", color="tab:green")
+        ax.bar([p + 0.2 for p in positions], data["expenses"], width=0.4, label="Расходы", color="tab:red")
+        ax.set_xticks(list(positions), labels)
+        ax.set_ylabel("руб.")
+        ax.legend()
+    elif kind == PROJECT_STATUS:
+        ax.pie(data["counts"], labels=labels, autopct="%1.0f%%", startangle=90)
+        ax.axis("equal")
+    else:
+        raise ValueError(f"Неизвестный график: {kind}")
+    ax.set_title(data["title"])
+    if kind != PROJECT_STATUS:
+        ax.tick_params(axis="x", labelrotation=45)
+        ax.grid(axis="y", alpha=0.3)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+class Chart:
+    __slots__ = ("kind", "data", "key")
+
+    def __init__(self, kind: str, data: Dict[str, Any]):
+        self.kind = kind
+        self.data = data
+        # Ключ кэша - хэш агрегатов: одинаковые данные дают одну картинку для любого пользователя
+        payload = json.dumps([kind, data], sort_keys=True, ensure_ascii=False, default=str)
+        self.key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ChartRenderer:
+    """
+    Рендер графиков в пуле процессов с ограниченной очередью и LRU-кэшем file_id.
+    Одинаковые графики, запрошенные одновременно, рисуются один раз.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 8, cache_size: int = 1024):
+        self.configure(workers, max_pending, cache_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self._render_times: Deque[float] = deque(maxlen=1000)
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def configure(self, workers: int = 2, max_pending: int = 8, cache_size: int = 1024) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерний процесс не наследует цикл событий и соединения с БД родителя
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def render(self, chart: Chart) -> bytes:
+        future = self._rendering.get(chart.key)
+        if future is not None:
+            return await asyncio.shield(future)
+        if not charts_available():
+            raise ChartsUnavailable()
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ChartsBusy()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._rendering[chart.key] = future
+        self.pending += 1
+        started = time.monotonic()
+        try:
+            image = await loop.run_in_executor(self._get_executor(), render_chart, chart.kind, chart.data)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.failed += 1
+            future.set_exception(e)
+            # Исключение передается ожидающим через shield, здесь помечаем его полученным
+            future.exception()
+            raise
+        else:
+            self.renders += 1
+            self._render_times.append(time.monotonic() - started)
+            future.set_result(image)
+            return image
+        finally:
+            self.pending -= 1
+            del self._rendering[chart.key]
+
+    async def _media(self, charts: List[Chart]) -> List[InputMediaPhoto]:
+        media: List[Optional[InputMediaPhoto]] = []
+        missing = []
+        for chart in charts:
+            file_id = self._file_ids.get(chart.key)
+            if file_id is not None:
+                self._file_ids.move_to_end(chart.key)
+                self.hits += 1
+                media.append(InputMediaPhoto(media=file_id))
+            else:
+                self.misses += 1
+                media.append(None)
+                missing.append((len(media) - 1, chart))
+        images = await asyncio.gather(*(self.render(chart) for _, chart in missing))
+        for (index, chart), image in zip(missing, images):
+            media[index] = InputMediaPhoto(media=BufferedInputFile(image, filename=f"{chart.kind}.png"))
+        return media
+
+    def _remember(self, charts: List[Chart], messages: List[Message]) -> None:
+        for chart, message in zip(charts, messages):
+            if message.photo:
+                # Последний размер - исходное изображение
+                self._file_ids[chart.key] = message.photo[-1].file_id
+                self._file_ids.move_to_end(chart.key)
+        while len(self._file_ids) > self.cache_size:
+            self._file_ids.popitem(last=False)
+
+    def forget(self, charts: List[Chart]) -> None:
+        for chart in charts:
+            self._file_ids.pop(chart.key, None)
+
+    async def send(self, message: Message, charts: List[Chart]) -> List[Message]:
+        """Отправляет графики одним альбомом в чат сообщения"""
+        media = await self._media(charts)
+        try:
+            sent = await message.answer_media_group(media)
+        except TelegramBadRequest:
+            if not any(isinstance(item.media, str) for item in media):
+                raise
+            # Сохраненный file_id больше не принимается - рисуем заново
+            logger.warning("Кэшированный file_id графика отклонен, графики будут отрисованы заново")
+            self.forget(charts)
+            sent = await message.answer_media_group(await self._media(charts))
+        self._remember(charts, sent)
+        return sent
+
+    def stats(self) -> Dict[str, float]:
+        times = sorted(self._render_times)
+
+        def percentile(p):
+            return times[min(len(times) - 1, int(len(times) * p))] if times else 0
+
+        requests = self.hits + self.misses
+        return {
+            "pending": self.pending,
+            "cached": len(self._file_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0,
+            "renders": self.renders,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "render_p50": percentile(0.5),
+            "render_p95": percentile(0.95),
+            "render_max": times[-1] if times else 0,
+        }
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+chart_renderer = ChartRenderer()
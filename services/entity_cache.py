@@ -0,0 +1,205 @@
+"""
+Кэш проектов, задач и расходов по id в памяти процесса.
+
+Карточки открываются снова и снова при переходах между списком и карточкой,
+поэтому строки по id читаются из кэша, а не из БД. В кэше лежат снимки колонок,
+а не ORM-объекты: каждое чтение получает новый объект без сессии, и изменение
+его атрибутов не портит кэш. Читают через кэш репозитории (services.repositories).
+
+Кэш ограничен числом записей и приблизительным объемом в байтах (вытесняются
+давно не читавшиеся), запись живет не дольше ttl секунд. Обработчики, меняющие
+или удаляющие сущности, сбрасывают их через invalidate после commit.
+
+В шардированном режиме (services.sharding) сущности пользователя меняет только
+его рабочий процесс, и кэш согласован без дополнительных средств. Если одни и те же
+данные меняют несколько независимых процессов (например, реплики вебхука),
+сбросы рассылаются через канал - RedisInvalidationChannel (ENTITY_CACHE_REDIS_URL).
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# Отличает "нет в кэше" от закэшированного значения (в том числе None); общий для всех кэшей
+MISSING = object()
+
+# (таблица, id)
+Key = Tuple[str, int]
+
+def snapshot(instance) -> Dict[str, Any]:
+    return {attr.key: getattr(instance, attr.key) for attr in instance.__mapper__.column_attrs}
+
+def _size(values: Dict[str, Any]) -> int:
+    return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values.values())
+
+class EntityCache:
+    """
+    LRU+TTL кэш снимков строк по (таблица, id).
+    Запись, прочитанная из БД до сброса, не попадает в кэш после него:
+    set принимает token, взятый до запроса, и пропускает запись, если с тех пор были сбросы.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 8 * 1024 * 1024, ttl: float = 300.0):
+        # ключ -> (снимок, размер, момент записи)
+        self._entries: "OrderedDict[Key, Tuple[Dict[str, Any], int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._epoch = 0
+        self.channel: Optional["RedisInvalidationChannel"] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.configure(max_entries, max_bytes, ttl)
+
+    def configure(self, max_entries: int = 10_000, max_bytes: int = 8 * 1024 * 1024, ttl: float = 300.0) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._shrink()
+
+    def get(self, model, entity_id: int) -> Any:
+        key = (model.__tablename__, entity_id)
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[2] > self.ttl:
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def token(self) -> int:
+        return self._epoch
+
+    def set(self, model, entity_id: int, values: Dict[str, Any], token: int) -> None:
+        size = _size(values)
+        if token != self._epoch or size > self.max_bytes or self.max_entries <= 0:
+            return
+        key = (model.__tablename__, entity_id)
+        self._drop(key)
+        self._entries[key] = (values, size, time.monotonic())
+        self._bytes += size
+        self._shrink()
+
+    def _shrink(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.evictions += 1
+
+    def _drop(self, key: Key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def discard(self, table: str, entity_id: int) -> None:
+        """Сброс только в этом процессе (в том числе пришедший по каналу)"""
+        self._drop((table, entity_id))
+        self._epoch += 1
+
+    def invalidate(self, model, entity_id: int) -> None:
+        self.invalidations += 1
+        self.discard(model.__tablename__, entity_id)
+        if self.channel is not None:
+            self.channel.publish(model.__tablename__, entity_id)
+
+    async def connect(self, channel: "RedisInvalidationChannel") -> None:
+        self.channel = channel
+        await channel.start(self.discard)
+
+    async def close(self) -> None:
+        if self.channel is not None:
+            await self.channel.close()
+            self.channel = None
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+class RedisInvalidationChannel:
+    """
+    Рассылка сбросов кэша между процессами через Redis pub/sub.
+    Сообщение - "процесс:таблица:id"; свои сообщения процесс пропускает.
+    """
+
+    def __init__(self, url: str, name: str = "entity_cache"):
+        self.url = url
+        self.name = name
+        self.origin = f"{os.getpid()}-{id(self)}"
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        self._tasks = []
+        self._redis = None
+
+    async def start(self, on_invalidate: Callable[[str, int], None]) -> None:
+        # redis - необязательная зависимость, нужна только для этого режима
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(self.url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.name)
+        self._tasks = [
+            asyncio.create_task(self._listen(pubsub, on_invalidate)),
+            asyncio.create_task(self._publish_loop()),
+        ]
+
+    def publish(self, table: str, entity_id: int) -> None:
+        self._outgoing.put_nowait(f"{self.origin}:{table}:{entity_id}")
+
+    async def _publish_loop(self) -> None:
+        while True:
+            message = await self._outgoing.get()
+            try:
+                await self._redis.publish(self.name, message)
+            except Exception:
+                # Запись в других процессах устареет не дольше, чем на ttl кэша
+                logger.exception("Не удалось разослать сброс кэша %s", message)
+
+    async def _listen(self, pubsub, on_invalidate: Callable[[str, int], None]) -> None:
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            origin, table, entity_id = message["data"].decode().rsplit(":", 2)
+            if origin != self.origin:
+                on_invalidate(table, int(entity_id))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._redis is not None:
+            await self._redis.aclose()
+
+entity_cache = EntityCache()
+
+def build(model, values: Dict[str, Any]):
+    """Новый объект без сессии из снимка колонок"""
+    return model(**values)
+
+async def load(db, model, entity_id: int) -> Optional[Dict[str, Any]]:
+    """Снимок строки по id: из кэша или из БД с записью в кэш"""
+    values = entity_cache.get(model, entity_id)
+    if values is not MISSING:
+        return values
+    token = entity_cache.token()
+    instance = (await db.execute(select(model).where(model.id == entity_id))).scalar_one_or_none()
+    if instance is None:
+        return None
+    values = snapshot(instance)
+    entity_cache.set(model, entity_id, values, token)
+    return values
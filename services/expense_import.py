@@ -0,0 +1,282 @@
+"""
+Импорт расходов из CSV и банковских выписок OFX.
+
+Файл читается построчно, строки проверяются и пачками сверяются с уже сохраненными
+расходами на те же даты. Новые строки вставляются одним executemany на пачку,
+и каждая пачка фиксируется своей короткой транзакцией: разбор следующей пачки и отчет
+о прогрессе идут без открытой транзакции и не держат блокировку записи SQLite.
+"""
+import asyncio
+import csv
+import io
+import re
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Awaitable, Callable, IO, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select
+
+from models import Expense
+from services.analytics import apply_rollup_deltas, period_keys
+from services.stats import apply_expense_change
+
+BATCH_SIZE = 5000
+MAX_ROWS = 100_000
+COMMENT_LIMIT = 1000
+# Сколько ошибочных строк запоминается для отчета (остальные только считаются)
+ERROR_EXAMPLES = 5
+
+# %d.%m.%y раньше %d.%m.%Y: иначе «01.02.24» разберется как 24-й год
+DATE_FORMATS = ("%d.%m.%y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M")
+
+DATE_COLUMNS = {"date", "дата", "дата операции", "дата платежа"}
+AMOUNT_COLUMNS = {"amount", "sum", "сумма", "сумма операции", "сумма платежа"}
+COMMENT_COLUMNS = {"comment", "description", "memo", "комментарий", "описание", "назначение платежа"}
+
+# Строка выписки: (номер строки в файле, дата, сумма, комментарий)
+Row = Tuple[int, datetime, float, Optional[str]]
+
+class RowError(ValueError):
+    pass
+
+def _quoted(value: str, limit: int = 30) -> str:
+    # Значение ячейки попадает в отчет пользователю, длинное - обрезается
+    return f"«{value[:limit]}…»" if len(value) > limit else f"«{value}»"
+
+class ImportSummary:
+    def __init__(self):
+        self.rows = 0
+        self.added = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.total = 0.0
+        self.error_count = 0
+        # Первые ERROR_EXAMPLES ошибок: (номер строки, описание)
+        self.errors: List[Tuple[int, str]] = []
+        self.truncated = False
+
+    def add_error(self, line_no: int, error: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < ERROR_EXAMPLES:
+            self.errors.append((line_no, error))
+
+# В выписках одни и те же даты повторяются у множества строк, strptime - самое дорогое место разбора
+@lru_cache(maxsize=4096)
+def parse_date(value: str) -> datetime:
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise RowError(f"неизвестный формат даты {_quoted(value)}")
+
+def parse_amount(value: str) -> float:
+    cleaned = value.strip().replace(" ", "").replace(" ", "").replace(",", ".")
+    try:
+        amount = float(cleaned)
+    except ValueError:
+        raise RowError(f"некорректная сумма {_quoted(value)}")
+    if amount == 0:
+        raise RowError("нулевая сумма")
+    return amount
+
+def detect_encoding(head: bytes) -> str:
+    # Банковские выгрузки часто в cp1251, остальное считаем UTF-8
+    try:
+        head.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Обрыв многобайтового символа на границе прочитанного куска - не ошибка
+        return "utf-8-sig" if e.start >= len(head) - 3 else "cp1251"
+
+def _clean_comment(value: Optional[str]) -> Optional[str]:
+    value = (value or "").strip()
+    return value[:COMMENT_LIMIT] or None
+
+def iter_csv_rows(stream: IO[str]) -> Iterator[Tuple[int, Optional[Row], Optional[str]]]:
+    """Строки CSV: дата, сумма, комментарий (или колонки по заголовку). Отдает (номер, строка, ошибка)"""
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    columns = (0, 1, 2)
+    for line_no, record in enumerate(csv.reader(stream, dialect), start=1):
+        if not record or not any(cell.strip() for cell in record):
+            continue
+        if line_no == 1:
+            names = [cell.strip().lower() for cell in record]
+            if DATE_COLUMNS & set(names) or AMOUNT_COLUMNS & set(names):
+                columns = tuple(
+                    next((i for i, name in enumerate(names) if name in candidates), None)
+                    for candidates in (DATE_COLUMNS, AMOUNT_COLUMNS, COMMENT_COLUMNS)
+                )
+                if columns[0] is None or columns[1] is None:
+                    yield line_no, None, "в заголовке нет колонок даты и суммы"
+                    return
+                continue
+        try:
+            date_column, amount_column, comment_column = columns
+            if max(date_column, amount_column) >= len(record):
+                raise RowError("не хватает колонок")
+            comment = record[comment_column] if comment_column is not None and comment_column < len(record) else None
+            row = (line_no, parse_date(record[date_column]), parse_amount(record[amount_column]), _clean_comment(comment))
+        except RowError as e:
+            yield line_no, None, str(e)
+        else:
+            yield line_no, row, None
+
+_OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+def iter_ofx_rows(stream: IO[str]) -> Iterator[Tuple[int, Optional[Row], Optional[str]]]:
+    """Операции из выписки OFX (SGML или XML), построчно"""
+    transaction = None
+    for line_no, line in enumerate(stream, start=1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if not closing:
+                    transaction = {"line": line_no}
+                    continue
+                if transaction is not None:
+                    yield _ofx_row(transaction)
+                transaction = None
+            elif transaction is not None and not closing:
+                transaction[tag] = value.strip()
+
+def _ofx_row(transaction) -> Tuple[int, Optional[Row], Optional[str]]:
+    line_no = transaction["line"]
+    try:
+        posted = transaction.get("DTPOSTED", "")
+        try:
+            date = datetime.strptime(posted[:8], "%Y%m%d")
+        except ValueError:
+            raise RowError(f"некорректная дата {_quoted(posted)}")
+        amount = parse_amount(transaction.get("TRNAMT", ""))
+        comment = transaction.get("MEMO") or transaction.get("NAME")
+        return line_no, (line_no, date, amount, _clean_comment(comment)), None
+    except RowError as e:
+        return line_no, None, str(e)
+
+def open_text(file: IO[bytes]) -> IO[str]:
+    file.seek(0)
+    encoding = detect_encoding(file.read(65536))
+    file.seek(0)
+    return io.TextIOWrapper(file, encoding=encoding, errors="replace", newline="")
+
+def is_ofx(filename: Optional[str], stream: IO[str]) -> bool:
+    if filename and filename.lower().endswith((".ofx", ".qfx")):
+        return True
+    head = stream.read(1024).lstrip().upper()
+    stream.seek(0)
+    return head.startswith("OFXHEADER") or "<OFX>" in head
+
+# Ограничение числа параметров в одном запросе SQLite
+DATES_PER_QUERY = 500
+
+async def _existing_keys(db, user_id: int, dates: List[datetime]) -> Set[Tuple[datetime, float, Optional[str]]]:
+    """Ключи уже сохраненных расходов на указанные даты (по индексу user_id, date)"""
+    table = Expense.__table__
+    keys = set()
+    for start in range(0, len(dates), DATES_PER_QUERY):
+        result = await db.execute(
+            select(table.c.date, table.c.amount, table.c.comment).where(
+                table.c.user_id == user_id,
+                table.c.date.in_(dates[start:start + DATES_PER_QUERY]),
+            )
+        )
+        keys.update((date, round(amount, 2), comment) for date, amount, comment in result)
+    return keys
+
+async def import_expenses(
+    db,
+    user_id: int,
+    file: IO[bytes],
+    filename: Optional[str] = None,
+    progress: Optional[Callable[[ImportSummary], Awaitable[None]]] = None,
+    batch_size: int = BATCH_SIZE,
+    max_rows: int = MAX_ROWS,
+) -> ImportSummary:
+    """
+    Импортирует расходы из файла, фиксируя db после каждой пачки; progress вызывается после фиксации.
+    При ошибке разбора уже зафиксированные пачки остаются, повторный импорт их не задвоит.
+    В CSV суммы берутся по модулю, в OFX импортируются только списания (отрицательные суммы).
+    Дубликаты - совпадающие дата, сумма и комментарий - пропускаются.
+    """
+    summary = ImportSummary()
+    stream = open_text(file)
+    ofx = is_ofx(filename, stream)
+    rows = iter_ofx_rows(stream) if ofx else iter_csv_rows(stream)
+
+    # Добавленные строки и строки, бывшие в БД до импорта. Каждая дата запрашивается
+    # один раз, поэтому только что вставленные строки повторно не читаются
+    seen: Set[Tuple[datetime, float, Optional[str]]] = set()
+    existing: Set[Tuple[datetime, float, Optional[str]]] = set()
+    checked_dates: Set[datetime] = set()
+    now = datetime.now()
+
+    async def flush(batch: List[Row]) -> None:
+        new_dates = list({row[1] for row in batch} - checked_dates)
+        if new_dates:
+            existing.update(await _existing_keys(db, user_id, new_dates))
+            checked_dates.update(new_dates)
+        values = []
+        for _, date, amount, comment in batch:
+            key = (date, amount, comment)
+            if key in seen or key in existing:
+                summary.duplicates += 1
+                continue
+            seen.add(key)
+            values.append({"user_id": user_id, "amount": amount, "date": date, "comment": comment, "created_at": now})
+        if values:
+            # Core executemany без ORM-обработки каждой строки
+            await db.execute(insert(Expense.__table__), values)
+            summary.added += len(values)
+            summary.total += sum(value["amount"] for value in values)
+            # Сводные строки обновляются одним UPDATE на период, а не на каждую строку
+            deltas = defaultdict(lambda: {"expenses": 0.0, "expense_count": 0})
+            for value in values:
+                for key in period_keys(value["date"]):
+                    deltas[key]["expenses"] += value["amount"]
+                    deltas[key]["expense_count"] += 1
+            await apply_rollup_deltas(db, user_id, deltas)
+            await apply_expense_change(db, user_id, sum(value["amount"] for value in values))
+        await db.commit()
+        if progress is not None:
+            await progress(summary)
+
+    batch: List[Row] = []
+    while not summary.truncated:
+        # Разбор (csv, strptime) - синхронная работа, она идет в потоке, чтобы не занимать цикл событий
+        chunk = await asyncio.to_thread(list, islice(rows, batch_size))
+        if not chunk:
+            break
+        for line_no, row, error in chunk:
+            if summary.rows >= max_rows:
+                summary.truncated = True
+                break
+            summary.rows += 1
+            if error is not None:
+                summary.add_error(line_no, error)
+                continue
+            _, date, amount, comment = row
+            if ofx:
+                if amount > 0:
+                    # Поступления не являются расходами
+                    summary.skipped += 1
+                    continue
+            amount = round(abs(amount), 2)
+            batch.append((line_no, date, amount, comment))
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+    if batch:
+        await flush(batch)
+
+    stream.detach()
+    return summary
@@ -0,0 +1,144 @@
+"""
+Выгрузка данных пользователя (проекты, задачи, расходы) в CSV или JSON Lines.
+
+Строки читаются потоково (stream + yield_per) и сразу пишутся во временный файл,
+который держится в памяти до SPOOL_MAX_SIZE и дальше уходит на диск, поэтому расход
+памяти не зависит от числа строк. Выгрузка только читает: в режиме WAL чтение
+не блокирует запись других пользователей.
+"""
+import csv
+import gzip
+import io
+import json
+import tempfile
+from contextlib import aclosing
+from datetime import date, datetime
+from enum import Enum
+from typing import IO, Any, AsyncGenerator, Dict, List, Tuple
+
+from aiogram.types import InputFile
+from sqlalchemy import select
+
+from models import Expense, Project, Task
+
+YIELD_PER = 500
+SPOOL_MAX_SIZE = 1024 * 1024
+# Лимит Telegram на отправку файлов ботом
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+EXPORT_MODELS = (("projects", Project), ("tasks", Task), ("expenses", Expense))
+
+class ExportTooLarge(Exception):
+    pass
+
+class SpooledInputFile(InputFile):
+    """Файл для отправки в Telegram, читаемый кусками из открытого файла (повторная отправка тоже работает)"""
+
+    def __init__(self, file: IO[bytes], filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+async def iter_user_rows(db, model, user_id: int) -> AsyncGenerator[Dict[str, Any], None]:
+    """Строки таблицы пользователя порциями по YIELD_PER, без загрузки всех строк в память"""
+    table = model.__table__
+    result = await db.stream(
+        select(table)
+        .where(table.c.user_id == user_id)
+        .order_by(table.c.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    try:
+        async for partition in result.mappings().partitions():
+            for row in partition:
+                yield {key: _plain(value) for key, value in row.items()}
+    finally:
+        # Курсор закрывается и при досрочной остановке (ExportTooLarge), а не вместе с сессией
+        await result.close()
+
+class _ExportFile:
+    """Временный файл, при необходимости сжатый gzip, в который пишется текст"""
+
+    def __init__(self, filename: str, compress: bool):
+        self.filename = filename + (".gz" if compress else "")
+        self.raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._gzip = gzip.GzipFile(filename=filename, fileobj=self.raw, mode="wb") if compress else None
+        self.text = io.TextIOWrapper(self._gzip or self.raw, encoding="utf-8", newline="")
+
+    def finish(self) -> SpooledInputFile:
+        self.text.flush()
+        self.text.detach()
+        if self._gzip is not None:
+            # Закрытие GzipFile дописывает хвост архива, но не закрывает raw
+            self._gzip.close()
+        if self.raw.tell() > MAX_DOCUMENT_SIZE:
+            self.raw.close()
+            raise ExportTooLarge(self.filename)
+        return SpooledInputFile(self.raw, self.filename)
+
+    def close(self) -> None:
+        self.raw.close()
+
+def _check_size(export_file: _ExportFile) -> None:
+    # Сжатые данные копятся в буфере gzip, поэтому проверка по сырому файлу приблизительная
+    if export_file.raw.tell() > MAX_DOCUMENT_SIZE:
+        raise ExportTooLarge(export_file.filename)
+
+async def export_user_data(db, user_id: int, fmt: str = "csv", compress: bool = False) -> List[Tuple[SpooledInputFile, int]]:
+    """
+    Пишет данные пользователя во временные файлы и возвращает [(файл, число строк)].
+    CSV - отдельный файл на каждую таблицу, JSON Lines - один файл, у каждой строки поле "type".
+    Файлы нужно закрыть после отправки (close_export).
+    """
+    stamp = datetime.now().strftime("%Y%m%d")
+    files: List[_ExportFile] = []
+    counts: List[int] = []
+    try:
+        if fmt == "jsonl":
+            export_file = _ExportFile(f"export_{stamp}.jsonl", compress)
+            files.append(export_file)
+            count = 0
+            for name, model in EXPORT_MODELS:
+                async with aclosing(iter_user_rows(db, model, user_id)) as rows:
+                    async for row in rows:
+                        row["type"] = name[:-1]
+                        export_file.text.write(json.dumps(row, ensure_ascii=False))
+                        export_file.text.write("\n")
+                        count += 1
+                        if count % YIELD_PER == 0:
+                            _check_size(export_file)
+            counts.append(count)
+        else:
+            for name, model in EXPORT_MODELS:
+                export_file = _ExportFile(f"{name}_{stamp}.csv", compress)
+                files.append(export_file)
+                writer = csv.DictWriter(export_file.text, fieldnames=[column.name for column in model.__table__.columns])
+                writer.writeheader()
+                count = 0
+                async with aclosing(iter_user_rows(db, model, user_id)) as rows:
+                    async for row in rows:
+                        writer.writerow(row)
+                        count += 1
+                        if count % YIELD_PER == 0:
+                            _check_size(export_file)
+                counts.append(count)
+        return [(export_file.finish(), count) for export_file, count in zip(files, counts)]
+    except BaseException:
+        for export_file in files:
+            export_file.close()
+        raise
+
+def close_export(files: List[Tuple[SpooledInputFile, int]]) -> None:
+    for input_file, _ in files:
+        input_file.file.close()
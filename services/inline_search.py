@@ -0,0 +1,133 @@
+"""
+Поиск задач и проектов для inline-режима (@bot текст).
+
+Inline-запрос приходит на каждое нажатие клавиши, поэтому:
+- результаты кэшируются по пользователю и тексту запроса с коротким TTL и сбрасываются
+  вместе с кэшем клавиатур при изменении задач и проектов пользователя;
+- запрос, который успел устареть (пользователь набрал следующую букву), не выполняется
+  и не получает ответа - клиент Telegram показывает только последний.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import select
+
+from keyboards.cache import keyboard_cache
+from models import Project, ProjectStatus, Task
+from services.entity_cache import MISSING
+from services.search import SearchResult, search
+
+RESULTS_LIMIT = 20
+INLINE_KINDS = ("task", "project")
+
+class InlineResultCache:
+    """
+    Результаты inline-запросов: не больше max_queries запросов на пользователя
+    и max_users пользователей (LRU), каждая запись живет ttl секунд.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_users: int = 10_000, max_queries: int = 32):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_queries = max_queries
+        self._users: "OrderedDict[int, OrderedDict[Tuple[str, int], Tuple[float, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, key: Tuple[str, int]) -> Any:
+        entries = self._users.get(user_id)
+        entry = entries.get(key) if entries is not None else None
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return MISSING
+        self._users.move_to_end(user_id)
+        entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: int, key: Tuple[str, int], value: Any) -> None:
+        entries = self._users.get(user_id)
+        if entries is None:
+            entries = self._users[user_id] = OrderedDict()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        entries[key] = (time.monotonic() + self.ttl, value)
+        entries.move_to_end(key)
+        if len(entries) > self.max_queries:
+            entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+class QueryDebouncer:
+    """Последний inline-запрос каждого пользователя: более ранние считаются устаревшими"""
+
+    def __init__(self):
+        self._latest: Dict[int, str] = {}
+        self.superseded = 0
+
+    def begin(self, user_id: int, query_id: str) -> None:
+        self._latest[user_id] = query_id
+
+    def is_superseded(self, user_id: int, query_id: str) -> bool:
+        if self._latest.get(user_id) != query_id:
+            self.superseded += 1
+            return True
+        return False
+
+    def finish(self, user_id: int, query_id: str) -> None:
+        if self._latest.get(user_id) == query_id:
+            del self._latest[user_id]
+
+inline_cache = InlineResultCache()
+inline_debouncer = QueryDebouncer()
+
+async def active_items(db, user_id: int, limit: int) -> List[SearchResult]:
+    """Пустой запрос: активные задачи (ближайшие дедлайны первыми) и незавершенные проекты"""
+    tasks = await db.execute(
+        select(Task.id, Task.title, Task.deadline)
+        .where(Task.user_id == user_id, Task.is_completed == False)
+        .order_by(Task.deadline.is_(None), Task.deadline, Task.id.desc())
+        .limit(limit)
+    )
+    results = [SearchResult("task", id, title, None, deadline) for id, title, deadline in tasks]
+    if len(results) < limit:
+        projects = await db.execute(
+            select(Project.id, Project.name, Project.deadline)
+            .where(Project.user_id == user_id, Project.status != ProjectStatus.COMPLETED)
+            .order_by(Project.id.desc())
+            .limit(limit - len(results))
+        )
+        results += [SearchResult("project", id, name, None, deadline) for id, name, deadline in projects]
+    return results
+
+async def find_items(db, user_id: int, query: str, page: int = 0) -> Tuple[List[SearchResult], bool]:
+    """Страница результатов inline-запроса, из кэша или из поискового индекса"""
+    query = " ".join(query.split()).lower()
+    key = (query, page)
+    cached = inline_cache.get(user_id, key)
+    if cached is not MISSING:
+        return cached
+    token = keyboard_cache.token()
+    if query:
+        found = await search(db, user_id, query, page, RESULTS_LIMIT, kinds=INLINE_KINDS)
+    elif page == 0:
+        found = await active_items(db, user_id, RESULTS_LIMIT), False
+    else:
+        found = [], False
+    # Результат, прочитанный до изменения задач или проектов пользователя, не кэшируется
+    if not keyboard_cache.invalidated_since(user_id, token):
+        inline_cache.set(user_id, key, found)
+    return found
+
+def inline_stats() -> Dict[str, float]:
+    requests = inline_cache.hits + inline_cache.misses
+    return {
+        "cache_hits": inline_cache.hits,
+        "cache_misses": inline_cache.misses,
+        "cache_hit_rate": inline_cache.hits / requests if requests else 0,
+        "superseded": inline_debouncer.superseded,
+    }
@@ -0,0 +1,118 @@
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class HandlerMetrics:
+    __slots__ = ("buckets", "count", "total", "errors", "sql_statements", "sql_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+class MetricsRegistry:
+    """Метрики обработчиков в памяти процесса и их вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.handlers: Dict[str, HandlerMetrics] = {}
+        self.in_flight = 0
+        # Дополнительные источники метрик: функция возвращает {имя: значение}
+        self.gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def handler(self, name: str) -> HandlerMetrics:
+        metrics = self.handlers.get(name)
+        if metrics is None:
+            metrics = self.handlers[name] = HandlerMetrics()
+        return metrics
+
+    def add_gauges(self, prefix: str, collect: Callable[[], Dict[str, float]]) -> None:
+        self.gauges[prefix] = collect
+
+    def render(self) -> str:
+        lines: List[str] = [
+            "# HELP bot_handler_latency_seconds Время выполнения обработчика",
+            "# TYPE bot_handler_latency_seconds histogram",
+        ]
+        for name, metrics in sorted(self.handlers.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="+Inf"}} {metrics.count}')
+            lines.append(f'bot_handler_latency_seconds_sum{{handler="{name}"}} {metrics.total}')
+            lines.append(f'bot_handler_latency_seconds_count{{handler="{name}"}} {metrics.count}')
+
+        for metric, attribute, kind, help_text in (
+            ("bot_handler_errors_total", "errors", "counter", "Исключения в обработчике"),
+            ("bot_sql_statements_total", "sql_statements", "counter", "SQL-запросы, выполненные обработчиком"),
+            ("bot_sql_seconds_total", "sql_seconds", "counter", "Время SQL-запросов обработчика"),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, metrics in sorted(self.handlers.items()):
+                lines.append(f'{metric}{{handler="{name}"}} {getattr(metrics, attribute)}')
+
+        lines.append("# HELP bot_updates_in_flight Обработчики, выполняющиеся сейчас")
+        lines.append("# TYPE bot_updates_in_flight gauge")
+        lines.append(f"bot_updates_in_flight {self.in_flight}")
+
+        for prefix, collect in self.gauges.items():
+            for key, value in collect().items():
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# Метрики обработчика, выполняющегося в текущем контексте (для учета SQL)
+current_handler: ContextVar[Optional[HandlerMetrics]] = ContextVar("current_handler", default=None)
+
+# Начало запроса хранится в его контексте выполнения: упавший запрос не оставляет
+# записи, с которой сопоставились бы следующие запросы соединения
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = context._metrics_started
+    # SQL вне обработчиков (напоминания, фоновые задачи) учитывается отдельно
+    metrics = current_handler.get() or registry.handler("background")
+    metrics.sql_statements += 1
+    metrics.sql_seconds += time.perf_counter() - started
+
+def install_sql_metrics(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    """Отдает метрики на http://host:port/metrics"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
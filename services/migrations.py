@@ -0,0 +1,233 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Boolean, Column, Connection, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text,
+    Enum as SQLEnum, func, select, text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Миграции только добавляются в конец списка и никогда не меняются после выпуска
+Migration = Tuple[int, str, Callable[[Connection], None]]
+
+# Схема до появления миграций, зафиксированная отдельно от models.py: миграция 1
+# должна создавать одно и то же, как бы ни менялись модели. Новые таблицы и индексы -
+# только в следующих миграциях
+_baseline_metadata = MetaData()
+
+Table(
+    "projects", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, index=True),
+    Column("name", String, index=True),
+    Column("type", SQLEnum("PERSONAL", "ORDER", name="projecttype")),
+    Column("status", SQLEnum("IDEA", "AGREEMENT", "IN_PROGRESS", "COMPLETED", name="projectstatus")),
+    Column("deadline", DateTime, nullable=True),
+    Column("cost", Float, nullable=True),
+    Column("created_at", DateTime),
+    Column("completed_at", DateTime, nullable=True),
+)
+
+Table(
+    "tasks", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), nullable=True),
+    Column("title", String, index=True),
+    Column("description", Text, nullable=True),
+    Column("is_completed", Boolean),
+    Column("deadline", DateTime, nullable=True),
+    Column("created_at", DateTime),
+    Column("completed_at", DateTime, nullable=True),
+)
+
+Table(
+    "expenses", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, index=True),
+    Column("amount", Float),
+    Column("date", DateTime),
+    Column("comment", Text, nullable=True),
+    Column("created_at", DateTime),
+)
+
+def _baseline(conn: Connection) -> None:
+    # Таблицы, существовавшие до появления миграций (create_all их не пересоздает)
+    _baseline_metadata.create_all(conn)
+
+def _composite_indexes(conn: Connection) -> None:
+    statements = [
+        # Списки проектов: user_id + type + status
+        "CREATE INDEX IF NOT EXISTS ix_projects_user_type_status ON projects (user_id, type, status)",
+        # Активные задачи пользователя
+        "CREATE INDEX IF NOT EXISTS ix_tasks_user_completed ON tasks (user_id, is_completed)",
+        # Задачи проекта (join и проверка внешнего ключа при удалении проекта)
+        "CREATE INDEX IF NOT EXISTS ix_tasks_project_id ON tasks (project_id)",
+        # История и суммы расходов: покрывающий индекс, SUM не читает таблицу
+        "CREATE INDEX IF NOT EXISTS ix_expenses_user_date ON expenses (user_id, date, amount)",
+        # Одиночные индексы по user_id теперь дублируют префиксы составных
+        "DROP INDEX IF EXISTS ix_projects_user_id",
+        "DROP INDEX IF EXISTS ix_tasks_user_id",
+        "DROP INDEX IF EXISTS ix_expenses_user_id",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+def _deadline_reminders(conn: Connection) -> None:
+    from models import SentReminder
+
+    SentReminder.__table__.create(conn, checkfirst=True)
+    # Диапазонные запросы планировщика напоминаний по дедлайнам
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_completed_deadline ON tasks (is_completed, deadline)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_projects_deadline ON projects (deadline)"))
+
+def _period_rollups(conn: Connection) -> None:
+    from models import PeriodRollup
+    from services.analytics import accumulate_rollups, income_rows, source_queries
+
+    PeriodRollup.__table__.create(conn, checkfirst=True)
+    # Заполняем сводную таблицу по уже накопленным данным, дальше она обновляется при записи
+    expense_query, income_query = source_queries()
+    rollups = accumulate_rollups(conn.execute(expense_query), income_rows(conn.execute(income_query)))
+    if rollups:
+        conn.execute(
+            PeriodRollup.__table__.insert(),
+            [{"user_id": uid, "period": period, **values} for (uid, period), values in rollups.items()],
+        )
+
+def _user_stats(conn: Connection) -> None:
+    from models import UserStats
+
+    # Строки заполняются лениво: get_user_stats пересобирает статистику пользователя, если ее нет
+    UserStats.__table__.create(conn, checkfirst=True)
+
+def _full_text_search(conn: Connection) -> None:
+    from services.search import create_search_index
+
+    if conn.dialect.name != "sqlite":
+        # FTS5 есть только в SQLite, на других СУБД поиск идет через ILIKE
+        return
+    create_search_index(conn)
+
+MIGRATIONS: List[Migration] = [
+    (1, "baseline", _baseline),
+    (2, "composite indexes", _composite_indexes),
+    (3, "deadline reminders", _deadline_reminders),
+    (4, "period rollups", _period_rollups),
+    (5, "full-text search", _full_text_search),
+    (6, "user stats", _user_stats),
+]
+
+def _current_version(conn: Connection) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+def _upgrade(conn: Connection) -> int:
+    version = _current_version(conn)
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Применяется миграция %s: %s", number, name)
+        migrate(conn)
+        conn.execute(
+            text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+            {"version": number, "name": name, "applied_at": datetime.utcnow()},
+        )
+        version = number
+    return version
+
+async def run_migrations(engine: AsyncEngine) -> int:
+    """Применяет недостающие миграции, каждую вместе с записью о версии в одной транзакции"""
+    async with engine.begin() as conn:
+        return await conn.run_sync(_upgrade)
+
+def handler_queries():
+    """Запросы обработчиков, которые должны обслуживаться индексами"""
+    from models import Expense, PeriodRollup, Project, ProjectStatus, ProjectType, Task
+    from services.reminders import deadlines_query
+
+    user_id = 1
+    since = datetime.utcnow()
+    return {
+        "projects.show_my_projects": select(Project).where(
+            Project.user_id == user_id,
+            Project.type == ProjectType.PERSONAL,
+            Project.status != ProjectStatus.COMPLETED,
+        ),
+        "projects.show_completed_projects": select(Project).where(
+            Project.user_id == user_id,
+            Project.status == ProjectStatus.COMPLETED,
+        ),
+        "projects.show_project": select(Project).where(Project.id == user_id),
+        "tasks.show_my_tasks": select(Task).where(
+            Task.user_id == user_id,
+            Task.is_completed == False,
+        ),
+        "tasks.show_projects_for_selection": select(Project).where(
+            Project.user_id == user_id,
+            Project.status != ProjectStatus.COMPLETED,
+        ),
+        "expenses.show_expenses_history": select(Expense).where(
+            Expense.user_id == user_id,
+            Expense.date >= since,
+        ).order_by(Expense.date.desc()),
+        "expenses.history_total": select(func.count(Expense.id), func.sum(Expense.amount)).where(
+            Expense.user_id == user_id,
+            Expense.date >= since,
+        ),
+        "analytics.period_report": select(PeriodRollup).where(
+            PeriodRollup.user_id == user_id,
+            PeriodRollup.period >= "M2024-01",
+            PeriodRollup.period < "M2024-12~",
+        ),
+        "reminders.tasks": deadlines_query(Task, "task", "upcoming", since, since, 100),
+        "reminders.projects": deadlines_query(Project, "project", "upcoming", since, since, 100),
+    }
+
+def _check_plans(conn: Connection) -> List[str]:
+    problems = []
+    for name, query in handler_queries().items():
+        compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+        plan = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        details = [row[-1] for row in plan]
+        # "SCAN table" без индекса означает полный перебор строк
+        if any(d.startswith("SCAN") and "INDEX" not in d for d in details):
+            problems.append(f"{name}: {'; '.join(details)}")
+    return problems
+
+async def check_query_plans(engine: AsyncEngine) -> List[str]:
+    """Проверяет через EXPLAIN QUERY PLAN, что запросы обработчиков используют индексы (только SQLite)"""
+    if engine.dialect.name != "sqlite":
+        return []
+    async with engine.connect() as conn:
+        return await conn.run_sync(_check_plans)
+
+async def main(command: str):
+    from services.database import engine
+
+    try:
+        if command == "check":
+            problems = await check_query_plans(engine)
+            for problem in problems:
+                print(problem)
+            if problems:
+                raise SystemExit(1)
+            print("Все запросы обработчиков используют индексы")
+        else:
+            version = await run_migrations(engine)
+            print(f"Версия схемы: {version}")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m services.migrations upgrade | check
+    import asyncio
+    import sys
+
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "upgrade"))
@@ -0,0 +1,175 @@
+import asyncio
+import html
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import and_, exists, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models import Project, ProjectStatus, SentReminder, Task
+from services.sender import background_priority
+
+logger = logging.getLogger(__name__)
+
+UPCOMING = "upcoming"
+OVERDUE = "overdue"
+
+# Предел Telegram - 4096 символов, с запасом
+MESSAGE_LIMIT = 4000
+
+def deadlines_query(model, entity_type: str, stage: str, start: datetime, end: datetime, limit: int):
+    """Дедлайны из диапазона [start, end), по которым напоминание этой стадии еще не отправлялось"""
+    if model is Task:
+        title, active = Task.title, Task.is_completed == False
+    else:
+        title, active = Project.name, Project.status != ProjectStatus.COMPLETED
+
+    already_sent = exists().where(
+        SentReminder.entity_type == entity_type,
+        SentReminder.entity_id == model.id,
+        SentReminder.stage == stage,
+        SentReminder.deadline == model.deadline,
+    )
+    return (
+        select(model.id, model.user_id, title, model.deadline)
+        .where(active, and_(model.deadline >= start, model.deadline < end), ~already_sent)
+        .order_by(model.deadline)
+        .limit(limit)
+    )
+
+class ReminderService:
+    """
+    Напоминания о дедлайнах задач и проектов.
+    Одна периодическая задача раз в interval выбирает ближайшие и просроченные дедлайны
+    диапазонными запросами, группирует их по пользователям и отправляет пользователю
+    одно сообщение (или несколько, если не помещается в одно). В sent_reminders
+    записываются только напоминания из доставленных сообщений.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory: async_sessionmaker,
+        window: timedelta = timedelta(hours=24),
+        overdue_lookback: timedelta = timedelta(days=7),
+        batch_limit: int = 5000,
+        messages_per_second: float = 25,
+    ):
+        self.bot = bot
+        self.session_factory = session_factory
+        self.window = window
+        self.overdue_lookback = overdue_lookback
+        self.batch_limit = batch_limit
+        self.send_interval = 1 / messages_per_second
+
+    async def collect(self, db, now: datetime) -> Dict[int, List[Tuple[str, str, int, str, datetime]]]:
+        # Дедлайн выбирается в календаре как дата (полночь), поэтому просроченным
+        # он становится только со следующего дня
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        ranges = {
+            UPCOMING: (today, now + self.window),
+            OVERDUE: (today - self.overdue_lookback, today),
+        }
+        per_user = defaultdict(list)
+        for entity_type, model in (("task", Task), ("project", Project)):
+            for stage, (start, end) in ranges.items():
+                result = await db.execute(deadlines_query(model, entity_type, stage, start, end, self.batch_limit))
+                for entity_id, user_id, title, deadline in result.all():
+                    per_user[user_id].append((entity_type, stage, entity_id, title, deadline))
+        return per_user
+
+    @staticmethod
+    def format_messages(reminders) -> List[Tuple[str, list]]:
+        """Сообщения не длиннее MESSAGE_LIMIT вместе с напоминаниями, которые в них вошли"""
+        pages = []
+        lines, items = ["⏰ Напоминание о дедлайнах:\n"], []
+        size = len(lines[0])
+        for reminder in sorted(reminders, key=lambda r: r[4]):
+            entity_type, stage, _, title, deadline = reminder
+            icon = "✅ Задача" if entity_type == "task" else "📁 Проект"
+            when = "просрочено" if stage == OVERDUE else "до"
+            # Название ограничено, чтобы любая строка помещалась в сообщение
+            line = f"{icon} «{html.escape((title or '')[:200])}» — {when} {deadline.strftime('%d.%m.%Y')}"
+            if items and size + len(line) + 1 > MESSAGE_LIMIT:
+                pages.append(("\n".join(lines), items))
+                lines, items, size = [], [], 0
+            lines.append(line)
+            items.append(reminder)
+            size += len(line) + 1
+        if items:
+            pages.append(("\n".join(lines), items))
+        return pages
+
+    async def send(self, user_id: int, text: str) -> bool:
+        """True, если сообщение доставлено или доставить его невозможно в принципе; False - повторить позже"""
+        while True:
+            try:
+                # Напоминания уступают очередь ответам обработчиков
+                with background_priority():
+                    await self.bot.send_message(user_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота - повторять бессмысленно
+                return True
+            except TelegramBadRequest:
+                # Постоянная ошибка (чат не найден и т. п.): повтор на следующем проходе упадет так же
+                logger.warning("Напоминание пользователю %s отклонено", user_id, exc_info=True)
+                return True
+            except Exception:
+                logger.exception("Не удалось отправить напоминание пользователю %s", user_id)
+                return False
+
+    async def record(self, reminders, now: datetime) -> None:
+        """Записывает отправленные напоминания пользователя отдельной короткой транзакцией"""
+        async with self.session_factory() as db:
+            await db.execute(
+                insert(SentReminder),
+                [
+                    {"entity_type": entity_type, "entity_id": entity_id, "stage": stage, "deadline": deadline, "sent_at": now}
+                    for entity_type, stage, entity_id, _, deadline in reminders
+                ],
+            )
+            await db.commit()
+
+    async def tick(self) -> int:
+        """Один проход планировщика, возвращает число пользователей, получивших напоминания"""
+        now = datetime.now()
+        async with self.session_factory() as db:
+            per_user = await self.collect(db, now)
+
+        # Отправка (очередь, retry_after, паузы) идет без открытой транзакции: иначе блокировка
+        # записи SQLite держалась бы все это время и записи обработчиков падали бы с "database is locked"
+        notified = 0
+        for user_id, reminders in per_user.items():
+            delivered = []
+            for text, items in self.format_messages(reminders):
+                if not await self.send(user_id, text):
+                    # Остальные сообщения уйдут на следующем проходе
+                    break
+                delivered += items
+                await asyncio.sleep(self.send_interval)
+            if delivered:
+                await self.record(delivered, now)
+                notified += 1
+        if notified:
+            logger.info("Отправлены напоминания %s пользователям", notified)
+        return notified
+
+    def schedule(self, scheduler: AsyncIOScheduler, interval: timedelta = timedelta(minutes=10)) -> None:
+        scheduler.add_job(
+            self.tick,
+            "interval",
+            seconds=interval.total_seconds(),
+            next_run_time=datetime.now(),
+            max_instances=1,
+            coalesce=True,
+            id="deadline_reminders",
+            replace_existing=True,
+        )
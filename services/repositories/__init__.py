@@ -0,0 +1,11 @@
+"""
+Доступ к проектам, задачам и расходам для обработчиков.
+
+Изменения - одиночные запросы UPDATE/DELETE ... RETURNING с условием на владельца:
+одно действие - один запрос, который сразу возвращает строку для ответа, а id
+чужой сущности (подделанный callback_data) просто не находит строку.
+Чтение по id идет через кэш сущностей (services.entity_cache).
+
+Функции не фиксируют транзакцию: commit и сброс кэшей остаются за обработчиком.
+"""
+from services.repositories import expenses, projects, tasks
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Collection, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+
+from models import Expense
+from services.analytics import apply_expense_rollup, apply_rollup_deltas, period_keys
+from services.entity_cache import build, load
+from services.stats import apply_expense_change
+
+async def get(db, user_id: int, expense_id: int) -> Optional[Expense]:
+    values = await load(db, Expense, expense_id)
+    if values is None or values["user_id"] != user_id:
+        return None
+    return build(Expense, values)
+
+async def add(db, expense: Expense) -> None:
+    db.add(expense)
+    await apply_expense_change(db, expense.user_id, expense.amount)
+    await apply_expense_rollup(db, expense.user_id, expense.date, expense.amount)
+
+async def summary(db, user_id: int, since: datetime) -> Tuple[int, Optional[float]]:
+    """Количество и сумма расходов с даты since - в SQL, без загрузки строк"""
+    result = await db.execute(
+        select(func.count(Expense.id), func.sum(Expense.amount)).where(
+            Expense.user_id == user_id,
+            Expense.date >= since
+        )
+    )
+    return result.one()
+
+async def stream_since(db, user_id: int, since: datetime):
+    """Расходы с даты since, новые первыми, порциями по 100 строк"""
+    result = await db.stream(
+        select(Expense)
+        .where(Expense.user_id == user_id, Expense.date >= since)
+        .order_by(Expense.date.desc())
+        .execution_options(yield_per=100)
+    )
+    return result.scalars()
+
+async def recent(db, user_id: int, limit: int) -> List[Tuple[int, datetime, float, Optional[str]]]:
+    """id, дата, сумма и комментарий последних limit расходов"""
+    result = await db.execute(
+        select(Expense.id, Expense.date, Expense.amount, Expense.comment)
+        .where(Expense.user_id == user_id)
+        .order_by(Expense.date.desc(), Expense.id.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+async def remove(db, user_id: int, expense_id: int) -> Optional[Expense]:
+    """Удаляет расход пользователя и возвращает его"""
+    result = await db.execute(
+        delete(Expense).where(Expense.id == expense_id, Expense.user_id == user_id).returning(Expense)
+    )
+    expense = result.scalar_one_or_none()
+    if expense is not None:
+        await apply_expense_change(db, user_id, -expense.amount)
+        await apply_expense_rollup(db, user_id, expense.date, -expense.amount, count=-1)
+    return expense
+
+async def remove_many(db, user_id: int, expense_ids: Collection[int]) -> List[int]:
+    """
+    Удаляет расходы пользователя одним DELETE ... RETURNING и возвращает их id.
+    Сводные таблицы меняются одним изменением на пользователя и на каждый затронутый период.
+    """
+    result = await db.execute(
+        delete(Expense)
+        .where(Expense.user_id == user_id, Expense.id.in_(expense_ids))
+        .returning(Expense.id, Expense.date, Expense.amount)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    if rows:
+        rollups: Dict[str, Dict[str, float]] = defaultdict(lambda: {"expenses": 0, "expense_count": 0})
+        for _, date, amount in rows:
+            for key in period_keys(date):
+                rollups[key]["expenses"] -= amount
+                rollups[key]["expense_count"] -= 1
+        await apply_expense_change(db, user_id, -sum(amount for _, _, amount in rows))
+        await apply_rollup_deltas(db, user_id, rollups)
+    return [expense_id for expense_id, _, _ in rows]
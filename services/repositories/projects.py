@@ -0,0 +1,121 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func, select, update
+
+from models import Project, ProjectStatus, ProjectType, Task
+from services.analytics import apply_project_income_change, project_income
+from services.entity_cache import build, entity_cache, load
+from services.stats import apply_project_change, project_contribution
+
+# Вклад незавершенного проекта: он считается активным и дохода не дает
+OPEN_CONTRIBUTION = {"active_projects": 1}
+
+# Списки проектов в меню: вид списка -> условия
+LIST_CONDITIONS = {
+    "my_projects": (Project.type == ProjectType.PERSONAL, Project.status != ProjectStatus.COMPLETED),
+    "orders": (Project.type == ProjectType.ORDER, Project.status != ProjectStatus.COMPLETED),
+    "completed_projects": (Project.status == ProjectStatus.COMPLETED,),
+}
+
+async def get(db, user_id: int, project_id: int) -> Optional[Project]:
+    values = await load(db, Project, project_id)
+    if values is None or values["user_id"] != user_id:
+        return None
+    return build(Project, values)
+
+async def add(db, project: Project) -> None:
+    db.add(project)
+    await apply_project_change(db, project.user_id, {}, project_contribution(project))
+
+async def list_rows(db, user_id: int, kind: str):
+    """id, name, type, status проектов для списка kind (my_projects, orders, completed_projects)"""
+    result = await db.execute(
+        select(Project.id, Project.name, Project.type, Project.status).where(
+            Project.user_id == user_id,
+            *LIST_CONDITIONS[kind]
+        )
+    )
+    return result.all()
+
+async def open_choices(db, user_id: int):
+    """id и name незавершенных проектов - для выбора проекта задачи"""
+    result = await db.execute(
+        select(Project.id, Project.name).where(
+            Project.user_id == user_id,
+            Project.status != ProjectStatus.COMPLETED
+        )
+    )
+    return result.all()
+
+async def status_counts(db, user_id: int) -> Dict[ProjectStatus, int]:
+    result = await db.execute(
+        select(Project.status, func.count(Project.id))
+        .where(Project.user_id == user_id)
+        .group_by(Project.status)
+    )
+    return dict(result.all())
+
+async def complete(db, user_id: int, project_id: int) -> Optional[Project]:
+    """Завершает проект пользователя; None, если проекта нет, он чужой или уже завершен"""
+    result = await db.execute(
+        update(Project)
+        .where(Project.id == project_id, Project.user_id == user_id, Project.status != ProjectStatus.COMPLETED)
+        .values(status=ProjectStatus.COMPLETED, completed_at=datetime.now())
+        .returning(Project)
+    )
+    project = result.scalar_one_or_none()
+    if project is not None:
+        await apply_project_change(db, user_id, OPEN_CONTRIBUTION, project_contribution(project))
+        await apply_project_income_change(db, user_id, None, project_income(project))
+    return project
+
+async def change_status(db, user_id: int, project_id: int, status: ProjectStatus) -> Optional[Project]:
+    """
+    Меняет статус проекта пользователя. Прежнее состояние (для статистики) берется из кэша,
+    а UPDATE срабатывает, только если в БД оно такое же; если нет, кэш был устаревшим -
+    он сбрасывается, и попытка повторяется со свежей строкой.
+    """
+    for _ in range(2):
+        before = await get(db, user_id, project_id)
+        if before is None:
+            return None
+        values = {"status": status}
+        if status == ProjectStatus.COMPLETED and before.status != ProjectStatus.COMPLETED:
+            # Дата завершения нужна, чтобы отнести доход заказа к периоду
+            values["completed_at"] = datetime.now()
+        result = await db.execute(
+            update(Project)
+            .where(
+                Project.id == project_id,
+                Project.user_id == user_id,
+                Project.status == before.status,
+                Project.type == before.type,
+                Project.cost.is_not_distinct_from(before.cost),
+                Project.completed_at.is_not_distinct_from(before.completed_at),
+            )
+            .values(**values)
+            .returning(Project)
+        )
+        project = result.scalar_one_or_none()
+        if project is not None:
+            await apply_project_change(db, user_id, project_contribution(before), project_contribution(project))
+            await apply_project_income_change(db, user_id, project_income(before), project_income(project))
+            return project
+        entity_cache.invalidate(Project, project_id)
+    return None
+
+async def remove(db, user_id: int, project_id: int) -> Optional[Project]:
+    """Удаляет проект пользователя и возвращает его; задачи проекта остаются без проекта"""
+    # Сначала отвязываем задачи, иначе удаление нарушит внешний ключ
+    await db.execute(
+        update(Task).where(Task.project_id == project_id, Task.user_id == user_id).values(project_id=None)
+    )
+    result = await db.execute(
+        delete(Project).where(Project.id == project_id, Project.user_id == user_id).returning(Project)
+    )
+    project = result.scalar_one_or_none()
+    if project is not None:
+        await apply_project_change(db, user_id, project_contribution(project), {})
+        await apply_project_income_change(db, user_id, project_income(project), None)
+    return project
@@ -0,0 +1,109 @@
+from datetime import datetime
+from typing import Collection, List, Optional
+
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.orm import joinedload
+
+from models import Project, Task
+from services.entity_cache import MISSING, build, entity_cache, snapshot
+from services.repositories import projects
+
+async def get(db, user_id: int, task_id: int) -> Optional[Task]:
+    """Задача пользователя с проектом в task.project; проект берется из кэша проектов, поэтому его изменения видны сразу"""
+    values = entity_cache.get(Task, task_id)
+    project = None
+    if values is MISSING:
+        token = entity_cache.token()
+        result = await db.execute(select(Task).options(joinedload(Task.project)).where(Task.id == task_id))
+        task = result.scalar_one_or_none()
+        if task is None:
+            return None
+        values = snapshot(task)
+        entity_cache.set(Task, task_id, values, token)
+        if task.project is not None:
+            project_values = snapshot(task.project)
+            entity_cache.set(Project, task.project.id, project_values, token)
+            project = build(Project, project_values)
+
+    if values["user_id"] != user_id:
+        return None
+    if project is None and values["project_id"]:
+        project = await projects.get(db, user_id, values["project_id"])
+
+    task = build(Task, values)
+    if project is not None:
+        task.project = project
+    return task
+
+async def add(db, task: Task) -> None:
+    db.add(task)
+
+async def list_active(db, user_id: int) -> List[Task]:
+    """Незавершенные задачи пользователя с загруженными проектами"""
+    result = await db.execute(
+        select(Task)
+        .options(joinedload(Task.project))
+        .where(
+            Task.user_id == user_id,
+            Task.is_completed == False
+        )
+    )
+    return result.scalars().all()
+
+async def complete(db, user_id: int, task_id: int) -> Optional[Task]:
+    """Отмечает задачу пользователя выполненной; None, если задачи нет, она чужая или уже выполнена"""
+    result = await db.execute(
+        update(Task)
+        .where(Task.id == task_id, Task.user_id == user_id, Task.is_completed == False)
+        .values(is_completed=True, completed_at=datetime.now())
+        .returning(Task)
+    )
+    return result.scalar_one_or_none()
+
+async def remove(db, user_id: int, task_id: int) -> Optional[Task]:
+    result = await db.execute(
+        delete(Task).where(Task.id == task_id, Task.user_id == user_id).returning(Task)
+    )
+    return result.scalar_one_or_none()
+
+# Массовые действия: один запрос на весь выбор, возвращаются id измененных задач пользователя.
+# synchronize_session=False: задачи не загружены в сессию, сверять нечего
+
+async def complete_many(db, user_id: int, task_ids: Collection[int]) -> List[int]:
+    result = await db.execute(
+        update(Task)
+        .where(Task.user_id == user_id, Task.id.in_(task_ids), Task.is_completed == False)
+        .values(is_completed=True, completed_at=datetime.now())
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
+
+async def remove_many(db, user_id: int, task_ids: Collection[int]) -> List[int]:
+    result = await db.execute(
+        delete(Task)
+        .where(Task.user_id == user_id, Task.id.in_(task_ids))
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
+
+async def move_many(db, user_id: int, task_ids: Collection[int], project_id: Optional[int]) -> List[int]:
+    """Переносит задачи в проект пользователя (None - без проекта); чужой проект не меняет ничего"""
+    statement = update(Task).where(Task.user_id == user_id, Task.id.in_(task_ids))
+    if project_id is not None:
+        statement = statement.where(exists().where(Project.id == project_id, Project.user_id == user_id))
+    result = await db.execute(
+        statement.values(project_id=project_id).returning(Task.id).execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
+
+async def set_deadline_many(db, user_id: int, task_ids: Collection[int], deadline: Optional[datetime]) -> List[int]:
+    result = await db.execute(
+        update(Task)
+        .where(Task.user_id == user_id, Task.id.in_(task_ids))
+        .values(deadline=deadline)
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
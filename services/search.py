@@ -0,0 +1,206 @@
+"""
+Полнотекстовый поиск по задачам, проектам и комментариям расходов.
+
+В SQLite используются виртуальные таблицы FTS5 без собственного содержимого
+(content=''): в индексе только токены, тексты читаются из исходных таблиц по rowid.
+Индексы обновляются триггерами на вставку, удаление и изменение индексируемых колонок.
+Владелец записи хранится в индексе токеном "u<user_id>", поэтому поиск пересекает
+списки документов слова и пользователя внутри FTS и не перебирает чужие совпадения.
+На других СУБД поиск выполняется через ILIKE.
+"""
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Connection, DateTime, Float, Integer, String, and_, literal, null, or_, select, text, union_all
+
+from models import Expense, Project, Task
+
+PAGE_SIZE = 8
+# Больше слов в запросе не нужно, а длинный запрос дороже разбирать
+MAX_TERMS = 8
+
+# (вид, таблица, FTS-таблица, индексируемые колонки, веса колонок для bm25, обязательная колонка)
+SEARCH_TABLES = (
+    ("task", "tasks", "tasks_fts", ("title", "description"), (10.0, 1.0), None),
+    ("project", "projects", "projects_fts", ("name",), (10.0,), None),
+    # Расходы без комментария в индекс не попадают
+    ("expense", "expenses", "expenses_fts", ("comment",), (1.0,), "comment"),
+)
+
+KINDS = tuple(kind for kind, *_ in SEARCH_TABLES)
+
+class SearchResult(NamedTuple):
+    kind: str
+    id: int
+    title: str
+    amount: Optional[float]
+    date: Optional[datetime]
+
+def _folded(column: str) -> str:
+    # remove_diacritics в unicode61 работает только для латиницы, «ё» приводим к «е» сами
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+def _index_statements(table: str, fts: str, columns: Tuple[str, ...], required: Optional[str]) -> List[str]:
+    names = ", ".join(columns)
+
+    def row(prefix: str) -> str:
+        values = ", ".join(_folded(f"{prefix}.{column}") for column in columns)
+        where = f" WHERE {prefix}.{required} IS NOT NULL" if required else ""
+        return f"{prefix}.id, 'u' || {prefix}.user_id, {values}{where}"
+
+    # Из таблицы без содержимого удаляют, передавая те же значения, что были вставлены
+    insert_new = f"INSERT INTO {fts} (rowid, owner, {names}) SELECT {row('new')}"
+    delete_old = f"INSERT INTO {fts} ({fts}, rowid, owner, {names}) SELECT 'delete', {row('old')}"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"owner, {names}, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_new}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_old}; END",
+        # Только при изменении индексируемых колонок: завершение задачи индекс не трогает
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF user_id, {names} ON {table} "
+        f"BEGIN {delete_old}; {insert_new}; END",
+    ]
+
+def _fill_statement(table: str, fts: str, columns: Tuple[str, ...], required: Optional[str]) -> str:
+    names = ", ".join(columns)
+    values = ", ".join(_folded(column) for column in columns)
+    where = f" WHERE {required} IS NOT NULL" if required else ""
+    return f"INSERT INTO {fts} (rowid, owner, {names}) SELECT id, 'u' || user_id, {values} FROM {table}{where}"
+
+def create_search_index(conn: Connection) -> None:
+    """Создает FTS-таблицы с триггерами и заполняет их (вызывается из миграции)"""
+    for _, table, fts, columns, _, required in SEARCH_TABLES:
+        for statement in _index_statements(table, fts, columns, required):
+            conn.execute(text(statement))
+        conn.execute(text(_fill_statement(table, fts, columns, required)))
+
+def _terms(query: str) -> List[str]:
+    return re.findall(r"\w+", query.lower().replace("ё", "е"))[:MAX_TERMS]
+
+def build_match(user_id: int, columns: Tuple[str, ...], terms: List[str]) -> str:
+    """
+    Выражение MATCH: все слова в колонках текста и токен владельца.
+    Последнее слово ищется как префикс (его могут еще дописывать), остальные - целиком:
+    префиксный поиск длиннее трех букв сливает списки документов всех пользователей.
+    """
+    words = " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    return f'owner:"u{user_id}" AND {{{" ".join(columns)}}}: ({words})'
+
+# Колонки выдачи для каждого вида: заголовок, сумма, дата
+_RESULT_COLUMNS = {
+    "task": "t.title AS title, NULL AS amount, t.deadline AS date",
+    "project": "t.name AS title, NULL AS amount, t.deadline AS date",
+    "expense": "t.comment AS title, t.amount AS amount, t.date AS date",
+}
+
+def _fts_query(user_id: int, terms: List[str], kinds: Tuple[str, ...], limit: int, offset: int):
+    parts = []
+    params = {"user_id": user_id, "limit": limit, "offset": offset}
+    for kind, table, fts, columns, weights, _ in SEARCH_TABLES:
+        if kind not in kinds:
+            continue
+        params[f"{kind}_match"] = build_match(user_id, columns, terms)
+        # Вес 0 у колонки владельца: токен пользователя не влияет на релевантность
+        rank = f"bm25({fts}, 0.0, {', '.join(map(str, weights))})"
+        parts.append(
+            f"SELECT '{kind}' AS kind, t.id AS id, {_RESULT_COLUMNS[kind]}, {rank} AS score "
+            f"FROM {fts} JOIN {table} t ON t.id = {fts}.rowid "
+            f"WHERE {fts} MATCH :{kind}_match AND t.user_id = :user_id"
+        )
+    statement = " UNION ALL ".join(parts) + " ORDER BY score, id DESC LIMIT :limit OFFSET :offset"
+    # Типы колонок нужны, чтобы даты из SQLite вернулись как datetime
+    return text(statement).columns(
+        kind=String, id=Integer, title=String, amount=Float, date=DateTime, score=Float
+    ), params
+
+def _like_query(user_id: int, terms: List[str], kinds: Tuple[str, ...], limit: int, offset: int):
+    def matches(*columns):
+        return and_(*(or_(*(column.ilike(f"%{term}%") for column in columns)) for term in terms))
+
+    def row(kind, id_column, title, amount, date):
+        return select(
+            literal(kind).label("kind"),
+            id_column.label("id"),
+            title.label("title"),
+            amount.label("amount"),
+            date.label("date"),
+        )
+
+    queries = {
+        "task": row("task", Task.id, Task.title, null(), Task.deadline)
+        .where(Task.user_id == user_id, matches(Task.title, Task.description)),
+        "project": row("project", Project.id, Project.name, null(), Project.deadline)
+        .where(Project.user_id == user_id, matches(Project.name)),
+        "expense": row("expense", Expense.id, Expense.comment, Expense.amount, Expense.date)
+        .where(Expense.user_id == user_id, matches(Expense.comment)),
+    }
+    results = union_all(*(queries[kind] for kind in KINDS if kind in kinds)).subquery()
+    return select(results).order_by(results.c.id.desc()).limit(limit).offset(offset), {}
+
+async def search(
+    db,
+    user_id: int,
+    query: str,
+    page: int = 0,
+    page_size: int = PAGE_SIZE,
+    kinds: Tuple[str, ...] = KINDS,
+) -> Tuple[List[SearchResult], bool]:
+    """Страница результатов, лучшие совпадения первыми, и признак следующей страницы"""
+    terms = _terms(query)
+    if not terms or not kinds:
+        return [], False
+    # На одну строку больше страницы - чтобы узнать, есть ли следующая
+    limit, offset = page_size + 1, page * page_size
+    if db.bind.dialect.name == "sqlite":
+        statement, params = _fts_query(user_id, terms, kinds, limit, offset)
+    else:
+        statement, params = _like_query(user_id, terms, kinds, limit, offset)
+    rows = (await db.execute(statement, params)).all()
+    results = [SearchResult(row[0], row[1], row[2], row[3], row[4]) for row in rows[:page_size]]
+    return results, len(rows) > page_size
+
+async def rebuild_search_index(db) -> None:
+    for _, table, fts, columns, _, required in SEARCH_TABLES:
+        await db.execute(text(f"INSERT INTO {fts} ({fts}) VALUES ('delete-all')"))
+        await db.execute(text(_fill_statement(table, fts, columns, required)))
+
+async def verify_search_index(db) -> List[str]:
+    """FTS-таблицы, число документов в которых расходится с исходной таблицей"""
+    drifted = []
+    for _, table, fts, _, _, required in SEARCH_TABLES:
+        where = f" WHERE {required} IS NOT NULL" if required else ""
+        expected = (await db.execute(text(f"SELECT COUNT(*) FROM {table}{where}"))).scalar()
+        indexed = (await db.execute(text(f"SELECT COUNT(*) FROM {fts}_docsize"))).scalar()
+        if expected != indexed:
+            drifted.append(f"{fts}: {indexed} документов, ожидается {expected}")
+    return drifted
+
+async def main(command: str):
+    from services.database import AsyncSessionLocal, engine
+
+    try:
+        if engine.dialect.name != "sqlite":
+            print("Полнотекстовый индекс используется только с SQLite")
+            return
+        async with AsyncSessionLocal() as session:
+            if command == "rebuild":
+                await rebuild_search_index(session)
+                await session.commit()
+                print("Поисковый индекс пересобран")
+            else:
+                drifted = await verify_search_index(session)
+                for problem in drifted:
+                    print(problem)
+                if drifted:
+                    raise SystemExit(1)
+                print("Поисковый индекс совпадает с исходными данными")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m services.search verify | rebuild
+    import asyncio
+    import sys
+
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "verify"))
@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    DeleteMessage,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendChatAction,
+    TelegramMethod,
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Приоритет отправки в текущем контексте: ответы обработчиков - INTERACTIVE,
+# рассылки (напоминания, выгрузки) оборачиваются в background_priority()
+_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+@contextmanager
+def background_priority():
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+# Методы, не расходующие лимит сообщений чата (но соблюдающие порядок)
+FREE_METHODS = (DeleteMessage, SendChatAction)
+# Повторные правки одного сообщения в очереди схлопываются в последнюю
+COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен один токен"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+class _Item:
+    __slots__ = ("make_request", "bot", "method", "priority", "futures", "enqueued_at")
+
+    def __init__(self, make_request, bot: Bot, method: TelegramMethod, priority: int):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.futures: List[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+        self.enqueued_at = time.monotonic()
+
+class OutboundQueue(BaseRequestMiddleware):
+    """
+    Очередь исходящих запросов к Telegram (подключается как middleware сессии бота).
+
+    Запросы с chat_id проходят через общий token bucket (~30 сообщений/с) и bucket чата
+    (~1 сообщение/с с небольшим запасом), отправляются строго по порядку внутри чата,
+    при 429 чат ставится на паузу на retry_after. Ответы обработчиков идут раньше рассылок.
+    Остальные запросы (getUpdates, answerCallbackQuery и т.п.) проходят напрямую.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        latency_window: int = 1000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self._pending: Dict[Any, Deque[_Item]] = {}
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._paused_until: Dict[Any, float] = {}
+        self._ready: List[Tuple[int, int, Any]] = []
+        self._waiting: List[Tuple[float, int, Any]] = []
+        self._scheduled: Set[Any] = set()
+        self._in_flight: Set[Any] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retried = 0
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        future = self._enqueue(chat_id, make_request, bot, method)
+        return await future
+
+    def _enqueue(self, chat_id, make_request, bot: Bot, method: TelegramMethod) -> asyncio.Future:
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+        queue = self._pending.setdefault(chat_id, deque())
+        priority = _priority.get()
+
+        if isinstance(method, COALESCED_METHODS):
+            for item in queue:
+                if type(item.method) is type(method) and item.method.message_id == method.message_id:
+                    future = asyncio.get_running_loop().create_future()
+                    item.method = method
+                    item.priority = min(item.priority, priority)
+                    item.futures.append(future)
+                    self.coalesced += 1
+                    return future
+
+        item = _Item(make_request, bot, method, priority)
+        queue.append(item)
+        self._schedule(chat_id)
+        return item.futures[0]
+
+    def _schedule(self, chat_id) -> None:
+        if chat_id in self._scheduled or chat_id in self._in_flight or not self._pending.get(chat_id):
+            return
+        self._scheduled.add(chat_id)
+        paused_until = self._paused_until.get(chat_id, 0)
+        if paused_until > time.monotonic():
+            heapq.heappush(self._waiting, (paused_until, next(self._seq), chat_id))
+        else:
+            heapq.heappush(self._ready, (self._pending[chat_id][0].priority, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                heapq.heappush(self._ready, (self._pending[chat_id][0].priority, next(self._seq), chat_id))
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, seq, chat_id = self._ready[0]
+            item = self._pending[chat_id][0]
+            free = isinstance(item.method, FREE_METHODS)
+
+            if not free:
+                delay = self.global_bucket.delay(now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                delay = max(self._bucket(chat_id).delay(now), self._paused_until.get(chat_id, 0) - now)
+                if delay > 0:
+                    heapq.heappop(self._ready)
+                    heapq.heappush(self._waiting, (now + delay, seq, chat_id))
+                    continue
+                self.global_bucket.consume(now)
+                self._bucket(chat_id).consume(now)
+
+            heapq.heappop(self._ready)
+            self._pending[chat_id].popleft()
+            self._scheduled.discard(chat_id)
+            self._in_flight.add(chat_id)
+            asyncio.create_task(self._deliver(chat_id, item))
+
+            if len(self._buckets) > 10_000:
+                self._prune(now)
+
+    async def _deliver(self, chat_id, item: _Item) -> None:
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            # Возвращаем запрос в начало очереди чата и ждем, сколько попросил Telegram
+            self.retried += 1
+            self._pending.setdefault(chat_id, deque()).appendleft(item)
+            self._paused_until[chat_id] = time.monotonic() + e.retry_after
+        except Exception as e:
+            self.failed += 1
+            for future in item.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - item.enqueued_at)
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight.discard(chat_id)
+            if self._pending.get(chat_id):
+                self._schedule(chat_id)
+            else:
+                self._pending.pop(chat_id, None)
+
+    def _prune(self, now: float) -> None:
+        # Заполнившиеся bucket'ы неактивных чатов ничем не отличаются от новых
+        for chat_id, bucket in list(self._buckets.items()):
+            bucket.delay(now)
+            if chat_id not in self._pending and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+        for chat_id in [c for c, until in self._paused_until.items() if until <= now]:
+            del self._paused_until[chat_id]
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._pending.values())
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0
+
+        return {
+            "depth": self.depth,
+            "chats": len(self._pending),
+            "sent": self.sent,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0,
+        }
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
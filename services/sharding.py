@@ -0,0 +1,293 @@
+"""
+Шардированный режим: входной процесс принимает апдейты (polling или вебхук)
+и раздает их N рабочим процессам, в каждом из которых работает обычный Dispatcher.
+
+Апдейты одного пользователя всегда попадают в один рабочий процесс (from.id по модулю N):
+порядок его апдейтов сохраняется, а кэши процесса (клавиатуры, inline-результаты,
+FSM в памяти) видят все его изменения.
+
+Канал между процессами - stdin/stdout рабочего, по JSON-строке на апдейт.
+Рабочий отвечает номером обработанного апдейта, а раз в HEARTBEAT_INTERVAL
+секунд - пустой строкой-пульсом. Супервизор перезапускает рабочий, который
+завершился или перестал присылать пульс, и заново отправляет ему неподтвержденные апдейты.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+
+from services.webhook import UpdateWorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Номер рабочего процесса и их число - переменные окружения, которые задает входной процесс
+SHARD_ENV = "BOT_SHARD"
+SHARDS_ENV = "BOT_SHARDS"
+
+HEARTBEAT_INTERVAL = 5.0
+# Апдейт, отправленный столько раз без подтверждения (рабочий падал), отбрасывается
+MAX_DELIVERIES = 3
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+# Апдейт может быть больше стандартного лимита строки StreamReader (64 КиБ)
+LINE_LIMIT = 4 * 1024 * 1024
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """Пользователь, от которого пришел апдейт; для апдейтов без отправителя - чат"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        sender = event.get("from") or event.get("user")
+        if sender:
+            return sender["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    return shard_key(update) % shards
+
+def _encode(update: Dict[str, Any]) -> bytes:
+    return json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+class _Shard:
+    def __init__(self, index: int, max_in_flight: int):
+        self.index = index
+        self.max_in_flight = max_in_flight
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+        # update_id -> [апдейт, число отправок] в порядке отправки
+        self.in_flight: "OrderedDict[int, list]" = OrderedDict()
+        self.acked = asyncio.Event()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.last_seen = 0.0
+        self.processed = 0
+        self.restarts = 0
+        self.dropped = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+class ShardRouter:
+    """
+    Входной процесс шардированного режима: раздает апдейты рабочим процессам и следит за ними.
+    Интерфейс совпадает с UpdateWorkerPool, поэтому роутер подходит для run_webhook.
+    У каждого рабочего не больше queue_size ожидающих и столько же неподтвержденных апдейтов.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        command: List[str],
+        shards: int,
+        queue_size: int = 100,
+        stall_timeout: float = 30.0,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.command = command
+        self.stall_timeout = stall_timeout
+        self.shards = [_Shard(index, queue_size) for index in range(shards)]
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._supervise(shard)) for shard in self.shards]
+
+    def _shard(self, update: Dict[str, Any]) -> _Shard:
+        return self.shards[shard_for(update, len(self.shards))]
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        try:
+            self._shard(update).queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, update: Dict[str, Any]) -> None:
+        """Как submit, но при заполненной очереди ждет (для polling)"""
+        await self._shard(update).queue.put(update)
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.queue.qsize() + len(shard.in_flight) for shard in self.shards)
+
+    async def _supervise(self, shard: _Shard) -> None:
+        delay = RESTART_DELAY
+        while not self._stopping:
+            started = time.monotonic()
+            try:
+                await self._run_process(shard)
+            except Exception:
+                logger.exception("Ошибка рабочего процесса %s", shard.index)
+            if self._stopping:
+                break
+            shard.restarts += 1
+            # Процесс, проработавший долго, перезапускается сразу, падающий на старте - с растущей паузой
+            if time.monotonic() - started > MAX_RESTART_DELAY:
+                delay = RESTART_DELAY
+            logger.warning("Рабочий процесс %s завершился, перезапуск через %.0f с", shard.index, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _run_process(self, shard: _Shard) -> None:
+        env = {**os.environ, SHARD_ENV: str(shard.index), SHARDS_ENV: str(len(self.shards))}
+        process = shard.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+            limit=LINE_LIMIT,
+        )
+        shard.last_seen = time.monotonic()
+        logger.info("Рабочий процесс %s запущен (pid %s)", shard.index, process.pid)
+
+        receive = asyncio.create_task(self._receive(shard, process))
+        tasks = [asyncio.create_task(self._send(shard, process)), asyncio.create_task(self._watch(shard, process))]
+        try:
+            await process.wait()
+            # Подтверждения, которые процесс успел записать перед выходом, не должны потеряться
+            await asyncio.wait({receive}, timeout=1)
+        finally:
+            for task in tasks + [receive]:
+                task.cancel()
+            await asyncio.gather(*tasks, receive, return_exceptions=True)
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    async def _send(self, shard: _Shard, process: asyncio.subprocess.Process) -> None:
+        # Неподтвержденные апдейты упавшего процесса отправляются первыми, в исходном порядке
+        for update_id, entry in list(shard.in_flight.items()):
+            if entry[1] >= MAX_DELIVERIES:
+                del shard.in_flight[update_id]
+                shard.dropped += 1
+                logger.error("Апдейт %s отброшен: рабочий процесс %s падал, не обработав его", update_id, shard.index)
+                continue
+            entry[1] += 1
+            process.stdin.write(_encode(entry[0]))
+        shard.acked.set()
+
+        while True:
+            while len(shard.in_flight) >= shard.max_in_flight:
+                shard.acked.clear()
+                await shard.acked.wait()
+            update = await shard.queue.get()
+            shard.in_flight[update["update_id"]] = [update, 1]
+            process.stdin.write(_encode(update))
+            await process.stdin.drain()
+
+    async def _receive(self, shard: _Shard, process: asyncio.subprocess.Process) -> None:
+        async for line in process.stdout:
+            shard.last_seen = time.monotonic()
+            line = line.strip()
+            if line and shard.in_flight.pop(int(line), None) is not None:
+                shard.processed += 1
+                shard.acked.set()
+
+    async def _watch(self, shard: _Shard, process: asyncio.subprocess.Process) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - shard.last_seen > self.stall_timeout:
+                # Цикл событий рабочего завис: пульса нет, хотя процесс жив
+                logger.error("Рабочий процесс %s не отвечает %.0f с, перезапуск", shard.index, self.stall_timeout)
+                process.kill()
+                return
+
+    async def stop(self, timeout: Optional[float] = 10) -> None:
+        """Отправляет принятые апдейты, дожидается их обработки и останавливает рабочие процессы"""
+        deadline = time.monotonic() + (timeout or 0)
+        while any(shard.queue.qsize() for shard in self.shards if shard.alive) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        self._stopping = True
+        for shard in self.shards:
+            if shard.alive:
+                # Конец входного потока: рабочий доделывает свои апдейты и завершается
+                shard.process.stdin.close()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*self._tasks, return_exceptions=True), max(deadline - time.monotonic(), 1)
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов", self.depth)
+            for shard in self.shards:
+                if shard.alive:
+                    shard.process.kill()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "shards": len(self.shards),
+            "alive": sum(shard.alive for shard in self.shards),
+            "queued": sum(shard.queue.qsize() for shard in self.shards),
+            "in_flight": sum(len(shard.in_flight) for shard in self.shards),
+            "processed": sum(shard.processed for shard in self.shards),
+            "restarts": sum(shard.restarts for shard in self.shards),
+            "dropped": sum(shard.dropped for shard in self.shards),
+        }
+
+class ShardForwardMiddleware(BaseMiddleware):
+    """Входной процесс в режиме polling: апдейт не обрабатывается, а передается рабочему"""
+
+    def __init__(self, router: ShardRouter):
+        self.router = router
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        await self.router.put(event.model_dump(mode="json", exclude_unset=True, by_alias=True))
+
+async def _heartbeat(writer: asyncio.StreamWriter) -> None:
+    while True:
+        writer.write(b"\n")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+async def serve_shard(dispatcher: Dispatcher, bot: Bot, workers: int = 8, queue_size: int = 100, **kwargs: Any) -> None:
+    """
+    Рабочий процесс: читает апдейты из stdin, обрабатывает их в UpdateWorkerPool
+    и подтверждает в stdout. Завершается, когда входной процесс закрывает канал.
+    """
+    loop = asyncio.get_running_loop()
+    # stdout занят подтверждениями, поэтому случайный print уходит в stderr
+    ack_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(ack_fd, "wb", buffering=0)
+    )
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    def acknowledge(update: Dict[str, Any]) -> None:
+        writer.write(b"%d\n" % update["update_id"])
+
+    pool = UpdateWorkerPool(dispatcher, bot, workers=workers, queue_size=queue_size, on_done=acknowledge, **kwargs)
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, bots=[bot], **dispatcher.workflow_data)
+    pool.start()
+    heartbeat = asyncio.create_task(_heartbeat(writer))
+    try:
+        async for line in reader:
+            update = json.loads(line)
+            if not pool.submit(update):
+                # Входной процесс не присылает больше queue_size неподтвержденных апдейтов
+                logger.error("Очередь рабочего процесса переполнена, апдейт %s пропущен", update["update_id"])
+                acknowledge(update)
+    finally:
+        await pool.stop()
+        heartbeat.cancel()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, bots=[bot], **dispatcher.workflow_data)
+        writer.close()
@@ -0,0 +1,185 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, case, delete, func, select, update
+
+from models import Expense, Project, ProjectStatus, ProjectType, UserStats
+from services.database import insert_or_ignore
+from services.writer import Deltas, defer, register_deferred
+
+STAT_FIELDS = ("completed_projects", "active_projects", "income", "expenses")
+
+def project_contribution(project: Optional[Project]) -> Dict[str, float]:
+    """Вклад одного проекта в сводную статистику пользователя"""
+    if project is None:
+        return {}
+    completed = project.status == ProjectStatus.COMPLETED
+    income = (project.cost or 0) if completed and project.type == ProjectType.ORDER else 0
+    return {
+        "completed_projects": int(completed),
+        "active_projects": int(not completed),
+        "income": income,
+    }
+
+def contribution_delta(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    return {field: after.get(field, 0) - before.get(field, 0) for field in STAT_FIELDS}
+
+async def apply_stats_delta(db, user_id: int, delta: Dict[str, float]) -> None:
+    """
+    Применяет изменение к user_stats в текущей транзакции.
+    Если строки еще нет (пользователь появился до введения таблицы),
+    она создается по исходным таблицам, и изменение применяется к ней повторным UPDATE.
+    """
+    delta = {field: value for field, value in delta.items() if value}
+    if not delta:
+        return
+    if defer("user_stats", (user_id,), delta):
+        return
+
+    statement = (
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values({field: getattr(UserStats, field) + value for field, value in delta.items()})
+    )
+    result = await db.execute(statement)
+    if result.rowcount == 0:
+        await create_user_stats(db, user_id, exclude=delta)
+        await db.execute(statement)
+
+async def apply_stats_deltas(db, deltas: Deltas) -> None:
+    """
+    Изменения, накопленные пакетом групповой фиксации: {(user_id,): delta}.
+    Недостающие строки создаются по исходным таблицам, затем один UPDATE executemany на все строки.
+    """
+    user_ids = [user_id for (user_id,) in deltas]
+    existing = set((await db.execute(select(UserStats.user_id).where(UserStats.user_id.in_(user_ids)))).scalars())
+    for user_id in user_ids:
+        if user_id not in existing:
+            await create_user_stats(db, user_id, exclude=deltas[(user_id,)])
+
+    table = UserStats.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.user_id == bindparam("key_user_id"))
+        .values({field: table.c[field] + bindparam(f"delta_{field}") for field in STAT_FIELDS}),
+        [
+            {"key_user_id": user_id, **{f"delta_{field}": delta.get(field, 0) for field in STAT_FIELDS}}
+            for (user_id,), delta in deltas.items()
+        ],
+    )
+
+register_deferred("user_stats", apply_stats_deltas)
+
+async def apply_project_change(db, user_id: int, before: Dict[str, float], after: Dict[str, float]) -> None:
+    await apply_stats_delta(db, user_id, contribution_delta(before, after))
+
+async def apply_expense_change(db, user_id: int, amount: float) -> None:
+    await apply_stats_delta(db, user_id, {"expenses": amount})
+
+async def compute_user_stats(db, user_id: Optional[int] = None) -> Dict[int, Dict[str, float]]:
+    """Считает статистику с нуля по исходным таблицам (для одного или всех пользователей)"""
+    completed = Project.status == ProjectStatus.COMPLETED
+    project_query = select(
+        Project.user_id,
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((completed, 0), else_=1)),
+        func.sum(case((completed & (Project.type == ProjectType.ORDER), Project.cost), else_=0)),
+    ).group_by(Project.user_id)
+    expense_query = select(Expense.user_id, func.sum(Expense.amount)).group_by(Expense.user_id)
+
+    if user_id is not None:
+        project_query = project_query.where(Project.user_id == user_id)
+        expense_query = expense_query.where(Expense.user_id == user_id)
+
+    stats: Dict[int, Dict[str, float]] = {}
+    empty = lambda: dict.fromkeys(STAT_FIELDS, 0)
+
+    for uid, completed_count, active_count, income in (await db.execute(project_query)).all():
+        row = stats.setdefault(uid, empty())
+        row.update(
+            completed_projects=completed_count or 0,
+            active_projects=active_count or 0,
+            income=income or 0,
+        )
+
+    for uid, expenses in (await db.execute(expense_query)).all():
+        stats.setdefault(uid, empty())["expenses"] = expenses or 0
+
+    if user_id is not None:
+        stats.setdefault(user_id, empty())
+    return stats
+
+async def rebuild_user_stats(db, user_id: Optional[int] = None) -> Dict[int, Dict[str, float]]:
+    """Пересобирает user_stats для одного пользователя или целиком"""
+    stats = await compute_user_stats(db, user_id)
+
+    if user_id is None:
+        await db.execute(delete(UserStats))
+    else:
+        await db.execute(delete(UserStats).where(UserStats.user_id == user_id))
+
+    db.add_all(UserStats(user_id=uid, **values) for uid, values in stats.items())
+    await db.flush()
+    return stats
+
+async def create_user_stats(db, user_id: int, exclude: Optional[Dict[str, float]] = None) -> None:
+    """
+    Создает строку user_stats по исходным таблицам, если ее еще нет. Строку пользователя
+    могут одновременно создавать несколько транзакций - вставка без ошибки пропускается.
+    exclude - изменение текущей транзакции, уже видное в исходных таблицах: оно вычитается,
+    и вызывающий применяет его UPDATE, чтобы оно учитывалось, какая бы транзакция ни создала строку.
+    """
+    values = (await compute_user_stats(db, user_id))[user_id]
+    for field, value in (exclude or {}).items():
+        values[field] -= value
+    await db.execute(insert_or_ignore(UserStats.__table__).values(user_id=user_id, **values))
+
+async def get_user_stats(db, user_id: int) -> UserStats:
+    stats = await db.get(UserStats, user_id)
+    if stats is None:
+        await create_user_stats(db, user_id)
+        stats = await db.get(UserStats, user_id)
+    return stats
+
+async def verify_user_stats(db) -> List[int]:
+    """Возвращает пользователей, у которых user_stats расходится с исходными данными"""
+    expected = await compute_user_stats(db)
+    actual = {
+        row.user_id: {field: getattr(row, field) for field in STAT_FIELDS}
+        for row in (await db.execute(select(UserStats))).scalars()
+    }
+
+    drifted = []
+    for uid in expected.keys() | actual.keys():
+        want = expected.get(uid, dict.fromkeys(STAT_FIELDS, 0))
+        have = actual.get(uid)
+        if have is None:
+            # Строка создается лениво, ее отсутствие - не расхождение
+            continue
+        if any(abs((have[field] or 0) - (want[field] or 0)) > 1e-6 for field in STAT_FIELDS):
+            drifted.append(uid)
+    return sorted(drifted)
+
+async def main(command: str):
+    from services.database import AsyncSessionLocal, engine
+
+    try:
+        async with AsyncSessionLocal() as session:
+            if command == "rebuild":
+                stats = await rebuild_user_stats(session)
+                await session.commit()
+                print(f"user_stats пересобрана: {len(stats)} пользователей")
+            else:
+                drifted = await verify_user_stats(session)
+                if drifted:
+                    print(f"Расхождения у пользователей: {', '.join(map(str, drifted))}")
+                    raise SystemExit(1)
+                print("user_stats совпадает с исходными данными")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m services.stats verify | rebuild
+    import asyncio
+    import sys
+
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "verify"))
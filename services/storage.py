@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+# Сериализация данных FSM: в анкетах хранятся даты (ExpenseForm.date),
+# которые стандартный json не умеет сохранять
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _json_object_hook(value):
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__date__" in value:
+        return date.fromisoformat(value["__date__"])
+    return value
+
+def json_dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=_json_default, ensure_ascii=False)
+
+def json_loads(raw: str) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_json_object_hook)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в отдельном файле SQLite.
+
+    Записи держатся в ограниченном LRU-кэше, изменения (в том числе
+    update_data) копятся и сбрасываются на диск одной транзакцией раз в
+    flush_interval секунд или при накоплении flush_batch записей.
+    Записи, не менявшиеся дольше state_ttl секунд, считаются устаревшими.
+    """
+
+    def __init__(
+        self,
+        path: str = "fsm_storage.db",
+        state_ttl: Optional[float] = 24 * 60 * 60,
+        max_cached: int = 10_000,
+        flush_interval: float = 1.0,
+        flush_batch: int = 100,
+    ) -> None:
+        self.path = path
+        self.state_ttl = state_ttl
+        self.max_cached = max_cached
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        # ключ -> [state, data, updated_at]
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        self._dirty: set = set()
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._conn_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _build_key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        if key.business_connection_id:
+            parts.append(key.business_connection_id)
+        parts.append(key.destiny)
+        return ":".join(parts)
+
+    def _is_expired(self, updated_at: float) -> bool:
+        return self.state_ttl is not None and time.time() - updated_at > self.state_ttl
+
+    async def _get_connection(self) -> aiosqlite.Connection:
+        async with self._conn_lock:
+            if self._conn is None:
+                self._conn = await aiosqlite.connect(self.path)
+                await self._conn.execute("PRAGMA journal_mode=WAL")
+                await self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS fsm_storage ("
+                    "key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL NOT NULL)"
+                )
+                await self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS ix_fsm_storage_updated_at ON fsm_storage (updated_at)"
+                )
+                await self._conn.commit()
+            return self._conn
+
+    async def _load(self, key: str) -> list:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            conn = await self._get_connection()
+            async with conn.execute(
+                "SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                record = [None, {}, time.time()]
+            else:
+                record = [row[0], json_loads(row[1]) if row[1] else {}, row[2]]
+            await self._remember(key, record)
+
+        if self._is_expired(record[2]):
+            record[0], record[1] = None, {}
+        return record
+
+    async def _remember(self, key: str, record: list) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_cached:
+            # Перед вытеснением несохраненных записей сбрасываем их на диск
+            if any(k in self._dirty for k in list(self._cache)[: len(self._cache) - self.max_cached]):
+                await self.flush()
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    async def _mark_dirty(self, key: str, record: list) -> None:
+        record[2] = time.time()
+        self._dirty.add(key)
+        if len(self._dirty) >= self.flush_batch:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения и удаляет устаревшие записи"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+
+            upserts, deletes = [], []
+            for key in keys:
+                record = self._cache.get(key)
+                if record is None:
+                    continue
+                state, data, updated_at = record
+                if state is None and not data:
+                    deletes.append((key,))
+                else:
+                    upserts.append((key, state, json_dumps(data), updated_at))
+
+            conn = await self._get_connection()
+            if upserts:
+                await conn.executemany(
+                    "INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                    upserts,
+                )
+            if deletes:
+                await conn.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
+            if self.state_ttl is not None:
+                await conn.execute(
+                    "DELETE FROM fsm_storage WHERE updated_at < ?", (time.time() - self.state_ttl,)
+                )
+            await conn.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._build_key(key)
+        record = await self._load(storage_key)
+        record[0] = state.state if isinstance(state, State) else state
+        await self._mark_dirty(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(self._build_key(key))
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._build_key(key)
+        record = await self._load(storage_key)
+        record[1] = data.copy()
+        await self._mark_dirty(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(self._build_key(key))
+        return record[1].copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        storage_key = self._build_key(key)
+        record = await self._load(storage_key)
+        record[1].update(data)
+        await self._mark_dirty(storage_key, record)
+        return record[1].copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+def create_storage() -> BaseStorage:
+    """
+    Создает хранилище FSM по переменным окружения:
+
+    FSM_STORAGE       - memory | sqlite | redis (по умолчанию sqlite)
+    FSM_STORAGE_PATH  - файл для sqlite-хранилища
+    FSM_REDIS_URL     - адрес Redis или совместимого сервера (KeyDB, Dragonfly и т.п.)
+    FSM_STATE_TTL     - время жизни незавершенной анкеты в секундах
+    FSM_MAX_CACHED    - максимальное число записей в памяти
+    """
+    backend = os.getenv("FSM_STORAGE", "sqlite").lower()
+    ttl = int(os.getenv("FSM_STATE_TTL", 24 * 60 * 60)) or None
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    if backend == "redis":
+        # redis - необязательная зависимость, нужна только для этого режима
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0"),
+            state_ttl=ttl,
+            data_ttl=ttl,
+            json_loads=json_loads,
+            json_dumps=json_dumps,
+        )
+
+    if backend == "sqlite":
+        return SQLiteStorage(
+            path=os.getenv("FSM_STORAGE_PATH", "fsm_storage.db"),
+            state_ttl=ttl,
+            max_cached=int(os.getenv("FSM_MAX_CACHED", 10_000)),
+        )
+
+    raise ValueError(f"Неизвестный тип хранилища FSM: {backend}")
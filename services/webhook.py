@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+def update_ordering_key(update: Dict[str, Any]) -> int:
+    """
+    Ключ, по которому апдейты одного чата попадают к одному обработчику.
+    Берется чат (для callback_query - чат исходного сообщения), иначе отправитель.
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        sender = event.get("from") or event.get("user")
+        if sender:
+            return sender["id"]
+    return 0
+
+class UpdateWorkerPool:
+    """
+    Ограниченный пул обработчиков апдейтов.
+    Апдейты одного чата всегда попадают в одну очередь, поэтому обрабатываются по порядку,
+    а разные чаты обрабатываются параллельно. При заполненной очереди submit возвращает False.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = 8,
+        queue_size: int = 100,
+        on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **kwargs: Any,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.on_done = on_done
+        self.kwargs = kwargs
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        queue = self.queues[update_ordering_key(update) % len(self.queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                result = await self.dispatcher.feed_raw_update(self.bot, update, **self.kwargs)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта %s", update.get("update_id"))
+            finally:
+                queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(update)
+
+    async def stop(self, timeout: Optional[float] = 10) -> None:
+        """Дожидается обработки уже принятых апдейтов и останавливает обработчики"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Принимает апдейт, ставит его в пул и сразу отвечает Telegram"""
+
+    def __init__(self, pool: UpdateWorkerPool, **kwargs: Any):
+        super().__init__(dispatcher=pool.dispatcher, bot=pool.bot, handle_in_background=True, **kwargs)
+        self.pool = pool
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.pool.submit(update):
+            # Telegram повторит доставку позже - так очередь не растет бесконечно
+            return web.Response(body="Too Many Requests", status=429)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    base_url: str,
+    path: str = "/webhook",
+    secret_token: Optional[str] = None,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    workers: int = 8,
+    queue_size: int = 100,
+    pool: Optional[UpdateWorkerPool] = None,
+) -> None:
+    # pool передается в шардированном режиме (ShardRouter), иначе апдейты обрабатываются здесь же
+    pool = pool or UpdateWorkerPool(dispatcher, bot, workers=workers, queue_size=queue_size)
+
+    app = web.Application()
+    QueuedRequestHandler(pool, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+
+    async def on_startup(app: web.Application) -> None:
+        pool.start()
+        await bot.set_webhook(
+            base_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+
+    async def on_shutdown(app: web.Application) -> None:
+        await pool.stop()
+
+    app.on_startup.insert(0, on_startup)
+    app.on_shutdown.insert(0, on_shutdown)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Вебхук слушает %s:%s%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,168 @@
+"""
+Групповая фиксация записей (включается DB_GROUP_COMMIT=1).
+
+Без нее каждое создание задачи, проекта или расхода - отдельная транзакция,
+а в SQLite каждая фиксация - отдельная запись WAL на диск. Писатель собирает
+операции из одновременно работающих обработчиков и выполняет их одной транзакцией
+раз в interval секунд или при накоплении max_batch операций. Обработчик получает
+результат только после фиксации транзакции, поэтому надежность та же.
+
+Изменения счетчиков (user_stats, period_rollups) внутри пакета не выполняются
+по одному UPDATE на операцию: они копятся (defer) и применяются в конце пакета
+несколькими запросами на все строки сразу.
+
+Если одна операция пакета падает, пакет откатывается и операции выполняются
+по одной: ошибку получает только обработчик, чья операция ее вызвала.
+"""
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Operation = Callable[[AsyncSession], Awaitable[T]]
+# {ключ строки: {поле: изменение}}
+Deltas = Dict[Tuple, Dict[str, float]]
+
+# Накопленные изменения счетчиков по таблицам, пока выполняются операции пакета
+_deferred: ContextVar[Optional[Dict[str, Deltas]]] = ContextVar("deferred_deltas", default=None)
+# Таблица -> функция, применяющая накопленные изменения в сессии пакета
+_appliers: Dict[str, Callable[[AsyncSession, Deltas], Awaitable[None]]] = {}
+
+def register_deferred(table: str, applier: Callable[[AsyncSession, Deltas], Awaitable[None]]) -> None:
+    _appliers[table] = applier
+
+def defer(table: str, key: Tuple, delta: Dict[str, float]) -> bool:
+    """Внутри пакета копит изменение счетчиков строки key и возвращает True, вне пакета - False"""
+    deltas = _deferred.get()
+    if deltas is None:
+        return False
+    row = deltas.setdefault(table, {}).setdefault(key, {})
+    for field, value in delta.items():
+        row[field] = row.get(field, 0) + value
+    return True
+
+class GroupCommitWriter:
+    """Выполняет операции записи пакетами в отдельной сессии, одна транзакция на пакет"""
+
+    def __init__(self, session_factory: Optional[async_sessionmaker] = None, interval: float = 0.005, max_batch: int = 100):
+        self.configure(session_factory, interval, max_batch)
+        self._pending: Deque[Tuple[Operation, asyncio.Future]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._busy = False
+        self.batches = 0
+        self.operations = 0
+        self.fallbacks = 0
+        self.max_batch_seen = 0
+
+    def configure(self, session_factory: Optional[async_sessionmaker], interval: float = 0.005, max_batch: int = 100) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        self.max_batch = max_batch
+
+    @property
+    def enabled(self) -> bool:
+        return self.session_factory is not None
+
+    async def run(self, operation: Operation) -> T:
+        """Ставит операцию в ближайший пакет и ждет фиксации ее транзакции"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        self._wakeup.set()
+        # shield: отмена обработчика не должна выбросить его операцию из уже собранного пакета
+        return await asyncio.shield(future)
+
+    async def _loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self._pending) < self.max_batch:
+                # Даем другим обработчикам добавить свои операции в этот же пакет
+                await asyncio.sleep(self.interval)
+            self._busy = True
+            try:
+                while self._pending:
+                    batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+                    await self._commit(batch)
+            finally:
+                self._busy = False
+
+    async def _commit(self, batch: List[Tuple[Operation, asyncio.Future]]) -> None:
+        try:
+            async with self.session_factory() as session:
+                deferred: Dict[str, Deltas] = {}
+                token = _deferred.set(deferred)
+                try:
+                    results = [await operation(session) for operation, _ in batch]
+                finally:
+                    _deferred.reset(token)
+                # Сначала вставки пакета: пересчет недостающих строк статистики должен их учитывать
+                await session.flush()
+                for table, deltas in deferred.items():
+                    await _appliers[table](session, deltas)
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                self._settle(batch[0][1], exception=e)
+                return
+            self.fallbacks += 1
+            logger.warning("Пакет из %s операций откатан, операции выполняются по одной", len(batch), exc_info=True)
+            for item in batch:
+                await self._commit([item])
+            return
+
+        self.batches += 1
+        self.operations += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for (_, future), result in zip(batch, results):
+            self._settle(future, result=result)
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "operations": self.operations,
+            "operations_per_batch": self.operations / self.batches if self.batches else 0,
+            "max_batch": self.max_batch_seen,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def close(self) -> None:
+        """Дожидается фиксации накопленных операций и останавливает писателя"""
+        while self._task is not None and not self._task.done() and (self._pending or self._busy):
+            await asyncio.sleep(self.interval)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+group_writer = GroupCommitWriter()
+
+async def write(db, operation: Operation) -> T:
+    """
+    Выполняет операцию записи и фиксирует ее.
+    С групповой фиксацией - в общем пакете писателя, иначе - в сессии обработчика.
+    """
+    if group_writer.enabled:
+        return await group_writer.run(operation)
+    result = await operation(db)
+    await db.commit()
+    return result